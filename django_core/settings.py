@@ -101,9 +101,28 @@ if not DEBUG:
             "PORT": os.environ["DATABASE_PORT"],
             "PASSWORD": os.environ["DATABASE_PASSWORD"],
             "OPTIONS": {"init_command": "SET sql_mode='STRICT_TRANS_TABLES'"},
+            # Connections are reused for this number of seconds, and checked before they are reused.
+            "CONN_MAX_AGE": int(os.environ.get("DATABASE_CONN_MAX_AGE", "60")),
+            "CONN_HEALTH_CHECKS": True,
         }
     }
 
+# Map popups are cached per parking lot, far more than the 300 entries the local memory cache holds by default.
+CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "OPTIONS": {"MAX_ENTRIES": 100_000}}}
+# Popups, the grid index and occupancy profiles are invalidated on writes, so all processes must share the cache.
+if CACHE_URL := os.environ.get("CACHE_URL"):
+    CACHES = {"default": {"BACKEND": "django.core.cache.backends.redis.RedisCache", "LOCATION": CACHE_URL}}
+# Client locations are cached in every process, and also in Redis, if configured, to share them between processes.
+CACHES["geolocation"] = {
+    "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    "LOCATION": "geolocation",
+    "OPTIONS": {"MAX_ENTRIES": int(os.environ.get("GEOLOCATION_CACHE_MAX_ENTRIES", "10000"))},
+}
+# Redis URL of the channel that spreads the occupancy changes to the map viewers of all processes, if enabled.
+PUSH_BROKER_URL = os.environ.get("PUSH_BROKER_URL", "")
+# Cache aliases that client locations are looked up in, from the fastest.
+GEOLOCATION_CACHES = ["geolocation", "default"] if CACHE_URL else ["geolocation"]
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -172,3 +191,35 @@ CELERY_TIMEZONE = TIME_ZONE
 CELERY_BEAT_SCHEDULER = "django_celery_beat.schedulers:DatabaseScheduler"
 CELERY_BROKER_URL = "redis://localhost"
 # CELERY_RESULT_BACKEND = CELERY_BROKER_URL
+
+# Directory of the local IP geolocation database built with `python manage.py build_geoip_database`.
+GEOIP_DATABASE = os.environ.get("GEOIP_DATABASE", "")
+# Provider that responds like ipinfo.io, asked in the background about the addresses missing from the database.
+# Set to an empty string to stay offline.
+GEOIP_REMOTE_URL = os.environ.get("GEOIP_REMOTE_URL", "https://ipinfo.io/{ip_address}/json")
+# Seconds to wait for the remote provider.
+GEOIP_REMOTE_TIMEOUT = float(os.environ.get("GEOIP_REMOTE_TIMEOUT", "3"))
+# Seconds to cache the located client addresses for, and the addresses that cannot be located.
+GEOLOCATION_CACHE_TIMEOUT = int(os.environ.get("GEOLOCATION_CACHE_TIMEOUT", str(24 * 60 * 60)))
+GEOLOCATION_NEGATIVE_CACHE_TIMEOUT = int(os.environ.get("GEOLOCATION_NEGATIVE_CACHE_TIMEOUT", str(10 * 60)))
+
+# Database connections, kept open in their own threads, of the async occupancy ingest view of every ASGI process.
+INGEST_DATABASE_CONNECTIONS = int(os.environ.get("INGEST_DATABASE_CONNECTIONS", "4"))
+
+# Raw occupancy records are kept for this number of hours even after they are aggregated.
+OCCUPANCY_RETENTION_HOURS = int(os.environ.get("OCCUPANCY_RETENTION_HOURS", "48"))
+# Maximum number of occupancy records deleted in one short transaction.
+OCCUPANCY_PURGE_BATCH_SIZE = int(os.environ.get("OCCUPANCY_PURGE_BATCH_SIZE", "5000"))
+# Store occupancy records in daily partitions and drop whole partitions on purge (MySQL only).
+OCCUPANCY_PARTITIONING = os.environ.get("OCCUPANCY_PARTITIONING", "false").lower() in {"1", "true", "yes", "on"}
+OCCUPANCY_PARTITIONS_AHEAD_DAYS = 7
+# Store a reading only when the occupancy of its parking lot changes, or `OCCUPANCY_KEEPALIVE_SECONDS` after the latest
+# stored reading. Keep it under an hour, so that every hour a camera reports in has a stored reading.
+OCCUPANCY_CHANGES_ONLY = os.environ.get("OCCUPANCY_CHANGES_ONLY", "false").lower() in {"1", "true", "yes", "on"}
+OCCUPANCY_KEEPALIVE_SECONDS = int(os.environ.get("OCCUPANCY_KEEPALIVE_SECONDS", "600"))
+# Buffer the ingested readings and save them in batches with the `Flush occupancy buffer` task (see `livemap.buffer`).
+OCCUPANCY_WRITE_BEHIND = os.environ.get("OCCUPANCY_WRITE_BEHIND", "false").lower() in {"1", "true", "yes", "on"}
+# Redis URL of the stream that buffers the readings of all processes, required by `OCCUPANCY_WRITE_BEHIND`.
+OCCUPANCY_BUFFER_URL = os.environ.get("OCCUPANCY_BUFFER_URL", CACHE_URL or "")
+# Maximum number of buffered readings saved with a single insert.
+OCCUPANCY_FLUSH_BATCH_SIZE = int(os.environ.get("OCCUPANCY_FLUSH_BATCH_SIZE", "5000"))
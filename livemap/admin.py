@@ -1,8 +1,19 @@
 from django.contrib import admin
 
-from livemap.models import Address, City, Country, Occupancy, ParkingLot, VideoStreamSource
+from livemap.models import (
+    Address,
+    AggregationWatermark,
+    City,
+    Country,
+    CurrentOccupancy,
+    Occupancy,
+    ParkingLot,
+    StreamWorker,
+    VideoStreamSource,
+)
 
 admin.site.register(Country)
+admin.site.register(AggregationWatermark)
 
 
 @admin.register(City)
@@ -17,7 +28,8 @@ class AddressAdmin(admin.ModelAdmin):
 
 @admin.register(ParkingLot)
 class ParkingLotAdmin(admin.ModelAdmin):
-    list_display = ("id", "latitude", "longitude", "total_spots", "address")
+    list_display = ("id", "latitude", "longitude", "total_spots", "free_spots", "address")
+    list_select_related = ("address__city__country", "current_occupancy")
 
 
 @admin.register(VideoStreamSource)
@@ -25,6 +37,11 @@ class VideoStreamSourceAdmin(admin.ModelAdmin):
     list_display = ("id", "stream_source", "is_active", "processing_rate", "parking_lot")
 
 
+@admin.register(StreamWorker)
+class StreamWorkerAdmin(admin.ModelAdmin):
+    list_display = ("id", "lease_owner", "capacity", "active_until")
+
+
 @admin.register(Occupancy)
 class OccupancyAdmin(admin.ModelAdmin):
     def time_seconds(self, occupancy: Occupancy) -> str:
@@ -34,3 +51,9 @@ class OccupancyAdmin(admin.ModelAdmin):
     time_seconds.short_description = "Timestamp"  # type: ignore[attr-defined]
 
     list_display = ("id", "occupied_spots", "time_seconds", "parking_lot")
+
+
+@admin.register(CurrentOccupancy)
+class CurrentOccupancyAdmin(admin.ModelAdmin):
+    list_display = ("parking_lot_id", "occupied_spots", "timestamp", "parking_lot")
+    list_select_related = ("parking_lot__address__city__country",)
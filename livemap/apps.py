@@ -1,6 +1,16 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
 
 
 class LivemapConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"  # pyright: ignore[reportAssignmentType]
     name = "livemap"
+
+    def ready(self) -> None:
+        from . import signals  # noqa: F401, PLC0415
+
+        # The readings buffered in a process would never be seen by the flushes of the Celery workers.
+        if settings.OCCUPANCY_WRITE_BEHIND and not settings.OCCUPANCY_BUFFER_URL:
+            msg = "OCCUPANCY_WRITE_BEHIND requires OCCUPANCY_BUFFER_URL or CACHE_URL to share the buffer with Celery"
+            raise ImproperlyConfigured(msg)
@@ -0,0 +1,72 @@
+"""Packing of video streams into the capacity of processing workers.
+
+A worker declares its capacity in frames per second, and a video stream processed once every `processing_rate`
+seconds costs `1 / processing_rate` of it. All the video streams of a parking lot are assigned to the same worker.
+"""
+
+from collections import defaultdict
+from collections.abc import Iterable
+
+# Absorbs floating point errors when the load of parking lots is summed up.
+LOAD_TOLERANCE = 1e-9
+
+
+def stream_load(processing_rate: int) -> float:
+    """Frames per second needed to process a video stream."""
+    return 1 / processing_rate
+
+
+def group_by_parking_lot(streams: Iterable[tuple[int, int, int]]) -> dict[int, list[tuple[int, float]]]:
+    """Group `(id, parking_lot_id, processing_rate)` tuples into `(id, load)` pairs by parking lot."""
+    parking_lots: dict[int, list[tuple[int, float]]] = defaultdict(list)
+    for stream_id, parking_lot_id, processing_rate in streams:
+        parking_lots[parking_lot_id].append((stream_id, stream_load(processing_rate)))
+    return parking_lots
+
+
+def parking_lot_load(streams: list[tuple[int, float]]) -> float:
+    return sum(load for _, load in streams)
+
+
+def pack_parking_lots(
+    streams: Iterable[tuple[int, int, int]], budget: float, limit: int, *, allow_overflow: bool = False
+) -> list[int]:
+    """Pick whole parking lots whose load fits in the `budget` and return the IDs of their video streams.
+
+    Parking lots are packed first-fit in decreasing order of load, and at most `limit` video streams are picked.
+    With `allow_overflow`, the lightest parking lot is picked if none fits, so that a parking lot which is heavier
+    than the capacity of any worker is still processed by an idle one.
+    """
+    parking_lots = group_by_parking_lot(streams)
+    loads = {parking_lot_id: parking_lot_load(lot_streams) for parking_lot_id, lot_streams in parking_lots.items()}
+    picked: list[int] = []
+    stream_count = 0
+    for parking_lot_id in sorted(loads, key=lambda parking_lot_id: (-loads[parking_lot_id], parking_lot_id)):
+        lot_stream_count = len(parking_lots[parking_lot_id])
+        if loads[parking_lot_id] <= budget + LOAD_TOLERANCE and stream_count + lot_stream_count <= limit:
+            picked.append(parking_lot_id)
+            budget -= loads[parking_lot_id]
+            stream_count += lot_stream_count
+
+    if not picked and allow_overflow:
+        fitting_lots = [parking_lot_id for parking_lot_id in loads if len(parking_lots[parking_lot_id]) <= limit]
+        if fitting_lots:
+            picked.append(min(fitting_lots, key=lambda parking_lot_id: (loads[parking_lot_id], parking_lot_id)))
+
+    return sorted(stream_id for parking_lot_id in picked for stream_id, _ in parking_lots[parking_lot_id])
+
+
+def shed_parking_lots(streams: Iterable[tuple[int, int, int]], excess: float) -> list[int]:
+    """Pick whole parking lots to give away so that the load drops by at most `excess`. Return their stream IDs.
+
+    Parking lots heavier than the remaining excess are kept, otherwise they would just overload another worker
+    and bounce back and forth between workers.
+    """
+    parking_lots = group_by_parking_lot(streams)
+    loads = {parking_lot_id: parking_lot_load(lot_streams) for parking_lot_id, lot_streams in parking_lots.items()}
+    shed: list[int] = []
+    for parking_lot_id in sorted(loads, key=lambda parking_lot_id: (-loads[parking_lot_id], parking_lot_id)):
+        if loads[parking_lot_id] <= excess + LOAD_TOLERANCE:
+            shed.append(parking_lot_id)
+            excess -= loads[parking_lot_id]
+    return sorted(stream_id for parking_lot_id in shed for stream_id, _ in parking_lots[parking_lot_id])
@@ -0,0 +1,187 @@
+"""Write-behind buffer of the occupancy readings.
+
+With `OCCUPANCY_WRITE_BEHIND`, the ingest endpoints append the validated readings to the buffer and respond at once, and
+the `Flush occupancy buffer` task saves them in large batches. With `OCCUPANCY_BUFFER_URL`, the buffer is a Redis stream
+shared by all processes and read through a consumer group: the readings are removed only after their batch is
+committed, and the batches of a failed flush are claimed again by a later one. The app does not start with
+`OCCUPANCY_WRITE_BEHIND` but without a buffer URL. Tests override the URL to use a queue of the process instead.
+
+A reading may thus be delivered more than once. A redelivered reading has the same parking lot and timestamp as its
+saved copy, so it is skipped. The readings of a request get distinct timestamps, so they are not taken for copies.
+
+The readings are saved up to `MAX_FLUSH_LAG` after they arrive, so the hourly aggregation waits that long before
+closing an hour.
+"""
+
+import itertools
+import json
+import os
+import socket
+import threading
+from collections import deque
+from collections.abc import Iterable
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Any
+
+import redis
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Occupancy, ParkingLot
+from .versions import bump_model_versions
+
+OCCUPANCY_STREAM = "livemap:occupancy-buffer"
+FLUSH_GROUP = "occupancy-flush"
+# Readings delivered to a flush that has not acknowledged them for this number of milliseconds are delivered again.
+CLAIM_IDLE_MILLISECONDS = 60_000
+# The readings of a failed flush are claimed by the next flush after `CLAIM_IDLE_MILLISECONDS`, with a margin for the
+# flush schedule.
+MAX_FLUSH_LAG = 2 * timedelta(milliseconds=CLAIM_IDLE_MILLISECONDS)
+
+type Entry = tuple[str, dict[str, Any]]
+
+
+class LocalBuffer:
+    """Readings queued in the process. The read and unacknowledged ones are read again before the new ones."""
+
+    def __init__(self) -> None:
+        self._entries: deque[Entry] = deque()
+        self._unacknowledged: dict[str, dict[str, Any]] = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    def append(self, readings: Iterable[dict[str, Any]]) -> None:
+        with self._lock:
+            self._entries.extend((str(next(self._ids)), reading) for reading in readings)
+
+    def read(self, count: int) -> list[Entry]:
+        with self._lock:
+            entries = list(itertools.islice(self._unacknowledged.items(), count))
+            while len(entries) < count and self._entries:
+                entry_id, reading = self._entries.popleft()
+                self._unacknowledged[entry_id] = reading
+                entries.append((entry_id, reading))
+            return entries
+
+    def acknowledge(self, entry_ids: Iterable[str]) -> None:
+        with self._lock:
+            for entry_id in entry_ids:
+                self._unacknowledged.pop(entry_id, None)
+
+
+class RedisBuffer:
+    """Readings in a Redis stream, read by the consumer group of the flushes."""
+
+    def __init__(self, url: str) -> None:
+        self._client = redis.Redis.from_url(url)
+        self._consumer = f"{socket.gethostname()}-{os.getpid()}"
+        self._group_created = False
+
+    def append(self, readings: Iterable[dict[str, Any]]) -> None:
+        pipeline = self._client.pipeline(transaction=False)
+        for reading in readings:
+            pipeline.xadd(OCCUPANCY_STREAM, {"reading": json.dumps(reading)})
+        pipeline.execute()
+
+    def read(self, count: int) -> list[Entry]:
+        self._create_group()
+        # The readings of a failed flush first, then the new ones.
+        _, messages, _ = self._client.xautoclaim(
+            OCCUPANCY_STREAM, FLUSH_GROUP, self._consumer, CLAIM_IDLE_MILLISECONDS, count=count
+        )
+        if len(messages) < count:
+            streams = self._client.xreadgroup(
+                FLUSH_GROUP, self._consumer, {OCCUPANCY_STREAM: ">"}, count=count - len(messages)
+            )
+            messages = [*messages, *(streams[0][1] if streams else [])]
+        # Redis 6 claims the entries deleted since their delivery without their fields.
+        return [(entry_id.decode(), json.loads(fields[b"reading"])) for entry_id, fields in messages if fields]
+
+    def acknowledge(self, entry_ids: Iterable[str]) -> None:
+        entry_ids = list(entry_ids)
+        if not entry_ids:
+            return
+        pipeline = self._client.pipeline(transaction=False)
+        pipeline.xack(OCCUPANCY_STREAM, FLUSH_GROUP, *entry_ids)
+        pipeline.xdel(OCCUPANCY_STREAM, *entry_ids)
+        pipeline.execute()
+
+    def _create_group(self) -> None:
+        if self._group_created:
+            return
+        try:
+            self._client.xgroup_create(OCCUPANCY_STREAM, FLUSH_GROUP, id="0", mkstream=True)
+        except redis.ResponseError as error:
+            if "BUSYGROUP" not in str(error):
+                raise
+        self._group_created = True
+
+
+_local_buffer = LocalBuffer()
+
+
+@lru_cache(maxsize=1)
+def _redis_buffer(url: str) -> RedisBuffer:
+    return RedisBuffer(url)
+
+
+def occupancy_buffer() -> LocalBuffer | RedisBuffer:
+    return _redis_buffer(settings.OCCUPANCY_BUFFER_URL) if settings.OCCUPANCY_BUFFER_URL else _local_buffer
+
+
+def buffer_readings(readings: Iterable[dict[str, Any]]) -> None:
+    """Append the validated readings of existing parking lots to the buffer, stamped with the current time.
+
+    The readings are a microsecond apart in their order, like the readings saved at once one after another.
+    """
+    now = timezone.now()
+    occupancy_buffer().append(
+        {
+            "parking_lot_id": reading["parking_lot_id"],
+            "occupied_spots": reading["occupied_spots"],
+            "timestamp": (now + timedelta(microseconds=index)).isoformat(),
+        }
+        for index, reading in enumerate(readings)
+    )
+
+
+def _save_batch(readings: list[dict[str, Any]]) -> int:
+    # The readings of a parking lot with the same timestamp are copies, of which the last one is kept.
+    occupancies = {
+        (reading["parking_lot_id"], datetime.fromisoformat(reading["timestamp"])): reading["occupied_spots"]
+        for reading in readings
+    }
+    parking_lot_ids = {parking_lot_id for parking_lot_id, _ in occupancies}
+    timestamps = [timestamp for _, timestamp in occupancies]
+    # The parking lots may have been deleted since the readings were buffered.
+    existing_ids = set(ParkingLot.objects.filter(id__in=parking_lot_ids).values_list("id", flat=True))
+    saved = set(
+        Occupancy.objects.filter(
+            parking_lot_id__in=existing_ids, timestamp__gte=min(timestamps), timestamp__lte=max(timestamps)
+        ).values_list("parking_lot_id", "timestamp")
+    )
+    created = Occupancy.objects.ingest(
+        [
+            Occupancy(parking_lot_id=parking_lot_id, occupied_spots=occupied_spots, timestamp=timestamp)
+            for (parking_lot_id, timestamp), occupied_spots in occupancies.items()
+            if parking_lot_id in existing_ids and (parking_lot_id, timestamp) not in saved
+        ]
+    )
+    if created:
+        bump_model_versions(Occupancy)
+    return len(created)
+
+
+def flush(batch_size: int) -> dict[str, int]:
+    """Save the buffered readings in batches of up to `batch_size`, until less than a full batch is left."""
+    read = saved = batches = 0
+    buffer = occupancy_buffer()
+    while entries := buffer.read(batch_size):
+        saved += _save_batch([reading for _, reading in entries])
+        buffer.acknowledge(entry_id for entry_id, _ in entries)
+        read += len(entries)
+        batches += 1
+        if len(entries) < batch_size:
+            break
+    return {"read": read, "saved": saved, "batches": batches}
@@ -0,0 +1,171 @@
+"""Parking lots and their clusters within a map viewport, from a grid index cached between requests.
+
+The index holds the coordinates and spots of all parking lots as NumPy arrays along with their clusters at every
+zoom level: the parking lots are grouped by the cells of a grid whose cells are `CLUSTER_CELL_PIXELS` wide at that
+zoom. A viewport is then served by filtering a few arrays instead of querying and grouping the parking lots.
+"""
+
+from typing import Any, NamedTuple
+
+import numpy as np
+from django.core.cache import cache
+
+from .markers import cached_popups
+from .models import ParkingLot
+
+TILE_PIXELS = 256
+CLUSTER_CELL_PIXELS = 64
+# Parking lots are always clustered up to this zoom level.
+CLUSTER_MAX_ZOOM = 15
+MAX_ZOOM = 22
+# Coarser clusters are returned when the viewport holds more features at the requested zoom.
+MAX_FEATURES = 500
+GRID_INDEX_CACHE_KEY = "parking_lot_grid_index"
+# Changed parking lots invalidate the index, while their free spots may be outdated by this number of seconds.
+GRID_INDEX_CACHE_TIMEOUT = 60
+# Offset that keeps the cell numbers positive, so that a row and a column are packed into a single integer.
+CELL_OFFSET = 1 << 24
+
+
+class Clusters(NamedTuple):
+    latitudes: np.ndarray
+    longitudes: np.ndarray
+    parking_lots: np.ndarray
+    total_spots: np.ndarray
+    free_spots: np.ndarray
+    # The first parking lot of every cluster, which stands for the clusters of a single parking lot.
+    first_parking_lots: np.ndarray
+
+
+class GridIndex(NamedTuple):
+    ids: np.ndarray
+    latitudes: np.ndarray
+    longitudes: np.ndarray
+    total_spots: np.ndarray
+    # `NaN` for the parking lots without occupancy readings.
+    free_spots: np.ndarray
+    clusters_by_zoom: list[Clusters]
+
+
+def cell_degrees(zoom: int) -> float:
+    """The size of a grid cell in degrees at the `zoom` level."""
+    return 360 / 2**zoom * CLUSTER_CELL_PIXELS / TILE_PIXELS
+
+
+def _cluster(
+    latitudes: np.ndarray, longitudes: np.ndarray, total_spots: np.ndarray, free_spots: np.ndarray, zoom: int
+) -> Clusters:
+    size = cell_degrees(zoom)
+    rows = np.floor(latitudes / size).astype(np.int64) + CELL_OFFSET
+    columns = np.floor(longitudes / size).astype(np.int64) + CELL_OFFSET
+    _, first_parking_lots, cells, parking_lots = np.unique(
+        rows * 2 * CELL_OFFSET + columns, return_index=True, return_inverse=True, return_counts=True
+    )
+    return Clusters(
+        latitudes=np.bincount(cells, weights=latitudes) / parking_lots,
+        longitudes=np.bincount(cells, weights=longitudes) / parking_lots,
+        parking_lots=parking_lots,
+        total_spots=np.bincount(cells, weights=total_spots),
+        free_spots=np.bincount(cells, weights=np.nan_to_num(free_spots)),
+        first_parking_lots=first_parking_lots,
+    )
+
+
+def build_grid_index() -> GridIndex:
+    rows = (
+        ParkingLot.objects.filter(latitude__isnull=False, longitude__isnull=False)
+        .order_by("id")
+        .values_list("id", "latitude", "longitude", "total_spots", "current_occupancy__occupied_spots")
+    )
+    ids, latitudes, longitudes, total_spots, occupied_spots = zip(*rows, strict=True) if rows else ((), (), (), (), ())
+    latitudes = np.array(latitudes, dtype=np.float64)
+    longitudes = np.array(longitudes, dtype=np.float64)
+    total_spots = np.array(total_spots, dtype=np.float64)
+    free_spots = np.clip(total_spots - np.array(occupied_spots, dtype=np.float64), 0, None)
+    return GridIndex(
+        ids=np.array(ids, dtype=np.int64),
+        latitudes=latitudes,
+        longitudes=longitudes,
+        total_spots=total_spots,
+        free_spots=free_spots,
+        clusters_by_zoom=[
+            _cluster(latitudes, longitudes, total_spots, free_spots, zoom) for zoom in range(CLUSTER_MAX_ZOOM + 1)
+        ],
+    )
+
+
+def grid_index() -> GridIndex:
+    if (index := cache.get(GRID_INDEX_CACHE_KEY)) is None:
+        index = build_grid_index()
+        cache.set(GRID_INDEX_CACHE_KEY, index, GRID_INDEX_CACHE_TIMEOUT)
+    return index
+
+
+def invalidate_grid_index() -> None:
+    cache.delete(GRID_INDEX_CACHE_KEY)
+
+
+def in_bbox(latitudes: np.ndarray, longitudes: np.ndarray, bbox: tuple[float, float, float, float]) -> np.ndarray:
+    """Mask of the points within the `(west, south, east, north)` box, which crosses the antimeridian if west > east."""
+    west, south, east, north = bbox
+    within_latitudes = (latitudes >= south) & (latitudes <= north)
+    if west <= east:
+        return within_latitudes & (longitudes >= west) & (longitudes <= east)
+    return within_latitudes & ((longitudes >= west) | (longitudes <= east))
+
+
+def _point(longitude: float, latitude: float) -> dict[str, Any]:
+    return {"type": "Point", "coordinates": [round(float(longitude), 6), round(float(latitude), 6)]}
+
+
+def _parking_lot_features(index: GridIndex, positions: np.ndarray) -> list[dict[str, Any]]:
+    popups = cached_popups(index.ids[positions].tolist())
+    return [
+        {
+            "type": "Feature",
+            "id": int(index.ids[position]),
+            "geometry": _point(index.longitudes[position], index.latitudes[position]),
+            "properties": {
+                "parking_lot_id": int(index.ids[position]),
+                "total_spots": int(index.total_spots[position]),
+                "free_spots": None if np.isnan(free_spots := index.free_spots[position]) else int(free_spots),
+                "popup": popups.get(int(index.ids[position]), ""),
+            },
+        }
+        for position in positions
+    ]
+
+
+def map_features(bbox: tuple[float, float, float, float], zoom: int) -> dict[str, Any]:
+    """A GeoJSON feature collection of the parking lots within the `bbox`, clustered up to the `CLUSTER_MAX_ZOOM`.
+
+    Clusters of a single parking lot are returned as the parking lot. The number of features never exceeds
+    `MAX_FEATURES`: denser viewports get the clusters of a lower zoom level.
+    """
+    index = grid_index()
+    if zoom > CLUSTER_MAX_ZOOM:
+        positions = np.flatnonzero(in_bbox(index.latitudes, index.longitudes, bbox))
+        if len(positions) <= MAX_FEATURES:
+            return {"type": "FeatureCollection", "features": _parking_lot_features(index, positions)}
+
+    for cluster_zoom in range(min(zoom, CLUSTER_MAX_ZOOM), -1, -1):
+        clusters = index.clusters_by_zoom[cluster_zoom]
+        cluster_positions = np.flatnonzero(in_bbox(clusters.latitudes, clusters.longitudes, bbox))
+        if len(cluster_positions) <= MAX_FEATURES:
+            break
+    single = clusters.parking_lots[cluster_positions] == 1
+    features = _parking_lot_features(index, clusters.first_parking_lots[cluster_positions[single]])
+    features.extend(
+        {
+            "type": "Feature",
+            "geometry": _point(clusters.longitudes[position], clusters.latitudes[position]),
+            "properties": {
+                "cluster": True,
+                "parking_lots": int(clusters.parking_lots[position]),
+                "total_spots": int(clusters.total_spots[position]),
+                "free_spots": int(clusters.free_spots[position]),
+            },
+        }
+        for position in cluster_positions[~single]
+    )
+    return {"type": "FeatureCollection", "features": features}
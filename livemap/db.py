@@ -0,0 +1,24 @@
+from collections.abc import Iterable, Sequence
+
+from django.db import connections, models
+
+
+def bulk_upsert[M: models.Model](
+    model: type[M],
+    objs: Iterable[M],
+    unique_fields: Sequence[str],
+    update_fields: Sequence[str],
+    batch_size: int | None = None,
+) -> list[M]:
+    """Insert `objs` or update `update_fields` of the rows that already exist by `unique_fields`.
+
+    MySQL does not accept an explicit conflict target and relies on the unique indexes of the table instead.
+    """
+    connection = connections[model.objects.db]
+    return model.objects.bulk_create(
+        objs,
+        batch_size=batch_size,
+        update_conflicts=True,
+        unique_fields=unique_fields if connection.features.supports_update_conflicts_with_target else None,
+        update_fields=update_fields,
+    )
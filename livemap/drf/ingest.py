@@ -0,0 +1,132 @@
+"""Ingestion of occupancy readings, shared by the bulk endpoint and the async ingest view.
+
+The async view serves many concurrent camera uploads in a single ASGI process: the request is parsed, the token is
+verified and the readings are validated in the event loop, and only the database work of a request runs in one of
+`INGEST_DATABASE_CONNECTIONS` threads. Like in the request handlers, the connection of every thread is closed before
+and after every job if it is unusable or older than `CONN_MAX_AGE`, so it is reused between the requests until then.
+"""
+
+import asyncio
+import json
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import HttpRequest, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from rest_framework import status
+from rest_framework.exceptions import APIException, NotAuthenticated, ParseError, ValidationError
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.tokens import Token
+
+from livemap.buffer import buffer_readings
+from livemap.models import Occupancy
+from livemap.versions import bump_model_versions
+
+from .serializers import PARKING_LOT_NOT_FOUND_ERROR, OccupancyBulkItemSerializer, filter_existing_parking_lot_ids
+
+BULK_MAX_ITEMS = 1000
+
+_database_threads = ThreadPoolExecutor(
+    max_workers=settings.INGEST_DATABASE_CONNECTIONS, thread_name_prefix="occupancy-ingest"
+)
+
+
+def validate_readings(readings: Any) -> tuple[dict[int, dict[str, Any]], list[dict[str, Any]]]:
+    """The valid readings by their indexes and the errors of the invalid ones. The batch itself must be a list."""
+    if not isinstance(readings, list):
+        raise ValidationError({"non_field_errors": ["Expected a list of occupancy readings."]})
+    if len(readings) > BULK_MAX_ITEMS:
+        raise ValidationError({"non_field_errors": [f"Up to {BULK_MAX_ITEMS} readings are allowed per request."]})
+
+    errors: list[dict[str, Any]] = []
+    valid_readings: dict[int, dict[str, Any]] = {}
+    for index, reading in enumerate(readings):
+        serializer = OccupancyBulkItemSerializer(data=reading)
+        if serializer.is_valid():
+            valid_readings[index] = serializer.validated_data
+        else:
+            errors.append({"index": index, "errors": serializer.errors})
+    return valid_readings, errors
+
+
+def save_readings(
+    valid_readings: dict[int, dict[str, Any]], errors: list[dict[str, Any]]
+) -> tuple[list[dict[str, Any]], list[dict[str, Any]]]:
+    """Save or buffer the readings of the existing parking lots. Return them and all the errors sorted by the index."""
+    # Validate all the parking lots of the batch with a single query.
+    existing_ids = filter_existing_parking_lot_ids({reading["parking_lot_id"] for reading in valid_readings.values()})
+    accepted = []
+    errors = list(errors)
+    for index, reading in valid_readings.items():
+        if reading["parking_lot_id"] in existing_ids:
+            accepted.append(reading)
+        else:
+            parking_lot_error = PARKING_LOT_NOT_FOUND_ERROR.format(parking_lot_id=reading["parking_lot_id"])
+            errors.append({"index": index, "errors": {"parking_lot_id": [parking_lot_error]}})
+    errors.sort(key=lambda error: error["index"])
+
+    if settings.OCCUPANCY_WRITE_BEHIND:
+        buffer_readings(accepted)
+        return accepted, errors
+    # The bulk insert sends no `post_save` signals.
+    if Occupancy.objects.ingest([Occupancy(**reading) for reading in accepted]):
+        bump_model_versions(Occupancy)
+    return accepted, errors
+
+
+def ingestion_status(accepted: list[dict[str, Any]], errors: list[dict[str, Any]]) -> int:
+    if not errors:
+        # The buffered readings are saved later.
+        return status.HTTP_202_ACCEPTED if settings.OCCUPANCY_WRITE_BEHIND else status.HTTP_201_CREATED
+    if accepted:
+        return status.HTTP_207_MULTI_STATUS
+    return status.HTTP_400_BAD_REQUEST
+
+
+def _database_job(function: Callable[..., Any], *args: Any) -> Any:
+    # The `request_started` and `request_finished` signals do the same for the connections of the request threads.
+    close_old_connections()
+    try:
+        return function(*args)
+    finally:
+        close_old_connections()
+
+
+def _authenticate_and_save(
+    authentication: JWTAuthentication, token: Token, valid_readings: dict[int, dict[str, Any]], errors: list
+) -> tuple[list[dict[str, Any]], list[dict[str, Any]]]:
+    # The user is looked up along with the readings, to wait for a database thread once per request.
+    authentication.get_user(token)
+    return save_readings(valid_readings, errors)
+
+
+@csrf_exempt
+@require_POST
+async def ingest_occupancy(request: HttpRequest) -> JsonResponse:
+    """Save a reading or a list of up to `BULK_MAX_ITEMS` readings like the bulk endpoint, without holding a thread."""
+    authentication = JWTAuthentication()
+    try:
+        header = authentication.get_header(request)  # pyright: ignore[reportArgumentType]
+        if header is None or (raw_token := authentication.get_raw_token(header)) is None:
+            raise NotAuthenticated
+        token = authentication.get_validated_token(raw_token)
+        try:
+            readings = json.loads(request.body)
+        except ValueError as error:
+            raise ParseError(f"JSON parse error - {error}") from error
+        valid_readings, errors = validate_readings(readings if isinstance(readings, list) else [readings])
+        loop = asyncio.get_running_loop()
+        accepted, errors = await loop.run_in_executor(
+            _database_threads, _database_job, _authenticate_and_save, authentication, token, valid_readings, errors
+        )
+    except APIException as error:
+        detail = error.detail if isinstance(error.detail, dict | list) else {"detail": error.detail}
+        response = JsonResponse(detail, status=error.status_code, safe=False)
+        if error.status_code == status.HTTP_401_UNAUTHORIZED:
+            response.headers["WWW-Authenticate"] = authentication.authenticate_header(request)  # pyright: ignore[reportArgumentType]
+        return response
+    return JsonResponse({"created": len(accepted), "errors": errors}, status=ingestion_status(accepted, errors))
@@ -0,0 +1,143 @@
+import json
+from types import SimpleNamespace
+from typing import Any
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Model, Q, QuerySet
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination
+from rest_framework.request import Request
+from rest_framework.response import Response
+
+COUNT_PARAM = "count"
+
+
+class KeysetPagination(CursorPagination):
+    """Cursor pagination that seeks to the exact position of the last row of the previous page.
+
+    `CursorPagination` positions the cursor on the first ordering field and skips the rows that share its value with
+    an offset. Here the cursor holds the values of all the ordering fields, which must identify a row uniquely,
+    so a deep page costs as much as the first one. The total count is only calculated on request.
+    """
+
+    ordering: tuple[str, ...] = ("id",)
+    page_size_query_param = "limit"
+    max_page_size = 1000
+
+    def paginate_queryset(self, queryset: QuerySet, request: Request, view: Any = None) -> list[Any] | None:  # noqa: ARG002
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.fields = [queryset.model._meta.get_field(field.lstrip("-")) for field in self.ordering]  # noqa: SLF001
+        self.cursor = self.decode_cursor(request)
+        reverse = bool(self.cursor and self.cursor.reverse)
+        self.count = queryset.count() if request.query_params.get(COUNT_PARAM) in {"true", "1"} else None
+
+        ordering = [self._reverse(field) if reverse else field for field in self.ordering]
+        queryset = queryset.order_by(*ordering)
+        if self.cursor:
+            queryset = queryset.filter(self._seek(ordering, self._decode_position(self.cursor.position)))
+
+        results = list(queryset[: self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[: self.page_size]
+        if reverse:
+            self.page.reverse()
+        # A page reached backwards always has a next page and the other way round.
+        self.has_next = has_more if not reverse else True
+        self.has_previous = has_more if reverse else self.cursor is not None
+        return self.page
+
+    def paginate_list(self, results: list[Any], request: Request) -> list[Any]:
+        """Serve the `results` as the only page."""
+        self.request, self.page, self.count = request, results, len(results)
+        self.has_next = self.has_previous = False
+        return results
+
+    @staticmethod
+    def _reverse(field: str) -> str:
+        return field[1:] if field.startswith("-") else f"-{field}"
+
+    @staticmethod
+    def _seek(ordering: list[str], position: list[Any]) -> Q:
+        """Rows after the `position` in the `ordering`: `(a > x) OR (a = x AND b > y)` and so on.
+
+        The redundant `a >= x` bound lets the database start an index range scan at the position.
+        """
+        condition = Q()
+        for index, field in enumerate(ordering):
+            name, lookup = (field[1:], "lt") if field.startswith("-") else (field, "gt")
+            preceding = {
+                preceding_field.lstrip("-"): value
+                for preceding_field, value in zip(ordering[:index], position[:index], strict=True)
+            }
+            condition |= Q(**preceding, **{f"{name}__{lookup}": position[index]})
+        first_name, first_lookup = (ordering[0][1:], "lte") if ordering[0].startswith("-") else (ordering[0], "gte")
+        return Q(**{f"{first_name}__{first_lookup}": position[0]}) & condition
+
+    def _encode_position(self, row: Model | dict[str, Any]) -> str:
+        # The rows of `values()` querysets are dictionaries keyed by the attribute names.
+        row_object = SimpleNamespace(**row) if isinstance(row, dict) else row
+        return json.dumps([field.value_to_string(row_object) for field in self.fields])
+
+    def _decode_position(self, position: str | None) -> list[Any]:
+        try:
+            values = json.loads(position or "")
+        except ValueError as error:
+            raise NotFound(self.invalid_cursor_message) from error
+        if not isinstance(values, list) or len(values) != len(self.fields):
+            raise NotFound(self.invalid_cursor_message)
+        try:
+            return [field.to_python(value) for field, value in zip(self.fields, values, strict=True)]
+        except (TypeError, ValueError, DjangoValidationError) as error:
+            raise NotFound(self.invalid_cursor_message) from error
+
+    def _link(self, row: Model | dict[str, Any], *, reverse: bool) -> str:
+        return self.encode_cursor(Cursor(offset=0, reverse=reverse, position=self._encode_position(row)))
+
+    def get_next_link(self) -> str | None:
+        if not self.has_next or not self.page:
+            return None
+        return self._link(self.page[-1], reverse=False)
+
+    def get_previous_link(self) -> str | None:
+        if not self.has_previous or not self.page:
+            return None
+        return self._link(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data: Any) -> Response:
+        response = {"next": self.get_next_link(), "previous": self.get_previous_link()}
+        if self.count is not None:
+            response["count"] = self.count
+        return Response({**response, "results": data})
+
+    def get_paginated_response_schema(self, schema: dict[str, Any]) -> dict[str, Any]:
+        paginated_schema = super().get_paginated_response_schema(schema)
+        paginated_schema["properties"] = {
+            "count": {"type": "integer", "example": 123},
+            **paginated_schema["properties"],
+        }
+        return paginated_schema
+
+    def get_schema_operation_parameters(self, view: Any) -> list[dict[str, Any]]:
+        return [
+            *super().get_schema_operation_parameters(view),
+            {
+                "name": COUNT_PARAM,
+                "required": False,
+                "in": "query",
+                "description": "Set to `true` to include the total number of results, which is not counted by default.",
+                "schema": {"type": "boolean"},
+            },
+        ]
+
+
+class OccupancyPagination(KeysetPagination):
+    ordering = ("-timestamp", "-id")
+
+
+class CurrentOccupancyPagination(KeysetPagination):
+    ordering = ("parking_lot",)
@@ -1,16 +1,50 @@
-from typing import Any, ClassVar
+from datetime import datetime
+from typing import Any
 
+from django.utils import timezone
 from rest_framework import serializers
 
-from livemap.models import Occupancy, ParkingLot, VideoStreamSource
+from livemap.clusters import MAX_ZOOM
+from livemap.geo import MAX_LATITUDE, MAX_LONGITUDE
+from livemap.models import CurrentOccupancy, Occupancy, ParkingLot, StreamWorker, VideoStreamSource
+from livemap.series import BUCKETS
+
+# The values read for the lightweight serializers of the lists.
+PARKING_LOT_ROW_FIELDS = (
+    "id",
+    "address__parking_lot_address",
+    "address__city__city_name",
+    "address__city__country__country_name",
+)
+STREAM_ROW_FIELDS = (
+    "parking_lot_id",
+    "processing_rate",
+    "id",
+    "stream_source",
+    "in_use_until",
+    "lease_owner",
+    "is_active",
+)
+OCCUPANCY_ROW_FIELDS = ("id", "parking_lot_id", "occupied_spots", "timestamp")
+PARKING_LOT_NOT_FOUND_ERROR = "No parking lot found for the provided ID {parking_lot_id}"
+SERIES_MAX_BUCKETS = 10_000
+NEAREST_MAX_LIMIT = 50
+NEAREST_MAX_RADIUS = 50_000
 
 
 def validate_parking_lot_id(parking_lot_id: int | None) -> int | None:
-    if parking_lot_id and not ParkingLot.objects.filter(id=parking_lot_id).first():
-        raise serializers.ValidationError(f"No parking lot found for the provided ID {parking_lot_id}")
+    if parking_lot_id and not ParkingLot.objects.filter(id=parking_lot_id).exists():
+        raise serializers.ValidationError(PARKING_LOT_NOT_FOUND_ERROR.format(parking_lot_id=parking_lot_id))
     return parking_lot_id
 
 
+def filter_existing_parking_lot_ids(parking_lot_ids: set[int]) -> set[int]:
+    """Return the subset of `parking_lot_ids` that exist, using a single query."""
+    if not parking_lot_ids:
+        return set()
+    return set(ParkingLot.objects.filter(id__in=parking_lot_ids).values_list("id", flat=True))
+
+
 class VideoStreamSourceSerializer(serializers.ModelSerializer):
     parking_lot_address = serializers.CharField(source="parking_lot.address", read_only=True)
     parking_lot_id = serializers.IntegerField(
@@ -27,8 +61,10 @@ class VideoStreamSourceSerializer(serializers.ModelSerializer):
             "processing_rate",
             "stream_source",
             "in_use_until",
+            "lease_owner",
             "is_active",
         )
+        read_only_fields = ("lease_owner",)
 
     def validate(self, attrs: dict[str, Any]) -> dict[str, Any]:
         if attrs.get("processing_rate") and not attrs.get("parking_lot_id"):
@@ -63,20 +99,79 @@ class VideoStreamSourceSerializer(serializers.ModelSerializer):
         return super().update(instance, validated_data)
 
 
-class StreamSerializerSchema(serializers.ModelSerializer):
-    class Meta:  # pyright: ignore[reportIncompatibleVariableOverride]
-        model = VideoStreamSource
-        fields = ("id", "stream_source", "in_use_until", "is_active")
-        read_only_fields = ("in_use_until",)
+class StreamSerializer(serializers.Serializer):
+    """A listed video stream from a row of the `STREAM_ROW_FIELDS` values, without model instances."""
 
+    id = serializers.IntegerField(read_only=True)
+    stream_source = serializers.URLField(read_only=True)
+    in_use_until = serializers.DateTimeField(read_only=True)
+    lease_owner = serializers.CharField(read_only=True)
+    is_active = serializers.BooleanField(read_only=True)
 
-class VideoStreamSourceSerializerSchema(VideoStreamSourceSerializer):
-    streams = StreamSerializerSchema(read_only=True)
+    def to_representation(self, row: tuple[Any, ...]) -> dict[str, Any]:  # pyright: ignore[reportIncompatibleMethodOverride]
+        stream_id, stream_source, in_use_until, lease_owner, is_active = row
+        return {
+            "id": stream_id,
+            "stream_source": stream_source,
+            "in_use_until": self.fields["in_use_until"].to_representation(in_use_until),
+            "lease_owner": lease_owner,
+            "is_active": is_active,
+        }
+
+
+class ParkingLotStreamsSerializer(serializers.Serializer):
+    """Video streams of a parking lot from a `(parking_lot_id, address, stream rows)` tuple.
+
+    The stream rows hold the `STREAM_ROW_FIELDS` values, led by the processing rate.
+    """
+
+    parking_lot_address = serializers.CharField(read_only=True)
+    parking_lot_id = serializers.IntegerField(read_only=True)
+    processing_rate = serializers.IntegerField(
+        read_only=True,
+        help_text=VideoStreamSource.processing_rate.field.help_text,  # pyright: ignore[reportAttributeAccessIssue]
+    )
+    streams = StreamSerializer(many=True, read_only=True)
+
+    def to_representation(self, row: tuple[int, str, list[tuple[Any, ...]]]) -> dict[str, Any]:  # pyright: ignore[reportIncompatibleMethodOverride]
+        parking_lot_id, address, streams = row
+        return {
+            "parking_lot_address": address,
+            "parking_lot_id": parking_lot_id,
+            "processing_rate": streams[0][0],
+            "streams": self.fields["streams"].to_representation([stream[1:] for stream in streams]),
+        }
+
+
+class VideoStreamLeaseReleaseSerializer(serializers.Serializer):
+    lease_owner = serializers.CharField(
+        max_length=64, help_text="Identifier of the client that reserved the video streams."
+    )
+    ids = serializers.ListField(
+        child=serializers.IntegerField(),
+        required=False,
+        max_length=1000,
+        help_text="IDs of the video streams. All the video streams reserved by the `lease_owner` by default.",
+    )
 
-    class Meta:  # pyright: ignore[reportIncompatibleVariableOverride]
-        model = VideoStreamSource
-        fields = ("parking_lot_address", "parking_lot_id", "processing_rate", "streams")
-        extra_kwargs: ClassVar = {"stream_source": {"write_only": True}, "is_active": {"write_only": True}}
+
+class VideoStreamLeaseRenewalSerializer(VideoStreamLeaseReleaseSerializer):
+    in_use_until = serializers.DateTimeField(help_text=VideoStreamSource.in_use_until.field.help_text)
+    capacity = serializers.FloatField(
+        required=False,
+        help_text=f"{StreamWorker.capacity.field.help_text} Parking lots beyond the fair share of the worker are "
+        "released so that other workers can take them over.",
+    )
+
+    def validate_in_use_until(self, in_use_until: datetime) -> datetime:
+        if in_use_until <= timezone.now():
+            raise serializers.ValidationError("Must be in the future")
+        return in_use_until
+
+    def validate_capacity(self, capacity: float) -> float:
+        if capacity <= 0:
+            raise serializers.ValidationError("Must be greater than zero")
+        return capacity
 
 
 class OccupancySerializer(serializers.ModelSerializer):
@@ -88,3 +183,128 @@ class OccupancySerializer(serializers.ModelSerializer):
     class Meta:  # pyright: ignore[reportIncompatibleVariableOverride]
         model = Occupancy
         fields = ("id", "parking_lot_id", "occupied_spots", "timestamp")
+
+
+class OccupancyRowSerializer(serializers.Serializer):
+    """A listed reading from the `OCCUPANCY_ROW_FIELDS` values, without model instances."""
+
+    id = serializers.IntegerField(read_only=True)
+    parking_lot_id = serializers.IntegerField(read_only=True)
+    occupied_spots = serializers.IntegerField(read_only=True)
+    timestamp = serializers.DateTimeField(read_only=True)
+
+    def to_representation(self, row: dict[str, Any]) -> dict[str, Any]:  # pyright: ignore[reportIncompatibleMethodOverride]
+        return {**row, "timestamp": self.fields["timestamp"].to_representation(row["timestamp"])}
+
+
+class OccupancyBulkItemSerializer(serializers.ModelSerializer):
+    """A single reading of a bulk request.
+
+    The parking lot existence is checked for the whole batch at once, so no per-item validator is attached here.
+    """
+
+    parking_lot_id = serializers.IntegerField(help_text="ID of an existing parking lot.")
+
+    class Meta:  # pyright: ignore[reportIncompatibleVariableOverride]
+        model = Occupancy
+        fields = ("parking_lot_id", "occupied_spots")
+
+
+class CurrentOccupancySerializer(serializers.ModelSerializer):
+    parking_lot_id = serializers.IntegerField(read_only=True)
+    free_spots = serializers.IntegerField(source="parking_lot.free_spots", read_only=True)
+
+    class Meta:  # pyright: ignore[reportIncompatibleVariableOverride]
+        model = CurrentOccupancy
+        fields = ("parking_lot_id", "occupied_spots", "free_spots", "timestamp")
+
+
+class OccupancySeriesQuerySerializer(serializers.Serializer):
+    """Query parameters of the occupancy time series. Exactly one of the parking lot, city and country is required."""
+
+    parking_lot_id = serializers.IntegerField(required=False)
+    city_id = serializers.IntegerField(required=False)
+    country_id = serializers.IntegerField(required=False)
+    to = serializers.DateTimeField(required=False, help_text="The end of the series. Now by default.")
+    bucket = serializers.ChoiceField(choices=list(BUCKETS), default="hour")
+
+    def get_fields(self) -> dict[str, serializers.Field]:
+        fields = super().get_fields()
+        # `from` is a reserved word, so the field cannot be declared as a class attribute.
+        fields["from"] = serializers.DateTimeField(help_text="The start of the series.")
+        return fields
+
+    def validate(self, attrs: dict[str, Any]) -> dict[str, Any]:
+        area_fields = [field for field in ("parking_lot_id", "city_id", "country_id") if field in attrs]
+        if len(area_fields) != 1:
+            raise serializers.ValidationError(
+                {"non_field_errors": ["Exactly one of `parking_lot_id`, `city_id` and `country_id` is required"]}
+            )
+        attrs.setdefault("to", timezone.now())
+        if attrs["from"] >= attrs["to"]:
+            raise serializers.ValidationError({"from": ["Must be earlier than `to`"]})
+        if (attrs["to"] - attrs["from"]) / BUCKETS[attrs["bucket"]] > SERIES_MAX_BUCKETS:
+            raise serializers.ValidationError(
+                {"bucket": [f"The range must not exceed {SERIES_MAX_BUCKETS} buckets, use a larger bucket"]}
+            )
+        return attrs
+
+
+class OccupancySeriesPointSerializer(serializers.Serializer):
+    timestamp = serializers.DateTimeField(help_text="The start of the bucket.")
+    avg_occupied_spots = serializers.FloatField()
+
+
+class ParkingLotGeoJsonQuerySerializer(serializers.Serializer):
+    """Query parameters of the parking lots within a map viewport."""
+
+    bbox = serializers.CharField(
+        help_text="`west,south,east,north` in degrees. West is greater than east across the antimeridian."
+    )
+    zoom = serializers.IntegerField(min_value=0, max_value=MAX_ZOOM)
+
+    def validate_bbox(self, value: str) -> tuple[float, float, float, float]:
+        try:
+            west, south, east, north = (float(coordinate) for coordinate in value.split(","))
+        except ValueError as error:
+            raise serializers.ValidationError("Must be four comma-separated numbers: west,south,east,north") from error
+        if not (-MAX_LONGITUDE <= west <= MAX_LONGITUDE and -MAX_LONGITUDE <= east <= MAX_LONGITUDE):
+            raise serializers.ValidationError(f"Longitudes must be between {-MAX_LONGITUDE} and {MAX_LONGITUDE}")
+        if not -MAX_LATITUDE <= south <= north <= MAX_LATITUDE:
+            raise serializers.ValidationError(
+                f"Latitudes must be between {-MAX_LATITUDE} and {MAX_LATITUDE}, and south must not exceed north"
+            )
+        return west, south, east, north
+
+
+class NearestParkingLotsQuerySerializer(serializers.Serializer):
+    """Query parameters of the search for the nearest parking lots."""
+
+    latitude = serializers.FloatField(min_value=-MAX_LATITUDE, max_value=MAX_LATITUDE)
+    longitude = serializers.FloatField(min_value=-MAX_LONGITUDE, max_value=MAX_LONGITUDE)
+    limit = serializers.IntegerField(min_value=1, max_value=NEAREST_MAX_LIMIT, default=5)
+    radius = serializers.FloatField(
+        min_value=1, max_value=NEAREST_MAX_RADIUS, default=NEAREST_MAX_RADIUS, help_text="Search radius in meters."
+    )
+    min_free_spots = serializers.IntegerField(
+        min_value=0, default=0, help_text="Parking lots without occupancy readings are skipped if greater than 0."
+    )
+
+
+class NearestParkingLotSerializer(serializers.ModelSerializer):
+    parking_lot_id = serializers.IntegerField(source="id", read_only=True)
+    parking_lot_address = serializers.CharField(source="address", read_only=True)
+    free_spots = serializers.IntegerField(read_only=True, allow_null=True)
+    distance = serializers.FloatField(read_only=True, help_text="Distance in meters.")
+
+    class Meta:  # pyright: ignore[reportIncompatibleVariableOverride]
+        model = ParkingLot
+        fields = (
+            "parking_lot_id",
+            "parking_lot_address",
+            "latitude",
+            "longitude",
+            "total_spots",
+            "free_spots",
+            "distance",
+        )
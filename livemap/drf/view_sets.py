@@ -2,70 +2,172 @@ from collections import defaultdict
 from datetime import UTC, datetime, timedelta
 from typing import Any, cast
 
-from django.db.models import Q, QuerySet
+from django.conf import settings
+from django.utils.decorators import method_decorator
 from drf_spectacular.types import OpenApiTypes
 from drf_spectacular.utils import OpenApiExample, OpenApiParameter, extend_schema
-from rest_framework import viewsets
+from rest_framework import status, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
+from rest_framework.permissions import AllowAny
 from rest_framework.request import Request
+from rest_framework.response import Response
 from rest_framework.serializers import ValidationError
 
-from livemap.models import Occupancy, VideoStreamSource
+from livemap.clusters import CLUSTER_MAX_ZOOM, MAX_FEATURES, map_features
+from livemap.models import (
+    Address,
+    CurrentOccupancy,
+    Occupancy,
+    ParkingLot,
+    StreamWorker,
+    VideoStreamSource,
+    VideoStreamSourceQuerySet,
+)
+from livemap.profiles import cached_profile
+from livemap.series import occupancy_series
+from livemap.versions import conditional
 
-from .serializers import OccupancySerializer, VideoStreamSourceSerializer, VideoStreamSourceSerializerSchema
+from .ingest import BULK_MAX_ITEMS, ingestion_status, save_readings, validate_readings
+from .pagination import CurrentOccupancyPagination, KeysetPagination, OccupancyPagination
+from .serializers import (
+    OCCUPANCY_ROW_FIELDS,
+    PARKING_LOT_ROW_FIELDS,
+    STREAM_ROW_FIELDS,
+    CurrentOccupancySerializer,
+    NearestParkingLotSerializer,
+    NearestParkingLotsQuerySerializer,
+    OccupancyBulkItemSerializer,
+    OccupancyRowSerializer,
+    OccupancySerializer,
+    OccupancySeriesPointSerializer,
+    OccupancySeriesQuerySerializer,
+    ParkingLotGeoJsonQuerySerializer,
+    ParkingLotStreamsSerializer,
+    VideoStreamLeaseReleaseSerializer,
+    VideoStreamLeaseRenewalSerializer,
+    VideoStreamSourceSerializer,
+)
 
 ACTIVE_ONLY_PARAM = "active_only"
 MARK_IN_USE_UNTIL_PARAM = "mark_in_use_until"
+LEASE_OWNER_PARAM = "lease_owner"
+CAPACITY_PARAM = "capacity"
+PARKING_LOT_ID_PARAM = "parking_lot_id"
+SELECT_RELATED = ("parking_lot__address", "parking_lot__address__city", "parking_lot__address__city__country")
 
 
-class VideoStreamSourceViewSet(viewsets.ModelViewSet):
-    queryset = VideoStreamSource.objects.all().select_related(
-        "parking_lot__address", "parking_lot__address__city", "parking_lot__address__city__country"
+class ParkingLotViewSet(viewsets.GenericViewSet):
+    queryset = ParkingLot.objects.all()
+
+    @extend_schema(
+        parameters=[ParkingLotGeoJsonQuerySerializer],
+        responses=OpenApiTypes.OBJECT,
+        description=(
+            "A GeoJSON feature collection of the parking lots within the bounding box. Up to zoom level "
+            f"{CLUSTER_MAX_ZOOM} the parking lots are grouped into clusters with the number of parking lots, total "
+            f"and free spots, and at most {MAX_FEATURES} features are returned at any zoom level. Free spots may be "
+            "outdated by a minute."
+        ),
+    )
+    @action(detail=False, methods=["get"], pagination_class=None, permission_classes=[AllowAny])
+    def geojson(self, request: Request) -> Response:
+        query_serializer = ParkingLotGeoJsonQuerySerializer(data=request.query_params)
+        query_serializer.is_valid(raise_exception=True)
+        return Response(map_features(query_serializer.validated_data["bbox"], query_serializer.validated_data["zoom"]))
+
+    @extend_schema(
+        parameters=[NearestParkingLotsQuerySerializer],
+        responses=NearestParkingLotSerializer(many=True),
+        description=(
+            "The parking lots closest to a point, nearest first, optionally only those with enough free spots. "
+            "The parking lots are found by the grid cells around the point, without scanning all of them."
+        ),
     )
+    @action(detail=False, methods=["get"], pagination_class=None, permission_classes=[AllowAny])
+    def nearest(self, request: Request) -> Response:
+        query_serializer = NearestParkingLotsQuerySerializer(data=request.query_params)
+        query_serializer.is_valid(raise_exception=True)
+        query = query_serializer.validated_data
+        parking_lots = ParkingLot.objects.select_related("address__city__country", "current_occupancy")
+        if query["min_free_spots"]:
+            parking_lots = parking_lots.with_free_spots(query["min_free_spots"])
+        nearest = parking_lots.nearest(query["latitude"], query["longitude"], query["limit"], query["radius"])
+        return Response(NearestParkingLotSerializer(nearest, many=True).data)
+
+
+def _parking_lot_streams(
+    parking_lots: list[tuple[Any, ...]], streams: VideoStreamSourceQuerySet
+) -> list[tuple[int, str, list[tuple[Any, ...]]]]:
+    """The rows of `ParkingLotStreamsSerializer` for the `PARKING_LOT_ROW_FIELDS` rows of the parking lots.
+
+    The address is formatted once per parking lot, and the video streams are read with a single query.
+    """
+    stream_rows: dict[int, list[tuple[Any, ...]]] = defaultdict(list)
+    for parking_lot_id, *stream in (
+        streams.select_related(None)
+        .filter(parking_lot_id__in=[parking_lot_id for parking_lot_id, *_ in parking_lots])
+        .order_by("id")
+        .values_list(*STREAM_ROW_FIELDS)
+    ):
+        stream_rows[parking_lot_id].append(tuple(stream))
+    return [
+        (parking_lot_id, Address.format(*address), stream_rows[parking_lot_id])
+        for parking_lot_id, *address in parking_lots
+    ]
+
+
+class VideoStreamSourceViewSet(viewsets.ModelViewSet):
+    queryset = VideoStreamSource.objects.all().select_related(*SELECT_RELATED)
     serializer_class = VideoStreamSourceSerializer
+    pagination_class = KeysetPagination
 
-    def get_queryset(self) -> QuerySet[VideoStreamSource, VideoStreamSource]:  # pyright: ignore[reportIncompatibleMethodOverride]
+    def get_queryset(self) -> VideoStreamSourceQuerySet:  # pyright: ignore[reportIncompatibleMethodOverride]
         queryset = self.queryset
         active_only = self.request.query_params.get(ACTIVE_ONLY_PARAM)  # pyright: ignore[reportAttributeAccessIssue]
         if active_only:
             queryset = queryset.filter(is_active=True)
 
         if MARK_IN_USE_UNTIL_PARAM in self.request.query_params:  # pyright: ignore[reportAttributeAccessIssue]
-            now = datetime.now(UTC)
-            # Find all the items whose `in_use_until` field is either `null` or has an expired date and time.
-            queryset = queryset.filter(Q(in_use_until__isnull=True) | Q(in_use_until__lt=now))
+            queryset = queryset.not_in_use()
 
         return queryset
 
-    def filter_out_used_streams(
-        self, paginated_queryset: list[VideoStreamSource], in_use_until_datetime_string: str
-    ) -> list[VideoStreamSource]:
+    def claim_streams(
+        self, queryset: VideoStreamSourceQuerySet, in_use_until_datetime_string: str
+    ) -> list[tuple[int, str, list[tuple[Any, ...]]]]:
+        """Reserve a page of free video streams and return the parking lots of the ones reserved by this request."""
         try:
-            # 0) Validate the incoming ISO-8601 string.
+            # Validate the incoming ISO-8601 string.
             in_use_until = datetime.fromisoformat(in_use_until_datetime_string)
         except ValueError as error:
             raise ValidationError({MARK_IN_USE_UNTIL_PARAM: "Must be a valid ISO 8601 datetime string"}) from error
 
-        now = datetime.now(UTC)
-        # 1) Find all the items whose `in_use_until` field is either `None` or has an expired date and time.
-        candidates = [
-            video_stream
-            for video_stream in paginated_queryset
-            if (video_stream.in_use_until is None) or (video_stream.in_use_until < now)
-        ]
+        capacity = None
+        if capacity_string := self.request.query_params.get(CAPACITY_PARAM):  # pyright: ignore[reportAttributeAccessIssue]
+            try:
+                capacity = float(capacity_string)
+            except ValueError as error:
+                raise ValidationError({CAPACITY_PARAM: "Must be a number"}) from error
+            if not capacity > 0:
+                raise ValidationError({CAPACITY_PARAM: "Must be greater than zero"})
 
-        ids_to_update = []
-        for candidate in candidates:
-            # 2) Capture their PKs (so we know exactly which ones).
-            ids_to_update.append(candidate.pk)
-            candidate.in_use_until = in_use_until
+        lease_owner = self.request.query_params.get(LEASE_OWNER_PARAM)  # pyright: ignore[reportAttributeAccessIssue]
+        if capacity is not None and not lease_owner:
+            # A generated lease owner is not returned, so the worker could not renew its streams.
+            raise ValidationError({LEASE_OWNER_PARAM: f"Required along with `{CAPACITY_PARAM}`"})
 
-        # 3) Bulk-update just those rows.
-        self.queryset.filter(pk__in=ids_to_update).update(in_use_until=in_use_until)
+        paginator = cast("KeysetPagination", self.paginator)
+        limit = cast("int", paginator.get_page_size(self.request))
+        claimed_ids = queryset.claim(in_use_until, limit=limit, lease_owner=lease_owner, capacity=capacity)
+        claimed = VideoStreamSource.objects.filter(id__in=claimed_ids)
+        parking_lots = list(claimed.parking_lots().values_list(*PARKING_LOT_ROW_FIELDS))
 
-        return candidates
+        # Streams reserved by concurrent requests are not returned, so there are no other pages.
+        return _parking_lot_streams(paginator.paginate_list(parking_lots, self.request), claimed)
 
     @extend_schema(
-        responses=VideoStreamSourceSerializerSchema,
+        responses=ParkingLotStreamsSerializer(many=True),
         parameters=[
             OpenApiParameter(
                 ACTIVE_ONLY_PARAM,
@@ -75,53 +177,165 @@ class VideoStreamSourceViewSet(viewsets.ModelViewSet):
             OpenApiParameter(
                 MARK_IN_USE_UNTIL_PARAM,
                 type=OpenApiTypes.DATETIME,
-                description=VideoStreamSource.in_use_until.field.help_text,
+                description=f"{VideoStreamSource.in_use_until.field.help_text} Reserves up to `limit` free "
+                "video streams atomically and returns only the reserved ones. `cursor` is ignored.",
                 examples=[OpenApiExample((datetime.now(UTC) + timedelta(minutes=5)).isoformat())],
             ),
+            OpenApiParameter(
+                LEASE_OWNER_PARAM,
+                type=OpenApiTypes.STR,
+                description=f"Used along with `{MARK_IN_USE_UNTIL_PARAM}`. Identifier of the worker that reserves "
+                "the video streams to renew or release them later. Generated if not provided, unless "
+                f"`{CAPACITY_PARAM}` is.",
+            ),
+            OpenApiParameter(
+                CAPACITY_PARAM,
+                type=OpenApiTypes.FLOAT,
+                description=f"Used along with `{MARK_IN_USE_UNTIL_PARAM}` and requires `{LEASE_OWNER_PARAM}`. "
+                f"{StreamWorker.capacity.field.help_text} A video stream costs `1 / processing_rate` of it. Whole "
+                "parking lots are reserved until the capacity left by the already reserved streams is filled.",
+            ),
         ],
     )
-    def list(self, request: Request, *args: Any, **kwargs: Any) -> dict[str, Any]:  # noqa: ARG002
-        # There may be several CCTV cameras in one parking lot.
-        # The code below groups parking lots by video streams.
-        queryset = self.filter_queryset(self.get_queryset())
-        paginated_queryset = cast("list[VideoStreamSource]", self.paginate_queryset(queryset))
+    def list(self, request: Request, *args: Any, **kwargs: Any) -> Response:  # noqa: ARG002
+        # There may be several CCTV cameras in one parking lot, so whole parking lots are paginated.
         if in_use_until_datetime_string := request.query_params.get(MARK_IN_USE_UNTIL_PARAM):
-            paginated_queryset = self.filter_out_used_streams(paginated_queryset, in_use_until_datetime_string)
-            self.paginator.count = len(paginated_queryset)  # pyright: ignore[reportOptionalMemberAccess]
-        serializer = self.get_serializer(paginated_queryset, many=True)
-        video_streams = serializer.data
-        stream_details = defaultdict(list)
-
-        for stream in video_streams:
-            stream_details[stream["parking_lot_id"]].append(
-                {
-                    "id": stream["id"],
-                    "stream_source": stream["stream_source"],
-                    "is_active": stream["is_active"],
-                    "in_use_until": stream.get("in_use_until"),
-                }
-            )
-
-        grouped_video_streams = []
-        for video_stream in video_streams:
-            try:
-                grouped_video_streams.append(
-                    {
-                        "parking_lot_address": video_stream["parking_lot_address"],
-                        "parking_lot_id": video_stream["parking_lot_id"],
-                        "processing_rate": video_stream["processing_rate"],
-                        "streams": stream_details.pop(video_stream["parking_lot_id"]),
-                    }
-                )
-            except KeyError:
-                # The `KeyError` is expected because there are might be duplicates in the `video_streams`.
-                continue
+            queryset = self.filter_queryset(self.get_queryset())
+            parking_lots = self.claim_streams(queryset, in_use_until_datetime_string)
+            return self.get_paginated_response(ParkingLotStreamsSerializer(parking_lots, many=True).data)
+        return self._list_parking_lots(request)
+
+    # Claims change the video streams, so only plain listings are answered with 304 Not Modified.
+    @method_decorator(conditional(ParkingLot, VideoStreamSource))
+    def _list_parking_lots(self, request: Request) -> Response:  # noqa: ARG002
+        queryset = self.filter_queryset(self.get_queryset())
+        parking_lots = self.paginate_queryset(queryset.parking_lots().values(*PARKING_LOT_ROW_FIELDS))
+        rows = [tuple(parking_lot.values()) for parking_lot in cast("list[dict[str, Any]]", parking_lots)]
+        serializer = ParkingLotStreamsSerializer(_parking_lot_streams(rows, queryset), many=True)
+        return self.get_paginated_response(serializer.data)
+
+    def _leased_streams(self, lease_serializer: VideoStreamLeaseReleaseSerializer) -> VideoStreamSourceQuerySet:
+        lease_serializer.is_valid(raise_exception=True)
+        streams = VideoStreamSource.objects.all()
+        if (ids := lease_serializer.validated_data.get("ids")) is not None:
+            streams = streams.filter(id__in=ids)
+        return streams
+
+    @extend_schema(request=VideoStreamLeaseRenewalSerializer, responses=OpenApiTypes.OBJECT)
+    @action(detail=False, methods=["post"])
+    def renew(self, request: Request) -> Response:
+        """Extend the reservations of a worker with a single update. Expired reservations have to be claimed again.
+
+        With `capacity`, the parking lots that the worker holds beyond its fair share are released and listed.
+        """
+        lease_serializer = VideoStreamLeaseRenewalSerializer(data=request.data)
+        streams = self._leased_streams(lease_serializer)
+        lease_owner = lease_serializer.validated_data["lease_owner"]
+        in_use_until = lease_serializer.validated_data["in_use_until"]
+        renewed = streams.renew(lease_owner, in_use_until)
+        if (capacity := lease_serializer.validated_data.get("capacity")) is None:
+            return Response({"renewed": renewed})
+
+        released = VideoStreamSource.objects.filter(is_active=True).rebalance(lease_owner, capacity, in_use_until)
+        return Response({"renewed": renewed, "released": released})
 
-        return self.get_paginated_response(grouped_video_streams)
+    @extend_schema(request=VideoStreamLeaseReleaseSerializer, responses=OpenApiTypes.OBJECT)
+    @action(detail=False, methods=["post"])
+    def release(self, request: Request) -> Response:
+        """Make the video streams reserved by a worker available to other workers right away."""
+        lease_serializer = VideoStreamLeaseReleaseSerializer(data=request.data)
+        streams = self._leased_streams(lease_serializer)
+        lease_owner = lease_serializer.validated_data["lease_owner"]
+        released = streams.release(lease_owner)
+        if "ids" not in lease_serializer.validated_data:
+            # The worker leaves, so its fair share goes to the other workers.
+            StreamWorker.objects.filter(lease_owner=lease_owner).delete()
+        return Response({"released": released})
 
 
+@method_decorator(conditional(Occupancy), name="list")
 class OccupancyViewSet(viewsets.ModelViewSet):
-    queryset = Occupancy.objects.all().select_related(
-        "parking_lot__address", "parking_lot__address__city", "parking_lot__address__city__country"
-    )
+    queryset = Occupancy.objects.all()
     serializer_class = OccupancySerializer
+    pagination_class = OccupancyPagination
+
+    def list(self, request: Request, *args: Any, **kwargs: Any) -> Response:  # noqa: ARG002
+        # The readings are listed from plain values, without building model instances.
+        readings = self.paginate_queryset(self.filter_queryset(self.get_queryset()).values(*OCCUPANCY_ROW_FIELDS))
+        return self.get_paginated_response(OccupancyRowSerializer(readings, many=True).data)
+
+    @extend_schema(
+        request=OccupancyBulkItemSerializer(many=True),
+        responses={
+            status.HTTP_201_CREATED: OpenApiTypes.OBJECT,
+            status.HTTP_202_ACCEPTED: OpenApiTypes.OBJECT,
+            status.HTTP_207_MULTI_STATUS: OpenApiTypes.OBJECT,
+            status.HTTP_400_BAD_REQUEST: OpenApiTypes.OBJECT,
+        },
+        description=(
+            f"Create up to {BULK_MAX_ITEMS} occupancy readings at once. Valid readings are saved "
+            "even if some other readings are rejected; errors are reported per item index. "
+            "With the write-behind buffer enabled, they are saved shortly after the 202 response."
+        ),
+    )
+    @action(detail=False, methods=["post"])
+    def bulk(self, request: Request) -> Response:
+        valid_readings, errors = validate_readings(request.data)
+        accepted, errors = save_readings(valid_readings, errors)
+        return Response({"created": len(accepted), "errors": errors}, status=ingestion_status(accepted, errors))
+
+    @extend_schema(
+        parameters=[OccupancySeriesQuerySerializer],
+        responses=OccupancySeriesPointSerializer(many=True),
+        description=(
+            "Average occupied spots of a parking lot, city or country per bucket. Closed hours are read from the "
+            "hourly summaries and the latest hours from the raw readings. Minute buckets are only available for the "
+            f"raw readings, which are kept for {settings.OCCUPANCY_RETENTION_HOURS} hours."
+        ),
+    )
+    @action(detail=False, methods=["get"], pagination_class=None)
+    def series(self, request: Request) -> Response:
+        query_serializer = OccupancySeriesQuerySerializer(data=request.query_params)
+        query_serializer.is_valid(raise_exception=True)
+        query = query_serializer.validated_data
+        if "parking_lot_id" in query:
+            parking_lots = ParkingLot.objects.filter(id=query["parking_lot_id"])
+        elif "city_id" in query:
+            parking_lots = ParkingLot.objects.filter(address__city_id=query["city_id"])
+        else:
+            parking_lots = ParkingLot.objects.filter(address__city__country_id=query["country_id"])
+        series = occupancy_series(parking_lots.values("id"), query["from"], query["to"], query["bucket"])
+        return Response(series)
+
+    @extend_schema(
+        parameters=[OpenApiParameter(PARKING_LOT_ID_PARAM, type=OpenApiTypes.INT, required=True)],
+        responses=OpenApiTypes.OBJECT,
+    )
+    @action(detail=False, methods=["get"], pagination_class=None)
+    def profile(self, request: Request) -> Response:
+        """Typical occupancy of a parking lot per hour of the week (0 is Monday 00:00 UTC) and a short-term forecast.
+
+        Profiles are rebuilt periodically from the hourly summaries and served from the cache.
+        """
+        try:
+            parking_lot_id = int(request.query_params[PARKING_LOT_ID_PARAM])
+        except (KeyError, ValueError) as error:
+            raise ValidationError({PARKING_LOT_ID_PARAM: "A valid integer is required"}) from error
+        if (profile := cached_profile(parking_lot_id)) is None:
+            raise NotFound(f"No occupancy profile found for the parking lot {parking_lot_id}")
+        return Response(profile)
+
+    @extend_schema(responses=CurrentOccupancySerializer(many=True))
+    @action(
+        detail=False,
+        methods=["get"],
+        serializer_class=CurrentOccupancySerializer,
+        pagination_class=CurrentOccupancyPagination,
+    )
+    @method_decorator(conditional(CurrentOccupancy, ParkingLot))
+    def current(self, request: Request) -> Response:  # noqa: ARG002
+        """The latest occupancy of every parking lot, without scanning the occupancy history."""
+        queryset = CurrentOccupancy.objects.select_related("parking_lot")
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
@@ -0,0 +1,76 @@
+"""Distances on the Earth and the grid cells of parking lots, for proximity searches without a spatial extension.
+
+The grid cell of a point is `row * GRID_COLUMNS + column`, where the row and the column count cells of
+`1 / GRID_CELLS_PER_DEGREE` degrees from the south pole and the antimeridian. The cells of a row are consecutive
+numbers, so the cells around a point are a few ranges of an indexed integer column.
+"""
+
+import math
+
+EARTH_RADIUS = 6_371_008.8
+MAX_LATITUDE = 90
+MAX_LONGITUDE = 180
+GRID_CELLS_PER_DEGREE = 20
+GRID_COLUMNS = 2 * MAX_LONGITUDE * GRID_CELLS_PER_DEGREE
+GRID_ROWS = 2 * MAX_LATITUDE * GRID_CELLS_PER_DEGREE
+
+
+def distance(latitude: float, longitude: float, other_latitude: float, other_longitude: float) -> float:
+    """Great-circle distance between two points in meters."""
+    latitude, longitude, other_latitude, other_longitude = map(
+        math.radians, (latitude, longitude, other_latitude, other_longitude)
+    )
+    haversine = (
+        math.sin((other_latitude - latitude) / 2) ** 2
+        + math.cos(latitude) * math.cos(other_latitude) * math.sin((other_longitude - longitude) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS * math.asin(min(math.sqrt(haversine), 1))
+
+
+def _merge(ranges: list[tuple[int, int]]) -> list[tuple[int, int]]:
+    merged: list[tuple[int, int]] = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def grid_cell_ranges(latitude: float, longitude: float, radius: float) -> list[tuple[int, int]]:
+    """Inclusive ranges of the grid cells that cover the circle of `radius` meters around the point.
+
+    The ranges are widened by a cell on every side, so that it does not matter whether the database rounds or
+    truncates the cell numbers of the parking lots.
+    """
+    angular_radius = radius / EARTH_RADIUS
+    south = math.degrees(math.radians(latitude) - angular_radius)
+    north = math.degrees(math.radians(latitude) + angular_radius)
+    first_row = max(math.floor((south + MAX_LATITUDE) * GRID_CELLS_PER_DEGREE) - 1, 0)
+    last_row = min(math.floor((north + MAX_LATITUDE) * GRID_CELLS_PER_DEGREE) + 1, GRID_ROWS)
+
+    # The widest longitude span of the circle, unless the circle covers a pole.
+    spread = math.sin(angular_radius) / math.cos(math.radians(latitude)) if abs(latitude) < MAX_LATITUDE else 2
+    if south <= -MAX_LATITUDE or north >= MAX_LATITUDE or spread >= 1:
+        column_ranges = [(0, GRID_COLUMNS - 1)]
+    else:
+        longitude_delta = math.degrees(math.asin(spread))
+        first_column = math.floor((longitude - longitude_delta + MAX_LONGITUDE) * GRID_CELLS_PER_DEGREE) - 1
+        last_column = math.floor((longitude + longitude_delta + MAX_LONGITUDE) * GRID_CELLS_PER_DEGREE) + 1
+        if last_column - first_column >= GRID_COLUMNS - 1:
+            column_ranges = [(0, GRID_COLUMNS - 1)]
+        elif first_column < 0:
+            # Across the antimeridian.
+            column_ranges = [(0, last_column), (first_column + GRID_COLUMNS, GRID_COLUMNS - 1)]
+        elif last_column >= GRID_COLUMNS:
+            column_ranges = [(first_column, GRID_COLUMNS - 1), (0, last_column - GRID_COLUMNS)]
+        else:
+            column_ranges = [(first_column, last_column)]
+
+    return _merge(
+        [
+            (row * GRID_COLUMNS + first_column, row * GRID_COLUMNS + last_column)
+            for row in range(first_row, last_row + 1)
+            for first_column, last_column in column_ranges
+        ]
+    )
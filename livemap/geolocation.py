@@ -0,0 +1,217 @@
+"""Coordinates of client IP addresses from a local IP range database, with an optional remote fallback.
+
+The database is a directory of NumPy arrays built from a CSV file of IP ranges with the `build_geoip_database`
+command. The arrays are sorted by the first address of every range and memory-mapped, so that all processes share
+them and an address is found with a binary search. IPv6 ranges are matched by the first 64 bits of the addresses.
+
+Addresses that are not in the database are looked up remotely in a background thread, and are located from the
+cache on the next requests, so a slow provider never holds up a request.
+
+Located addresses, and for a shorter time the addresses that cannot be located, are cached in the tiers of
+`GEOLOCATION_CACHES`: a bounded local memory cache of the process and the shared Redis cache, if configured.
+"""
+
+import csv
+import ipaddress
+import logging
+import threading
+from collections import Counter
+from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from http import HTTPStatus
+from pathlib import Path
+
+import numpy as np
+import requests  # type: ignore[import]
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+DATABASE_COLUMNS = ("first", "last", "coordinates")
+DATABASE_FILE = "ipv{version}_{column}.npy"
+GEOLOCATION_CACHE_KEY = "geolocation:{ip_address}"
+# Cached in place of the coordinates of the addresses that cannot be located.
+NOT_FOUND = ()
+# An address is looked up remotely at most once per this number of seconds.
+REMOTE_LOOKUP_CACHE_KEY = "remote_geolocation_lookup:{ip_address}"
+REMOTE_LOOKUP_INTERVAL = 5 * 60
+NUMBER_OF_COORDINATES = 2
+IPV4 = 4
+IPV6 = 6
+# IPv6 ranges are matched by this number of the first bits of the addresses.
+IPV6_PREFIX_BITS = 64
+# The cache statistics are logged once per this number of lookups.
+STATISTICS_LOG_INTERVAL = 1000
+
+_remote_lookups = ThreadPoolExecutor(max_workers=2, thread_name_prefix="remote-geolocation")
+_statistics: Counter[tuple[str, str]] = Counter()
+_statistics_lock = threading.Lock()
+
+
+def range_key(address: ipaddress.IPv4Address | ipaddress.IPv6Address) -> tuple[int, int]:
+    """The IP version of the address and the number it is searched by in the ranges of that version."""
+    if isinstance(address, ipaddress.IPv6Address) and address.ipv4_mapped:
+        address = address.ipv4_mapped
+    if address.version == IPV4:
+        return IPV4, int(address)
+    return IPV6, int(address) >> (ipaddress.IPV6LENGTH - IPV6_PREFIX_BITS)
+
+
+def read_ranges(csv_path: Path) -> Iterable[tuple[str, str, float, float]]:
+    """`(first address, last address, latitude, longitude)` of the ranges of a DB-IP "IP to City Lite" CSV file.
+
+    The first two columns of every row are the addresses and the last two are the coordinates.
+    """
+    with csv_path.open(newline="", encoding="utf-8") as csv_file:
+        for row in csv.reader(csv_file):
+            yield row[0], row[1], float(row[-2]), float(row[-1])
+
+
+def build_database(ranges: Iterable[tuple[str, str, float, float]], directory: Path) -> dict[int, int]:
+    """Save the IP ranges as the arrays of the database in the `directory`. Return the number of ranges by version."""
+    keys: dict[int, list[tuple[int, int]]] = {IPV4: [], IPV6: []}
+    coordinates: dict[int, list[tuple[float, float]]] = {IPV4: [], IPV6: []}
+    for first, last, latitude, longitude in ranges:
+        version, first_key = range_key(ipaddress.ip_address(first))
+        _, last_key = range_key(ipaddress.ip_address(last))
+        keys[version].append((first_key, last_key))
+        coordinates[version].append((latitude, longitude))
+
+    directory.mkdir(parents=True, exist_ok=True)
+    for version, version_ranges in keys.items():
+        version_keys = np.array(version_ranges, dtype=np.uint64).reshape(-1, 2)
+        order = np.argsort(version_keys[:, 0], kind="stable")
+        columns = {
+            "first": version_keys[order, 0],
+            "last": version_keys[order, 1],
+            "coordinates": np.array(coordinates[version], dtype=np.float32).reshape(-1, 2)[order],
+        }
+        for column, values in columns.items():
+            np.save(directory / DATABASE_FILE.format(version=version, column=column), values)
+    return {version: len(version_keys) for version, version_keys in keys.items()}
+
+
+@lru_cache(maxsize=4)
+def _database(directory: str) -> dict[int, dict[str, np.ndarray]]:
+    path = Path(directory)
+    database = {}
+    for version in (IPV4, IPV6):
+        files = {column: path / DATABASE_FILE.format(version=version, column=column) for column in DATABASE_COLUMNS}
+        if all(file.exists() for file in files.values()):
+            database[version] = {column: np.load(file, mmap_mode="r") for column, file in files.items()}
+        else:
+            logger.warning("No IPv%s geolocation database in %s", version, directory)
+    return database
+
+
+def locate(ip_address: str) -> tuple[float, float] | None:
+    """Coordinates of the IP address from the local database, if it is configured and has the address."""
+    if not settings.GEOIP_DATABASE:
+        return None
+    try:
+        version, key = range_key(ipaddress.ip_address(ip_address))
+    except ValueError:
+        return None
+    if (ranges := _database(str(settings.GEOIP_DATABASE)).get(version)) is None:
+        return None
+    index = int(np.searchsorted(ranges["first"], np.uint64(key), side="right")) - 1
+    if index < 0 or key > int(ranges["last"][index]):
+        return None
+    latitude, longitude = ranges["coordinates"][index]
+    return round(float(latitude), 4), round(float(longitude), 4)
+
+
+def fetch_remote_geolocation(ip_address: str) -> tuple[float, float] | None:
+    """Coordinates of the IP address from the remote provider, which responds like ipinfo.io."""
+    response = requests.get(
+        settings.GEOIP_REMOTE_URL.format(ip_address=ip_address), timeout=settings.GEOIP_REMOTE_TIMEOUT
+    )
+    if response.status_code == HTTPStatus.OK:
+        location = response.json().get("loc", "").split(",")
+        if len(location) == NUMBER_OF_COORDINATES:
+            latitude, longitude = location
+            return float(latitude), float(longitude)
+    return None
+
+
+def cache_statistics() -> dict[str, dict[str, float]]:
+    """Hits, misses and the hit rate of every geolocation cache tier in this process."""
+    with _statistics_lock:
+        counts = dict(_statistics)
+    statistics = {}
+    for alias in settings.GEOLOCATION_CACHES:
+        hits, misses = counts.get((alias, "hits"), 0), counts.get((alias, "misses"), 0)
+        statistics[alias] = {"hits": hits, "misses": misses, "hit_rate": hits / (hits + misses) if hits + misses else 0}
+    return statistics
+
+
+def _count(alias: str, outcome: str) -> None:
+    with _statistics_lock:
+        _statistics[alias, outcome] += 1
+        lookups = (
+            _statistics[settings.GEOLOCATION_CACHES[0], "hits"] + _statistics[settings.GEOLOCATION_CACHES[0], "misses"]
+        )
+    if lookups % STATISTICS_LOG_INTERVAL == 0:
+        logger.info("Geolocation cache statistics: %s", cache_statistics())
+
+
+def _timeout(location: tuple[float, float] | tuple[()]) -> int:
+    return settings.GEOLOCATION_CACHE_TIMEOUT if location else settings.GEOLOCATION_NEGATIVE_CACHE_TIMEOUT
+
+
+def _cached_geolocation(ip_address: str) -> tuple[float, float] | tuple[()] | None:
+    cache_key = GEOLOCATION_CACHE_KEY.format(ip_address=ip_address)
+    for tier, alias in enumerate(settings.GEOLOCATION_CACHES):
+        if (location := caches[alias].get(cache_key)) is None:
+            _count(alias, "misses")
+            continue
+        _count(alias, "hits")
+        # Keep it in the faster tiers for the next requests.
+        for faster_alias in settings.GEOLOCATION_CACHES[:tier]:
+            caches[faster_alias].set(cache_key, location, _timeout(location))
+        return location
+    return None
+
+
+def _remember_geolocation(ip_address: str, location: tuple[float, float] | tuple[()]) -> None:
+    cache_key = GEOLOCATION_CACHE_KEY.format(ip_address=ip_address)
+    for alias in settings.GEOLOCATION_CACHES:
+        caches[alias].set(cache_key, location, _timeout(location))
+
+
+def _remember_remote_geolocation(ip_address: str) -> None:
+    try:
+        location = fetch_remote_geolocation(ip_address)
+    except (requests.RequestException, ValueError):
+        logger.warning("Remote geolocation of %s failed", ip_address, exc_info=True)
+        location = None
+    _remember_geolocation(ip_address, location or NOT_FOUND)
+
+
+def geolocate(ip_address: str) -> tuple[float, float] | None:
+    """Coordinates of the IP address from the cache, the local database or the remote provider.
+
+    Public addresses that are missing from the database are looked up remotely in the background, without waiting.
+    Addresses that cannot be located are cached for a shorter time. Anything else than an IP address, which clients
+    may send in the `X-Forwarded-For` header, is neither looked up nor cached.
+    """
+    try:
+        address = ipaddress.ip_address(ip_address.strip())
+    except ValueError:
+        return None
+    # The canonical form, so that every address has a single cache key.
+    ip_address = str(address)
+    if (location := _cached_geolocation(ip_address)) is not None:
+        return location or None
+    if (location := locate(ip_address)) is not None:
+        _remember_geolocation(ip_address, location)
+        return location
+    if not settings.GEOIP_REMOTE_URL or not address.is_global:
+        _remember_geolocation(ip_address, NOT_FOUND)
+        return None
+    shared_cache = caches[settings.GEOLOCATION_CACHES[-1]]
+    if shared_cache.add(REMOTE_LOOKUP_CACHE_KEY.format(ip_address=ip_address), True, REMOTE_LOOKUP_INTERVAL):
+        _remote_lookups.submit(_remember_remote_geolocation, ip_address)
+    return None
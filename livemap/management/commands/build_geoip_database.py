@@ -0,0 +1,36 @@
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import Any
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from livemap.geolocation import build_database, read_ranges
+
+
+class Command(BaseCommand):
+    help = (
+        'Build the local IP geolocation database from a CSV file of IP ranges, e.g. the DB-IP "IP to City Lite" '
+        "database. The first two columns of every row are the first and the last address of a range, and the last "
+        "two are its latitude and longitude. Restart the application to load the new database."
+    )
+
+    def add_arguments(self, parser: ArgumentParser) -> None:
+        parser.add_argument("csv", type=Path, help="CSV file of IP ranges.")
+        parser.add_argument(
+            "--directory",
+            type=Path,
+            default=settings.GEOIP_DATABASE or None,
+            help="Directory to save the database to. `GEOIP_DATABASE` by default.",
+        )
+
+    def handle(self, *args: Any, **options: Any) -> None:  # noqa: ARG002
+        if options["directory"] is None:
+            raise CommandError("Set `GEOIP_DATABASE` or pass `--directory`")
+        try:
+            ranges = build_database(read_ranges(options["csv"]), Path(options["directory"]))
+        except (OSError, ValueError, IndexError) as error:
+            raise CommandError(f"Cannot build the database from {options['csv']}: {error}") from error
+        self.stdout.write(
+            self.style.SUCCESS(f"Saved {ranges[4]} IPv4 and {ranges[6]} IPv6 ranges to {options['directory']}")
+        )
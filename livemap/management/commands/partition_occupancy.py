@@ -0,0 +1,38 @@
+from argparse import ArgumentParser
+from datetime import UTC, datetime
+from typing import Any
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from livemap.partitions import OccupancyPartitions, partition_name
+
+
+class Command(BaseCommand):
+    help = (
+        "Partition the occupancy table by days, or create the partitions of the upcoming days if it is partitioned "
+        "already. Supported on MySQL only."
+    )
+
+    def add_arguments(self, parser: ArgumentParser) -> None:
+        parser.add_argument(
+            "--days-ahead",
+            type=int,
+            default=settings.OCCUPANCY_PARTITIONS_AHEAD_DAYS,
+            help="Number of days after today to create partitions for.",
+        )
+        parser.add_argument("--database", default="default", help="Database alias to partition the table in.")
+
+    def handle(self, *args: Any, **options: Any) -> None:  # noqa: ARG002
+        partitions = OccupancyPartitions(using=options["database"])
+        if not partitions.supported:
+            raise CommandError(
+                f"Partitioning is not supported by the {partitions.connection.vendor} database. "
+                "Old occupancy records are purged in batches instead."
+            )
+        created_days = partitions.ensure(datetime.now(UTC).date(), options["days_ahead"])
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Created {len(created_days)} partitions: {', '.join(map(partition_name, created_days))}"
+            )
+        )
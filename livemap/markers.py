@@ -0,0 +1,175 @@
+"""Parking lot markers of the livemap.
+
+The map loads the markers of its viewport from the GeoJSON endpoint as the user pans (see `livemap.clusters`).
+Popups are cached per parking lot. Saving a parking lot or anything shown in its popup invalidates the popup
+(see `livemap.signals`), so only the popups of the changed parking lots are rendered again.
+"""
+
+import contextlib
+import time
+from collections.abc import Iterable
+
+from branca.element import MacroElement
+from django.core.cache import cache
+from django.utils.html import format_html, format_html_join
+from jinja2 import Template
+
+from .models import ParkingLot
+
+POPUP_CACHE_KEY = "livemap_popup:{parking_lot_id}"
+POPUPS_VERSION_CACHE_KEY = "livemap_popups_version"
+# Popups are only evicted on changes.
+POPUP_CACHE_TIMEOUT = None
+
+
+class MarkerLayer(MacroElement):
+    """Markers and clusters of the parking lots within the viewport, loaded from the GeoJSON `url` on every move.
+
+    The free spots of the markers are updated by the Server-Sent Events of the `events_url`, if given.
+    """
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = L.featureGroup().addTo({{ this._parent.get_name() }});
+            (function (map, layer) {
+                const wrap = (longitude) => ((((longitude + 180) % 360) + 360) % 360) - 180;
+                let request = 0;
+                const markers = new Map();
+                function load() {
+                    const bounds = map.getBounds();
+                    const fullWidth = bounds.getEast() - bounds.getWest() >= 360;
+                    const bbox = [
+                        fullWidth ? -180 : wrap(bounds.getWest()),
+                        Math.max(bounds.getSouth(), -90),
+                        fullWidth ? 180 : wrap(bounds.getEast()),
+                        Math.min(bounds.getNorth(), 90),
+                    ];
+                    const current = ++request;
+                    const query = new URLSearchParams({bbox: bbox.join(","), zoom: map.getZoom()});
+                    fetch({{ this.url|tojson }} + "?" + query).then((response) => response.json()).then((data) => {
+                        // Responses to the previous moves may arrive later.
+                        if (current !== request) return;
+                        layer.clearLayers();
+                        markers.clear();
+                        for (const feature of data.features) {
+                            const [longitude, latitude] = feature.geometry.coordinates;
+                            const properties = feature.properties;
+                            if (!properties.cluster) {
+                                const marker = L.marker([latitude, longitude])
+                                    .bindPopup(properties.popup, {maxWidth: "100%"})
+                                    .addTo(layer);
+                                markers.set(properties.parking_lot_id, marker);
+                                continue;
+                            }
+                            const icon = L.divIcon({
+                                html: String(properties.parking_lots),
+                                className: "marker-cluster",
+                                iconSize: [40, 40],
+                            });
+                            L.marker([latitude, longitude], {icon: icon})
+                                .bindTooltip(
+                                    `${properties.parking_lots} parking lots, ${properties.free_spots} free spots`
+                                )
+                                .on("click", () => map.setView([latitude, longitude], map.getZoom() + 2))
+                                .addTo(layer);
+                        }
+                    });
+                }
+                map.on("moveend", load);
+                load();
+                {% if this.events_url %}
+                // Clusters are updated on the next move.
+                new EventSource({{ this.events_url|tojson }}).addEventListener("occupancy", (event) => {
+                    for (const change of JSON.parse(event.data)) {
+                        const marker = markers.get(change.parking_lot_id);
+                        if (!marker) continue;
+                        const popup = document.createElement("div");
+                        popup.innerHTML = marker.getPopup().getContent();
+                        const freeSpots = popup.querySelector(".free-spots");
+                        if (!freeSpots) continue;
+                        freeSpots.textContent = change.free_spots;
+                        marker.setPopupContent(popup.innerHTML);
+                    }
+                });
+                {% endif %}
+            })({{ this._parent.get_name() }}, {{ this.get_name() }});
+        {% endmacro %}
+    """)
+
+    def __init__(self, url: str, events_url: str | None = None) -> None:
+        super().__init__()
+        self._name = "MarkerLayer"
+        self.url = url
+        self.events_url = events_url
+
+
+def compose_popup(parking: ParkingLot) -> str:
+    rows = {
+        "Address": format_html(
+            "<a href='https://www.google.com/maps/search/?api=1&query={},{}'>{}</a>",
+            parking.latitude,
+            parking.longitude,
+            parking.address,
+        ),
+        "Private": parking.get_is_private,
+        "Free": parking.get_is_free,
+        "Total spots": parking.total_spots,
+        "Spots for disables": spots_for_disabled if (spots_for_disabled := parking.spots_for_disabled) else "",
+        # Updated by the pushed occupancy changes.
+        "Free spots": format_html(
+            "<span class='free-spots'>{}</span>", free_spots if (free_spots := parking.free_spots) is not None else ""
+        ),
+    }
+    # Use `all()` to benefit from `prefetch_related`.
+    lives = format_html_join(
+        "",
+        "<a href='{}'> 🔴 </a>",
+        ((stream_source.stream_source,) for stream_source in parking.stream_sources.all()),  # pyright: ignore[reportAttributeAccessIssue]
+    )
+    return format_html(
+        "<table class='styled-table' style='width:100%'>"
+        "<thead><tr><th colspan='2'>Parking details - Live {}</th></tr></thead>{}</table>",
+        lives,
+        format_html_join("", "<tr><td>{}</td><td>{}</td></tr>", rows.items()),
+    )
+
+
+def _popups_version() -> int:
+    # A new version starts from the clock, so it differs from the versions before an eviction.
+    return cache.get_or_set(POPUPS_VERSION_CACHE_KEY, time.time_ns, POPUP_CACHE_TIMEOUT)
+
+
+def cached_popups(parking_lot_ids: Iterable[int]) -> dict[int, str]:
+    """Popups of the parking lots by their IDs, read from the cache and rendered with two queries on a miss."""
+    version = _popups_version()
+    cache_keys = {
+        POPUP_CACHE_KEY.format(parking_lot_id=parking_lot_id): parking_lot_id for parking_lot_id in parking_lot_ids
+    }
+    popups = {cache_keys[cache_key]: popup for cache_key, popup in cache.get_many(cache_keys).items()}
+    if not (missing_ids := [parking_lot_id for parking_lot_id in cache_keys.values() if parking_lot_id not in popups]):
+        return popups
+
+    parking_lots = (
+        ParkingLot.objects.filter(id__in=missing_ids)
+        .select_related("address__city__country", "current_occupancy")
+        .prefetch_related("stream_sources")
+    )
+    rendered_popups = {parking.pk: compose_popup(parking) for parking in parking_lots}
+    # Popups invalidated while rendering may be stale, and are rendered again on the next request.
+    if _popups_version() == version:
+        cache.set_many(
+            {
+                POPUP_CACHE_KEY.format(parking_lot_id=parking_lot_id): popup
+                for parking_lot_id, popup in rendered_popups.items()
+            },
+            POPUP_CACHE_TIMEOUT,
+        )
+    return popups | rendered_popups
+
+
+def invalidate_popups(parking_lot_ids: Iterable[int]) -> None:
+    """Drop the cached popups of the parking lots."""
+    cache.delete_many([POPUP_CACHE_KEY.format(parking_lot_id=parking_lot_id) for parking_lot_id in parking_lot_ids])
+    # Without a version the next request starts a new one anyway.
+    with contextlib.suppress(ValueError):
+        cache.incr(POPUPS_VERSION_CACHE_KEY)
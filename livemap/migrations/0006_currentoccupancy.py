@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def populate_current_occupancy(apps, schema_editor):
+    Occupancy = apps.get_model('livemap', 'Occupancy')
+    CurrentOccupancy = apps.get_model('livemap', 'CurrentOccupancy')
+    latest_occupancy = Occupancy.objects.filter(parking_lot_id=OuterRef('parking_lot_id')).order_by('-timestamp', '-id')
+    latest_readings = Occupancy.objects.filter(id=Subquery(latest_occupancy.values('id')[:1]))
+    CurrentOccupancy.objects.bulk_create(
+        CurrentOccupancy(
+            parking_lot_id=occupancy.parking_lot_id, occupied_spots=occupancy.occupied_spots, timestamp=occupancy.timestamp
+        )
+        for occupancy in latest_readings.iterator()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('livemap', '0005_hourlyoccupancysummary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CurrentOccupancy',
+            fields=[
+                ('parking_lot', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='current_occupancy', serialize=False, to='livemap.parkinglot')),
+                ('occupied_spots', models.PositiveIntegerField(default=0)),
+                ('timestamp', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name_plural': 'current occupancy',
+            },
+        ),
+        migrations.RunPython(populate_current_occupancy, migrations.RunPython.noop),
+    ]
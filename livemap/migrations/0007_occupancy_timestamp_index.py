@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('livemap', '0006_currentoccupancy'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='occupancy',
+            index=models.Index(fields=['timestamp'], name='livemap_occ_timesta_99e1a0_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('livemap', '0008_aggregationwatermark'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='occupancy',
+            name='parking_lot',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='occupancies', to='livemap.parkinglot'),
+        ),
+    ]
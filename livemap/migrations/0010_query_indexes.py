@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:49
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('livemap', '0009_occupancy_parking_lot_db_constraint'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='occupancy',
+            name='parking_lot',
+            field=models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='occupancies', to='livemap.parkinglot'),
+        ),
+        migrations.AddIndex(
+            model_name='occupancy',
+            index=models.Index(fields=['parking_lot', 'timestamp'], name='livemap_occ_parking_4a95f2_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='videostreamsource',
+            index=models.Index(fields=['is_active', 'in_use_until'], name='livemap_vid_is_acti_21dcfa_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('livemap', '0010_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='videostreamsource',
+            name='lease_owner',
+            field=models.CharField(blank=True, default='', help_text='Identifier of the client that reserved the video stream.', max_length=64),
+        ),
+    ]
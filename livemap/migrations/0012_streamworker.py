@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('livemap', '0011_videostreamsource_lease_owner'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StreamWorker',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('lease_owner', models.CharField(max_length=64, unique=True)),
+                ('capacity', models.FloatField(help_text='Frames per second the worker can process.')),
+                ('active_until', models.DateTimeField(help_text='The worker is considered gone after this date and time.')),
+            ],
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('livemap', '0012_streamworker'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='occupancy',
+            name='livemap_occ_parking_4a95f2_idx',
+        ),
+        migrations.AddIndex(
+            model_name='hourlyoccupancysummary',
+            index=models.Index(fields=['parking_lot', 'date', 'hour', 'avg_occupied_spots'], name='livemap_hou_parking_635e21_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='occupancy',
+            index=models.Index(fields=['parking_lot', 'timestamp', 'occupied_spots'], name='livemap_occ_parking_e07e95_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('livemap', '0013_occupancy_series_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OccupancyProfile',
+            fields=[
+                ('parking_lot', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='occupancy_profile', serialize=False, to='livemap.parkinglot')),
+                ('statistics', models.BinaryField(help_text='Mean, 10th, 50th and 90th percentiles of occupied spots for every hour of the week.')),
+                ('forecast', models.BinaryField(help_text='Occupied spots expected in the hours from `forecast_start`.')),
+                ('forecast_start', models.DateTimeField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
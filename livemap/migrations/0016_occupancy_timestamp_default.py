@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:15
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('livemap', '0015_parkinglot_grid_cell'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='occupancy',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
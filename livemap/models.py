@@ -1,7 +1,33 @@
-from typing import ClassVar
-
+import logging
+from collections.abc import Iterable
+from datetime import UTC, datetime, timedelta
+from operator import attrgetter
+from typing import Any, ClassVar, Self
+from uuid import uuid4
+
+from django.conf import settings
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db import models
+from django.db import connections, models, transaction
+from django.db.models import Count, Exists, F, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Cast
+from django.dispatch import Signal
+from django.utils import timezone
+
+from .assignment import pack_parking_lots, shed_parking_lots, stream_load
+from .geo import GRID_CELLS_PER_DEGREE, GRID_COLUMNS, MAX_LATITUDE, MAX_LONGITUDE, distance, grid_cell_ranges
+
+logger = logging.getLogger(__name__)
+
+# The nearest parking lots are first searched for within this number of meters, growing by the factor below.
+NEAREST_INITIAL_RADIUS = 1000
+NEAREST_RADIUS_GROWTH = 4
+# A claim by capacity locks and packs at most this number of free video streams per requested stream.
+CLAIM_PACKING_WINDOW = 4
+HOURLY_OCCUPANCY_WATERMARK = "hourly_occupancy"
+
+
+def _floor_to_hour(timestamp: datetime) -> datetime:
+    return timestamp.replace(minute=0, second=0, microsecond=0)
 
 
 class Country(models.Model):
@@ -35,6 +61,44 @@ class Address(models.Model):
     def __str__(self) -> str:
         return f"{self.parking_lot_address}, {self.city}"
 
+    @staticmethod
+    def format(parking_lot_address: str, city_name: str, country_name: str) -> str:
+        """The address as `str()` formats it, from the names read without model instances."""
+        return f"{parking_lot_address}, {city_name}, {country_name}"
+
+
+class ParkingLotQuerySet(models.QuerySet):
+    def near(self, latitude: float, longitude: float, radius: float) -> Self:
+        """The parking lots in the grid cells around the point, a superset of the ones within `radius` meters."""
+        within_cells = Q()
+        for first_cell, last_cell in grid_cell_ranges(latitude, longitude, radius):
+            within_cells |= Q(grid_cell__range=(first_cell, last_cell))
+        return self.filter(within_cells)
+
+    def with_free_spots(self, min_free_spots: int) -> Self:
+        """The parking lots with at least `min_free_spots` free spots according to the latest occupancy reading."""
+        return self.filter(current_occupancy__occupied_spots__lte=F("total_spots") - min_free_spots)
+
+    def nearest(self, latitude: float, longitude: float, limit: int, radius: float) -> list["ParkingLot"]:
+        """Up to `limit` parking lots closest to the point within `radius` meters, nearest first.
+
+        The search starts from a small circle that grows until it holds `limit` parking lots, so dense areas
+        only read the grid cells next to the point. Every parking lot gets its `distance` in meters.
+        """
+        search_radius = min(NEAREST_INITIAL_RADIUS, radius)
+        while True:
+            parking_lots = []
+            for parking_lot in self.near(latitude, longitude, search_radius).order_by():
+                parking_lot.distance = distance(  # pyright: ignore[reportAttributeAccessIssue]
+                    latitude, longitude, float(parking_lot.latitude), float(parking_lot.longitude)
+                )
+                if parking_lot.distance <= search_radius:  # pyright: ignore[reportAttributeAccessIssue]
+                    parking_lots.append(parking_lot)
+            if len(parking_lots) >= limit or search_radius >= radius:
+                parking_lots.sort(key=lambda parking_lot: (parking_lot.distance, parking_lot.pk))
+                return parking_lots[:limit]
+            search_radius = min(search_radius * NEAREST_RADIUS_GROWTH, radius)
+
 
 class ParkingLot(models.Model):
     class Answer(models.IntegerChoices):
@@ -54,6 +118,16 @@ class ParkingLot(models.Model):
     longitude = models.DecimalField(
         max_digits=9, decimal_places=6, validators=[MinValueValidator(-180.0), MaxValueValidator(180.0)], null=True
     )
+    # See `livemap.geo`. Neighbouring cells may differ by one between databases that round or truncate the cast.
+    grid_cell = models.GeneratedField(
+        expression=Cast((F("latitude") + MAX_LATITUDE) * GRID_CELLS_PER_DEGREE, models.BigIntegerField()) * GRID_COLUMNS
+        + Cast((F("longitude") + MAX_LONGITUDE) * GRID_CELLS_PER_DEGREE, models.BigIntegerField()),
+        output_field=models.BigIntegerField(null=True),
+        db_persist=True,
+        db_index=True,
+    )
+
+    objects = ParkingLotQuerySet.as_manager()
 
     def __str__(self) -> str:
         return str(self.address)
@@ -69,6 +143,135 @@ class ParkingLot(models.Model):
         is_free_index = self.Answer.values.index(self.is_free)
         return self.Answer.labels[is_free_index]  # pyright: ignore[reportReturnType]
 
+    @property
+    def free_spots(self) -> int | None:
+        """Free spots according to the latest occupancy reading. Select `current_occupancy` to avoid extra queries."""
+        try:
+            current_occupancy = self.current_occupancy  # pyright: ignore[reportAttributeAccessIssue]
+        except CurrentOccupancy.DoesNotExist:
+            return None
+        return max(self.total_spots - current_occupancy.occupied_spots, 0)
+
+
+class VideoStreamSourceQuerySet(models.QuerySet):
+    def not_in_use(self, now: datetime | None = None) -> Self:
+        """Video streams whose `in_use_until` field is either `null` or has an expired date and time."""
+        now = now or datetime.now(UTC)
+        return self.filter(Q(in_use_until__isnull=True) | Q(in_use_until__lt=now))
+
+    def claim(
+        self, in_use_until: datetime, limit: int, lease_owner: str | None = None, capacity: float | None = None
+    ) -> list[int]:
+        """Atomically reserve up to `limit` video streams that are not in use until `in_use_until`.
+
+        Return the IDs of the reserved streams. Concurrent callers never get the same stream: rows locked by another
+        caller are skipped where the database supports `SKIP LOCKED`, otherwise the streams are reserved with
+        a compare-and-set update that only succeeds for the streams that are still free, and the winner is recognized
+        by the `lease_owner`. Streams are reserved in the order of their parking lots, so that all the streams of
+        a parking lot tend to go to the same caller.
+
+        With `capacity` in frames per second, the `lease_owner` is required and registered as a `StreamWorker` in the
+        same transaction, and whole parking lots are reserved until their load fills the capacity left by the streams
+        the caller already holds. They are packed from the first `limit * CLAIM_PACKING_WINDOW` free streams, so that
+        concurrent callers lock different ones.
+        """
+        if capacity is not None and lease_owner is None:
+            msg = "A capacity-aware claim requires a lease owner"
+            raise ValueError(msg)
+        lease_owner = lease_owner or uuid4().hex
+        candidates = self.not_in_use().order_by("parking_lot_id", "id")
+        streams = self.model.objects.using(self.db)
+        with transaction.atomic(using=self.db):
+            # The worker is registered with the streams it reserves, or not at all.
+            budget = None
+            if capacity is not None:
+                StreamWorker.objects.using(self.db).check_in(lease_owner, capacity, in_use_until)
+                held_load = streams.held_by(lease_owner).load()
+                budget = (capacity - held_load, not held_load)
+
+            if connections[self.db].features.has_select_for_update_skip_locked:
+                claimed_ids = candidates.select_for_update(skip_locked=True)._pick(limit, budget)  # noqa: SLF001
+                updated = streams.filter(id__in=claimed_ids).update(in_use_until=in_use_until, lease_owner=lease_owner)
+            else:
+                candidate_ids = candidates._pick(limit, budget)  # noqa: SLF001
+                # Another caller may have reserved some of the candidates since they were selected.
+                updated = (
+                    streams.filter(id__in=candidate_ids)
+                    .not_in_use()
+                    .update(in_use_until=in_use_until, lease_owner=lease_owner)
+                )
+                claimed_ids = list(
+                    streams.filter(id__in=candidate_ids, lease_owner=lease_owner, in_use_until=in_use_until)
+                    .order_by("parking_lot_id", "id")
+                    .values_list("id", flat=True)
+                )
+        self._leases_changed(updated)
+        return claimed_ids
+
+    def _pick(self, limit: int, budget: tuple[float, bool] | None) -> list[int]:
+        """IDs of up to `limit` streams, packed by parking lots into the `(budget, allow_overflow)` if given."""
+        if budget is None:
+            return list(self.values_list("id", flat=True)[:limit])
+        capacity_left, allow_overflow = budget
+        window = limit * CLAIM_PACKING_WINDOW
+        streams = list(self.values_list("id", "parking_lot_id", "processing_rate")[:window])
+        if len(streams) == window and streams[0][1] != streams[-1][1]:
+            # The window may end in the middle of the last parking lot, which must be reserved as a whole.
+            streams = [stream for stream in streams if stream[1] != streams[-1][1]]
+        return pack_parking_lots(streams, capacity_left, limit, allow_overflow=allow_overflow)
+
+    def load(self) -> float:
+        """Frames per second needed to process the video streams."""
+        rates = self.order_by().values_list("processing_rate").annotate(count=Count("id"))
+        return sum(count * stream_load(processing_rate) for processing_rate, count in rates)
+
+    def rebalance(self, lease_owner: str, capacity: float, in_use_until: datetime) -> list[int]:
+        """Release the parking lots that the `lease_owner` holds beyond its fair share of the load of the streams.
+
+        The fair share is proportional to the capacity of the worker among all the active workers, so the load of
+        a worker that joins is taken over from the others, while the streams of a worker that leaves are released
+        or expire and are claimed by the others. Return the IDs of the released streams.
+        """
+        workers = StreamWorker.objects.using(self.db)
+        workers.check_in(lease_owner, capacity, in_use_until)
+        total_capacity = workers.active().aggregate(total=Sum("capacity"))["total"]
+        fair_share = self.load() * capacity / total_capacity
+        held_streams = self.model.objects.using(self.db).held_by(lease_owner)
+        held = list(held_streams.values_list("id", "parking_lot_id", "processing_rate"))
+        excess = sum(stream_load(processing_rate) for _, _, processing_rate in held) - fair_share
+        if excess <= 0:
+            return []
+        released_ids = shed_parking_lots(held, excess)
+        self._leases_changed(held_streams.filter(id__in=released_ids).update(in_use_until=None, lease_owner=""))
+        return released_ids
+
+    def parking_lots(self) -> models.QuerySet["ParkingLot"]:
+        """Parking lots of the video streams ordered by ID."""
+        streams = self.select_related(None).filter(parking_lot=OuterRef("pk"))
+        return ParkingLot.objects.filter(Exists(streams)).order_by("id")
+
+    def held_by(self, lease_owner: str, now: datetime | None = None) -> Self:
+        """Video streams whose reservation by the `lease_owner` has not expired yet."""
+        now = now or datetime.now(UTC)
+        return self.filter(lease_owner=lease_owner, in_use_until__gte=now)
+
+    def renew(self, lease_owner: str, in_use_until: datetime) -> int:
+        """Extend the unexpired reservations of the `lease_owner` with a single update. Return their number.
+
+        Reservations that have expired may already belong to another owner, so they have to be claimed again.
+        """
+        return self._leases_changed(self.held_by(lease_owner).update(in_use_until=in_use_until))
+
+    def release(self, lease_owner: str) -> int:
+        """Make the streams reserved by the `lease_owner` available right away. Return their number."""
+        return self._leases_changed(self.held_by(lease_owner).update(in_use_until=None, lease_owner=""))
+
+    def _leases_changed(self, updated: int) -> int:
+        # The updates send no `post_save` signals.
+        if updated:
+            stream_leases_changed.send(sender=self.model)
+        return updated
+
 
 class VideoStreamSource(models.Model):
     class ProcessingRate(models.IntegerChoices):
@@ -94,23 +297,225 @@ class VideoStreamSource(models.Model):
         blank=True,
         help_text="Date and time in UTC timezone and ISO-8601 format until the video stream is in use.",
     )
+    lease_owner = models.CharField(
+        max_length=64, blank=True, default="", help_text="Identifier of the client that reserved the video stream."
+    )
+
+    objects = VideoStreamSourceQuerySet.as_manager()
+
+    class Meta:
+        # Serves the lookup of active video streams that are not in use.
+        indexes: ClassVar = [models.Index(fields=["is_active", "in_use_until"])]
 
     def __str__(self) -> str:
         return f"{self.stream_source}, {self.parking_lot}"
 
 
+class StreamWorkerQuerySet(models.QuerySet):
+    def active(self, now: datetime | None = None) -> Self:
+        now = now or datetime.now(UTC)
+        return self.filter(active_until__gte=now)
+
+    def check_in(self, lease_owner: str, capacity: float, active_until: datetime) -> None:
+        self.update_or_create(lease_owner=lease_owner, defaults={"capacity": capacity, "active_until": active_until})
+
+
+class StreamWorker(models.Model):
+    """A worker that processes video streams with a declared capacity. Registered when it claims or renews streams."""
+
+    lease_owner = models.CharField(max_length=64, unique=True)
+    capacity = models.FloatField(help_text="Frames per second the worker can process.")
+    active_until = models.DateTimeField(help_text="The worker is considered gone after this date and time.")
+
+    objects = StreamWorkerQuerySet.as_manager()
+
+    def __str__(self) -> str:
+        return f"{self.lease_owner}: {self.capacity} fps"
+
+
+class OccupancyQuerySet(models.QuerySet):
+    def ingest(self, occupancies: list["Occupancy"]) -> list["Occupancy"]:
+        """Insert the readings and refresh the current occupancy of their parking lots. Return the inserted readings.
+
+        With `OCCUPANCY_CHANGES_ONLY`, only the changes and the keep-alive readings are inserted.
+        """
+        stored = (
+            self.changes(occupancies, timedelta(seconds=settings.OCCUPANCY_KEEPALIVE_SECONDS))
+            if settings.OCCUPANCY_CHANGES_ONLY
+            else occupancies
+        )
+        with transaction.atomic():
+            created = self.bulk_create(stored)
+            CurrentOccupancy.objects.refresh_from(occupancies)
+            self._reopen_aggregated_hours(created)
+        return created
+
+    def _reopen_aggregated_hours(self, occupancies: list["Occupancy"]) -> None:
+        """Move the hourly aggregation watermark back to the hour of the earliest reading, if it is already aggregated.
+
+        Only the buffered readings may be stamped before the current hour, so the other ones cost no query. An hour
+        whose records may already be purged cannot be aggregated again, so its late readings are only logged.
+        """
+        now = datetime.now(UTC)
+        late = [occupancy.timestamp for occupancy in occupancies if occupancy.timestamp < _floor_to_hour(now)]
+        if not late:
+            return
+        first_retained_hour = _floor_to_hour(now - timedelta(hours=settings.OCCUPANCY_RETENTION_HOURS)) + timedelta(
+            hours=1
+        )
+        if expired := sum(timestamp < first_retained_hour for timestamp in late):
+            logger.warning("Not aggregating %s occupancy readings older than %s", expired, first_retained_hour)
+        reopened = [timestamp for timestamp in late if timestamp >= first_retained_hour]
+        if reopened and AggregationWatermark.objects.rewind(HOURLY_OCCUPANCY_WATERMARK, _floor_to_hour(min(reopened))):
+            logger.info("Reopened the aggregated hours for %s late occupancy readings", len(reopened))
+
+    def changes(self, occupancies: Iterable["Occupancy"], keepalive: timedelta) -> list["Occupancy"]:
+        """The readings that change the stored occupancy of their parking lots, or repeat it `keepalive` after it.
+
+        The readings are compared with the latest stored reading of their parking lot and with each other in the order
+        of their timestamps.
+        """
+        occupancies = sorted(occupancies, key=attrgetter("timestamp"))
+        if not occupancies:
+            return []
+        # Index-only lookups of the latest stored reading of every parking lot.
+        latest_readings = self.filter(
+            parking_lot=OuterRef("pk"),
+            timestamp__gte=occupancies[0].timestamp - keepalive,
+            timestamp__lte=occupancies[-1].timestamp,
+        ).order_by("-timestamp")
+        latest = {
+            parking_lot_id: (timestamp, occupied_spots)
+            for parking_lot_id, timestamp, occupied_spots in ParkingLot.objects.filter(
+                id__in={occupancy.parking_lot_id for occupancy in occupancies}  # pyright: ignore[reportAttributeAccessIssue]
+            )
+            .annotate(
+                latest_timestamp=Subquery(latest_readings.values("timestamp")[:1]),
+                latest_occupied_spots=Subquery(latest_readings.values("occupied_spots")[:1]),
+            )
+            .filter(latest_timestamp__isnull=False)
+            .values_list("id", "latest_timestamp", "latest_occupied_spots")
+        }
+
+        changes = []
+        for occupancy in occupancies:
+            parking_lot_id = occupancy.parking_lot_id  # pyright: ignore[reportAttributeAccessIssue]
+            previous = latest.get(parking_lot_id)
+            if (
+                previous is None
+                or occupancy.occupied_spots != previous[1]
+                or occupancy.timestamp - previous[0] >= keepalive
+            ):
+                changes.append(occupancy)
+                latest[parking_lot_id] = (occupancy.timestamp, occupancy.occupied_spots)
+        return changes
+
+
 class Occupancy(models.Model):
-    parking_lot = models.ForeignKey(ParkingLot, on_delete=models.CASCADE, related_name="occupancies")
+    # Partitioned MySQL tables do not support foreign keys (see `livemap.partitions`).
+    # Cascade deletion is still performed by Django. The composite index below covers the lookups by parking lot.
+    parking_lot = models.ForeignKey(
+        ParkingLot, on_delete=models.CASCADE, related_name="occupancies", db_constraint=False, db_index=False
+    )
     occupied_spots = models.PositiveIntegerField(default=0)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Not `auto_now_add`, so that the buffered readings keep the time they arrived at (see `livemap.buffer`).
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
+
+    objects = OccupancyQuerySet.as_manager()
 
     class Meta:
         get_latest_by = "timestamp"
         verbose_name_plural = "occupancy"
+        indexes: ClassVar = [
+            models.Index(fields=["timestamp"]),
+            # Covers the time series of parking lots without reading the table rows.
+            models.Index(fields=["parking_lot", "timestamp", "occupied_spots"]),
+        ]
 
     def __str__(self) -> str:
         return f"{self.occupied_spots} occupied spots, {self.parking_lot}"
 
+    def save(self, *args: Any, **kwargs: Any) -> None:
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            CurrentOccupancy.objects.refresh_from([self])
+
+
+class CurrentOccupancyQuerySet(models.QuerySet):
+    def refresh_from(self, occupancies: Iterable[Occupancy]) -> None:
+        """Store the newest of the `occupancies` readings as the current state of their parking lots.
+
+        A reading older than the stored current occupancy of its parking lot, e.g. a late or redelivered one, is
+        skipped.
+        """
+        latest: dict[int, Occupancy] = {}
+        for occupancy in occupancies:
+            parking_lot_id = occupancy.parking_lot_id  # pyright: ignore[reportAttributeAccessIssue]
+            if parking_lot_id not in latest or occupancy.timestamp >= latest[parking_lot_id].timestamp:
+                latest[parking_lot_id] = occupancy
+        with transaction.atomic(using=self.db):
+            # The stored rows are locked until the update, so that a concurrent refresh cannot slip in between.
+            stored = dict(self._lock(latest))
+            if missing := latest.keys() - stored.keys():
+                # The first readings of a parking lot may arrive concurrently, and there is no row to lock yet. The rows
+                # are inserted first, one of the concurrent inserts being ignored, and then locked like the others.
+                self.bulk_create(
+                    [self._from_reading(parking_lot_id, latest[parking_lot_id]) for parking_lot_id in sorted(missing)],
+                    ignore_conflicts=True,
+                )
+                stored.update(self._lock(missing))
+            for parking_lot_id, timestamp in stored.items():
+                if latest[parking_lot_id].timestamp < timestamp:
+                    del latest[parking_lot_id]
+            self.bulk_update(
+                [self._from_reading(parking_lot_id, occupancy) for parking_lot_id, occupancy in latest.items()],
+                ["occupied_spots", "timestamp"],
+            )
+        # The bulk queries send no `post_save` signals.
+        current_occupancy_refreshed.send(sender=CurrentOccupancy, parking_lot_ids=list(latest))
+
+    def _lock(self, parking_lot_ids: Iterable[int]) -> list[tuple[int, datetime]]:
+        return list(
+            self.select_for_update()
+            .filter(parking_lot_id__in=parking_lot_ids)
+            .order_by("parking_lot_id")
+            .values_list("parking_lot_id", "timestamp")
+        )
+
+    @staticmethod
+    def _from_reading(parking_lot_id: int, occupancy: Occupancy) -> "CurrentOccupancy":
+        return CurrentOccupancy(
+            parking_lot_id=parking_lot_id, occupied_spots=occupancy.occupied_spots, timestamp=occupancy.timestamp
+        )
+
+
+# Sent with the `parking_lot_ids` whose current occupancy was refreshed.
+current_occupancy_refreshed = Signal()
+# Sent when the reservations of video streams are changed with queryset updates.
+stream_leases_changed = Signal()
+
+
+class CurrentOccupancy(models.Model):
+    """The latest occupancy reading per parking lot, maintained on every write to `Occupancy`.
+
+    It is a copy rather than a reference, so it stays available when the reading is deleted or purged. Deleting the
+    latest reading does not move it back to the previous one.
+    """
+
+    parking_lot = models.OneToOneField(
+        ParkingLot, on_delete=models.CASCADE, primary_key=True, related_name="current_occupancy"
+    )
+    occupied_spots = models.PositiveIntegerField(default=0)
+    timestamp = models.DateTimeField()
+
+    objects = CurrentOccupancyQuerySet.as_manager()
+
+    class Meta:
+        verbose_name_plural = "current occupancy"
+
+    def __str__(self) -> str:
+        return f"{self.occupied_spots} occupied spots at {self.timestamp:%d.%m.%Y %X}, {self.parking_lot}"
+
 
 class HourlyOccupancySummary(models.Model):
     parking_lot = models.ForeignKey(ParkingLot, on_delete=models.CASCADE, related_name="hourly_occupancy")
@@ -120,6 +525,46 @@ class HourlyOccupancySummary(models.Model):
 
     class Meta:
         unique_together: ClassVar = ["parking_lot", "hour", "date"]
+        # Covers the time series of parking lots without reading the table rows.
+        indexes: ClassVar = [models.Index(fields=["parking_lot", "date", "hour", "avg_occupied_spots"])]
 
     def __str__(self) -> str:
         return f"{self.hour}:00-{self.hour + 1}:00 {self.date}: {self.avg_occupied_spots} ({self.parking_lot})"
+
+
+class OccupancyProfile(models.Model):
+    """Typical week of a parking lot and a short-term forecast, built from the hourly summaries.
+
+    The statistics are stored as little-endian float32 arrays to keep the rows small.
+    """
+
+    parking_lot = models.OneToOneField(
+        ParkingLot, on_delete=models.CASCADE, primary_key=True, related_name="occupancy_profile"
+    )
+    statistics = models.BinaryField(
+        help_text="Mean, 10th, 50th and 90th percentiles of occupied spots for every hour of the week."
+    )
+    forecast = models.BinaryField(help_text="Occupied spots expected in the hours from `forecast_start`.")
+    forecast_start = models.DateTimeField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self) -> str:
+        return f"Occupancy profile of {self.parking_lot_id}"  # pyright: ignore[reportAttributeAccessIssue]
+
+
+class AggregationWatermarkQuerySet(models.QuerySet):
+    def rewind(self, name: str, timestamp: datetime) -> bool:
+        """Move the watermark back to `timestamp`, so that the data after it is processed again. Return if it moved."""
+        return bool(self.filter(name=name, timestamp__gt=timestamp).update(timestamp=timestamp))
+
+
+class AggregationWatermark(models.Model):
+    """The point in time up to which a periodic aggregation has already processed the data."""
+
+    name = models.CharField(max_length=100, unique=True)
+    timestamp = models.DateTimeField()
+
+    objects = AggregationWatermarkQuerySet.as_manager()
+
+    def __str__(self) -> str:
+        return f"{self.name}: {self.timestamp:%d.%m.%Y %X}"
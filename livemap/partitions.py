@@ -0,0 +1,118 @@
+"""Daily range partitioning of the `Occupancy` table.
+
+Only MySQL supports it: a partitioned table cannot have foreign keys and every unique key must include the
+partitioning column, hence the `(id, timestamp)` primary key. Other databases keep an ordinary table that is purged
+in batches.
+"""
+
+from collections.abc import Iterable
+from datetime import date, datetime, timedelta
+
+from django.db import connections
+
+from .models import Occupancy
+
+MAX_PARTITION = "pmax"
+PARTITION_NAME_FORMAT = "p%Y%m%d"
+
+
+def partition_name(day: date) -> str:
+    return day.strftime(PARTITION_NAME_FORMAT)
+
+
+def partition_day(name: str) -> date | None:
+    """The day stored in the partition, or `None` for the catch-all partition."""
+    if name == MAX_PARTITION:
+        return None
+    return datetime.strptime(name, PARTITION_NAME_FORMAT).date()  # noqa: DTZ007
+
+
+def partition_definitions(days: Iterable[date]) -> str:
+    definitions = [
+        f"PARTITION {partition_name(day)} VALUES LESS THAN (TO_DAYS('{day + timedelta(days=1):%Y-%m-%d}'))"
+        for day in days
+    ]
+    definitions.append(f"PARTITION {MAX_PARTITION} VALUES LESS THAN MAXVALUE")
+    return ", ".join(definitions)
+
+
+def date_range(start: date, end: date) -> list[date]:
+    """Days from `start` to `end` inclusive."""
+    return [start + timedelta(days=offset) for offset in range((end - start).days + 1)]
+
+
+class OccupancyPartitions:
+    """Create, list and drop the daily partitions of the `Occupancy` table."""
+
+    def __init__(self, using: str = "default") -> None:
+        self.connection = connections[using]
+        self.table = Occupancy._meta.db_table  # noqa: SLF001
+
+    @property
+    def supported(self) -> bool:
+        return self.connection.vendor == "mysql"
+
+    def _execute(self, sql: str, params: Iterable[object] = ()) -> list[tuple]:
+        with self.connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall() if cursor.description else []
+
+    def days(self) -> list[date]:
+        """Days of the existing daily partitions in ascending order."""
+        if not self.supported:
+            return []
+        rows = self._execute(
+            "SELECT PARTITION_NAME FROM information_schema.PARTITIONS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL "
+            "ORDER BY PARTITION_ORDINAL_POSITION",
+            [self.table],
+        )
+        return [day for (name,) in rows if (day := partition_day(name))]
+
+    def enable_sql(self, start: date, end: date) -> list[str]:
+        """Statements that turn the ordinary table into a partitioned one with partitions from `start` to `end`."""
+        definitions = partition_definitions(date_range(start, end))
+        return [
+            f"ALTER TABLE {self.table} DROP PRIMARY KEY, ADD PRIMARY KEY (id, timestamp)",
+            f"ALTER TABLE {self.table} PARTITION BY RANGE (TO_DAYS(timestamp)) ({definitions})",
+        ]
+
+    def extend_sql(self, days: Iterable[date]) -> list[str]:
+        """Statements that split new daily partitions off the catch-all partition."""
+        if not (days := list(days)):
+            return []
+        return [f"ALTER TABLE {self.table} REORGANIZE PARTITION {MAX_PARTITION} INTO ({partition_definitions(days)})"]
+
+    def drop_sql(self, days: Iterable[date]) -> list[str]:
+        if not (names := [partition_name(day) for day in days]):
+            return []
+        return [f"ALTER TABLE {self.table} DROP PARTITION {', '.join(names)}"]
+
+    def ensure(self, today: date, days_ahead: int) -> list[date]:
+        """Partition the table if needed and make sure partitions exist up to `days_ahead` days after `today`.
+
+        Return the days of the created partitions.
+        """
+        if not self.supported:
+            return []
+        last_day = today + timedelta(days=days_ahead)
+        if existing_days := self.days():
+            new_days = date_range(existing_days[-1] + timedelta(days=1), last_day)
+            statements = self.extend_sql(new_days)
+        else:
+            first_timestamp = Occupancy.objects.order_by("timestamp").values_list("timestamp", flat=True).first()
+            first_day = min(first_timestamp.date(), today) if first_timestamp else today
+            new_days = date_range(first_day, last_day)
+            statements = self.enable_sql(first_day, last_day)
+        for statement in statements:
+            self._execute(statement)
+        return new_days
+
+    def drop_older_than(self, cutoff: datetime) -> list[date]:
+        """Drop the partitions that only hold records older than `cutoff`. Return their days."""
+        if not self.supported:
+            return []
+        old_days = [day for day in self.days() if day + timedelta(days=1) <= cutoff.date()]
+        for statement in self.drop_sql(old_days):
+            self._execute(statement)
+        return old_days
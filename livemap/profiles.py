@@ -0,0 +1,166 @@
+"""Typical-week occupancy profiles and short-term forecasts of parking lots.
+
+The hourly summaries of many parking lots are laid out as a `(parking lots, weeks, hours of the week)` array, so
+the statistics of a whole batch are calculated with a few vectorized NumPy operations.
+"""
+
+import warnings
+from collections.abc import Iterable
+from datetime import UTC, datetime, time, timedelta
+from functools import partial
+from typing import Any
+
+import numpy as np
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+
+from .db import bulk_upsert
+from .models import HourlyOccupancySummary, OccupancyProfile
+
+HOURS_PER_WEEK = 7 * 24
+PROFILE_WEEKS = 8
+PERCENTILES = (10, 50, 90)
+FORECAST_HOURS = 24
+# The share of the current deviation from the profile that is left after every hour of the forecast.
+FORECAST_DECAY = 0.8
+PROFILE_BATCH_SIZE = 500
+PROFILE_CACHE_KEY = "occupancy_profile:{parking_lot_id}"
+PROFILE_CACHE_TIMEOUT = int(timedelta(days=1).total_seconds())
+STATISTICS_DTYPE = np.dtype("<f4")
+
+
+def hour_of_week(moment: datetime) -> int:
+    """Hours since Monday 00:00 UTC."""
+    return moment.weekday() * 24 + moment.hour
+
+
+def changed_parking_lots(since: datetime | None, until: datetime) -> list[int]:
+    """IDs of the parking lots with hourly summaries of the hours between `since` and `until`."""
+    summaries = HourlyOccupancySummary.objects.filter(
+        Q(date__lt=until.date()) | Q(date=until.date(), hour__lt=until.hour)
+    )
+    if since is not None:
+        summaries = summaries.filter(Q(date__gt=since.date()) | Q(date=since.date(), hour__gte=since.hour))
+    return sorted(summaries.values_list("parking_lot_id", flat=True).distinct().order_by())
+
+
+def summary_matrix(parking_lot_ids: list[int], end: datetime) -> tuple[np.ndarray, datetime]:
+    """Hourly summaries of the `PROFILE_WEEKS` weeks before `end` as a `(parking lots, hours)` array.
+
+    The first hour is a Monday 00:00 UTC, so the hour of the week of every column is its index modulo
+    `HOURS_PER_WEEK`. Missing hours are `NaN`. Return the array and its first hour.
+    """
+    start_day = (end - timedelta(weeks=PROFILE_WEEKS)).date()
+    start = datetime.combine(start_day - timedelta(days=start_day.weekday()), time(), tzinfo=UTC)
+    hours = int((end - start) / timedelta(hours=1))
+    matrix = np.full((len(parking_lot_ids), hours), np.nan, dtype=STATISTICS_DTYPE)
+    rows = HourlyOccupancySummary.objects.filter(
+        Q(date__lt=end.date()) | Q(date=end.date(), hour__lt=end.hour),
+        parking_lot_id__in=parking_lot_ids,
+        date__gte=start.date(),
+    ).values_list("parking_lot_id", "date", "hour", "avg_occupied_spots")
+    row_indexes = {parking_lot_id: index for index, parking_lot_id in enumerate(parking_lot_ids)}
+    start_ordinal = start.date().toordinal()
+    lot_indexes, hour_indexes, values = [], [], []
+    for parking_lot_id, day, hour, avg_occupied_spots in rows.iterator(chunk_size=10_000):
+        lot_indexes.append(row_indexes[parking_lot_id])
+        hour_indexes.append((day.toordinal() - start_ordinal) * 24 + hour)
+        values.append(avg_occupied_spots)
+    matrix[lot_indexes, hour_indexes] = values
+    return matrix, start
+
+
+def compute_profiles(matrix: np.ndarray, start: datetime, end: datetime) -> tuple[np.ndarray, np.ndarray]:
+    """Statistics per hour of the week and forecasts from `end` for the rows of the `summary_matrix`.
+
+    Return a `(parking lots, 1 + len(PERCENTILES), HOURS_PER_WEEK)` array of the mean and percentiles and
+    a `(parking lots, FORECAST_HOURS)` array of forecasts. The forecast starts from the profile mean and carries
+    over the deviation of the last hour from it, which fades by `FORECAST_DECAY` every hour.
+    """
+    lots_number, hours = matrix.shape
+    weeks = -(-hours // HOURS_PER_WEEK)
+    padded = np.full((lots_number, weeks * HOURS_PER_WEEK), np.nan, dtype=STATISTICS_DTYPE)
+    padded[:, :hours] = matrix
+    by_week = padded.reshape(lots_number, weeks, HOURS_PER_WEEK)
+    with warnings.catch_warnings():
+        # Hours of the week without any summary are expected to stay `NaN`.
+        warnings.simplefilter("ignore", RuntimeWarning)
+        mean = np.nanmean(by_week, axis=1)
+        percentiles = np.nanpercentile(by_week, PERCENTILES, axis=1)
+    statistics = np.concatenate([mean[:, np.newaxis], percentiles.transpose(1, 0, 2)], axis=1)
+
+    last_hour = hour_of_week(end - timedelta(hours=1))
+    deviation = np.nan_to_num(matrix[:, int((end - start) / timedelta(hours=1)) - 1] - mean[:, last_hour])
+    steps = np.arange(1, FORECAST_HOURS + 1)
+    forecast_hours = (last_hour + steps) % HOURS_PER_WEEK
+    forecast = mean[:, forecast_hours] + deviation[:, np.newaxis] * FORECAST_DECAY**steps
+    return statistics, np.clip(forecast, 0, None)
+
+
+def rebuild_profiles(parking_lot_ids: Iterable[int], end: datetime) -> int:
+    """Recalculate the profiles of the parking lots from the summaries before `end`. Return their number."""
+    parking_lot_ids = list(parking_lot_ids)
+    for batch_start in range(0, len(parking_lot_ids), PROFILE_BATCH_SIZE):
+        batch = parking_lot_ids[batch_start : batch_start + PROFILE_BATCH_SIZE]
+        matrix, start = summary_matrix(batch, end)
+        statistics, forecasts = compute_profiles(matrix, start, end)
+        profiles = [
+            OccupancyProfile(
+                parking_lot_id=parking_lot_id,
+                statistics=lot_statistics.astype(STATISTICS_DTYPE).tobytes(),
+                forecast=forecast.astype(STATISTICS_DTYPE).tobytes(),
+                forecast_start=end,
+            )
+            for parking_lot_id, lot_statistics, forecast in zip(batch, statistics, forecasts, strict=True)
+        ]
+        bulk_upsert(
+            OccupancyProfile,
+            profiles,
+            unique_fields=["parking_lot"],
+            update_fields=["statistics", "forecast", "forecast_start", "updated_at"],
+        )
+        cache_keys = [PROFILE_CACHE_KEY.format(parking_lot_id=parking_lot_id) for parking_lot_id in batch]
+        # Otherwise a concurrent request could cache the old profile again before the new one is committed.
+        transaction.on_commit(partial(cache.delete_many, cache_keys))
+    return len(parking_lot_ids)
+
+
+def _rounded(values: np.ndarray) -> list[float | None]:
+    return [None if np.isnan(value) else round(float(value), 1) for value in values]
+
+
+def serialize_profile(profile: OccupancyProfile) -> dict[str, Any]:
+    statistics = np.frombuffer(profile.statistics, dtype=STATISTICS_DTYPE).reshape(-1, HOURS_PER_WEEK)
+    forecast = np.frombuffer(profile.forecast, dtype=STATISTICS_DTYPE)
+    mean, *percentiles = (_rounded(row) for row in statistics)
+    hours = [
+        {
+            "hour_of_week": hour,
+            "mean": mean[hour],
+            **{f"p{percentile}": values[hour] for percentile, values in zip(PERCENTILES, percentiles, strict=True)},
+        }
+        for hour in range(HOURS_PER_WEEK)
+    ]
+    return {
+        "parking_lot_id": profile.parking_lot_id,  # pyright: ignore[reportAttributeAccessIssue]
+        "updated_at": profile.updated_at,
+        "hours": hours,
+        "forecast": [
+            {"timestamp": profile.forecast_start + timedelta(hours=step), "occupied_spots": occupied_spots}
+            for step, occupied_spots in enumerate(_rounded(forecast))
+        ],
+    }
+
+
+def cached_profile(parking_lot_id: int) -> dict[str, Any] | None:
+    """The serialized profile of the parking lot, read from the cache and stored there on a miss."""
+    cache_key = PROFILE_CACHE_KEY.format(parking_lot_id=parking_lot_id)
+    if (serialized_profile := cache.get(cache_key)) is not None:
+        return serialized_profile
+    profile = OccupancyProfile.objects.filter(parking_lot_id=parking_lot_id).first()
+    if profile is None:
+        return None
+    serialized_profile = serialize_profile(profile)
+    cache.set(cache_key, serialized_profile, PROFILE_CACHE_TIMEOUT)
+    return serialized_profile
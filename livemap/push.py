@@ -0,0 +1,150 @@
+"""Push of the current occupancy changes to the map viewers with Server-Sent Events.
+
+Every ASGI process has a single broadcaster that fans the changes out to its connections. A connection keeps only the
+latest change of every parking lot until it is sent, so a slow viewer holds at most one change per parking lot.
+Without `PUSH_BROKER_URL` the changes committed in a process reach the viewers of that process only. With it, the
+changes are published to a Redis channel that every process listens to, so the readings ingested by any process or
+Celery worker reach all viewers.
+"""
+
+import asyncio
+import json
+import logging
+from collections.abc import AsyncIterator, Iterable
+from functools import lru_cache
+
+import redis
+import redis.asyncio
+from django.conf import settings
+
+from .models import CurrentOccupancy
+
+logger = logging.getLogger(__name__)
+
+OCCUPANCY_CHANNEL = "livemap:occupancy"
+# A comment is sent to idle connections at this interval in seconds, so that proxies do not close them.
+HEARTBEAT_INTERVAL = 15
+# Seconds to wait before listening to the broker again after it failed.
+BROKER_RETRY_INTERVAL = 5
+RECONNECT_MILLISECONDS = 5000
+
+
+class Subscription:
+    """Changes of the parking lots waiting to be sent to a viewer, the latest one per parking lot."""
+
+    def __init__(self) -> None:
+        self.pending: dict[int, str] = {}
+        self.changed = asyncio.Event()
+
+    def push(self, changes: dict[int, str]) -> None:
+        self.pending.update(changes)
+        self.changed.set()
+
+    async def next(self) -> list[str]:
+        """The changes that arrived since the previous call, waiting for them if there are none."""
+        await self.changed.wait()
+        self.changed.clear()
+        changes, self.pending = list(self.pending.values()), {}
+        return changes
+
+
+class Broadcaster:
+    """Fans the changes out to the subscriptions of the event loop of the process."""
+
+    def __init__(self) -> None:
+        self.subscriptions: set[Subscription] = set()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._listener: asyncio.Task | None = None
+
+    def subscribe(self) -> Subscription:
+        """Subscribe to the changes. Must be called in the event loop that serves the connections."""
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop, self._listener, self.subscriptions = loop, None, set()
+        if settings.PUSH_BROKER_URL and (self._listener is None or self._listener.done()):
+            self._listener = loop.create_task(self._listen(settings.PUSH_BROKER_URL))
+        subscription = Subscription()
+        self.subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        self.subscriptions.discard(subscription)
+
+    def deliver(self, changes: dict[int, str]) -> None:
+        """Pass the changes to every subscription. Must be called in the event loop."""
+        for subscription in self.subscriptions:
+            subscription.push(changes)
+
+    def publish(self, changes: dict[int, str]) -> None:
+        """Pass the changes to the subscriptions from any thread."""
+        if self.subscriptions and self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self.deliver, changes)
+
+    async def _listen(self, url: str) -> None:
+        while True:
+            try:
+                async with redis.asyncio.from_url(url) as client, client.pubsub() as pubsub:
+                    await pubsub.subscribe(OCCUPANCY_CHANNEL)
+                    async for message in pubsub.listen():
+                        if message["type"] == "message":
+                            self.deliver(_encode(json.loads(message["data"])))
+            except (redis.RedisError, OSError, ValueError):
+                logger.warning("Listening to the occupancy changes failed", exc_info=True)
+            await asyncio.sleep(BROKER_RETRY_INTERVAL)
+
+
+broadcaster = Broadcaster()
+
+
+def _encode(changes: Iterable[dict]) -> dict[int, str]:
+    # Every change is encoded once for all the viewers.
+    return {change["parking_lot_id"]: json.dumps(change, separators=(",", ":")) for change in changes}
+
+
+@lru_cache(maxsize=1)
+def _broker(url: str) -> redis.Redis:
+    return redis.Redis.from_url(url)
+
+
+def publish_current_occupancy(parking_lot_ids: list[int]) -> None:
+    """Send the current occupancy of the parking lots to the viewers of all processes."""
+    if not settings.PUSH_BROKER_URL and not broadcaster.subscriptions:
+        return
+    changes = [
+        {
+            "parking_lot_id": parking_lot_id,
+            "occupied_spots": occupied_spots,
+            "free_spots": max(total_spots - occupied_spots, 0),
+            "timestamp": timestamp.isoformat(),
+        }
+        for parking_lot_id, occupied_spots, total_spots, timestamp in CurrentOccupancy.objects.filter(
+            parking_lot_id__in=parking_lot_ids
+        ).values_list("parking_lot_id", "occupied_spots", "parking_lot__total_spots", "timestamp")
+    ]
+    if not changes:
+        return
+    if not settings.PUSH_BROKER_URL:
+        broadcaster.publish(_encode(changes))
+        return
+    try:
+        _broker(settings.PUSH_BROKER_URL).publish(OCCUPANCY_CHANNEL, json.dumps(changes))
+    except redis.RedisError:
+        # The viewers catch up on the next change.
+        logger.warning("Publishing the occupancy changes failed", exc_info=True)
+
+
+async def occupancy_events() -> AsyncIterator[str]:
+    """Server-Sent Events with the batches of the current occupancy changes, as JSON lists of the changes."""
+    subscription = broadcaster.subscribe()
+    try:
+        yield f"retry: {RECONNECT_MILLISECONDS}\n\n"
+        while True:
+            try:
+                async with asyncio.timeout(HEARTBEAT_INTERVAL):
+                    changes = await subscription.next()
+            except TimeoutError:
+                yield ": heartbeat\n\n"
+                continue
+            yield f"event: occupancy\ndata: [{','.join(changes)}]\n\n"
+    finally:
+        broadcaster.unsubscribe(subscription)
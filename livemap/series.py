@@ -0,0 +1,105 @@
+"""Occupancy time series bucketed inside the database.
+
+Closed hours are read from `HourlyOccupancySummary` and the hours after the aggregation watermark from the raw
+`Occupancy` readings. Minute buckets are only available within the retention period of the raw readings.
+"""
+
+from collections import defaultdict
+from datetime import UTC, date, datetime, time, timedelta
+from functools import lru_cache
+from typing import Any
+
+from django.db.models import Avg, Count, Q, QuerySet, Sum
+from django.db.models.functions import TruncDay, TruncHour, TruncMinute, TruncWeek
+
+from .models import AggregationWatermark, HourlyOccupancySummary, Occupancy, ParkingLot
+from .tasks import HOURLY_OCCUPANCY_WATERMARK
+
+BUCKETS = {
+    "minute": timedelta(minutes=1),
+    "hour": timedelta(hours=1),
+    "day": timedelta(days=1),
+    "week": timedelta(weeks=1),
+}
+TRUNCATE_FUNCTIONS = {"minute": TruncMinute, "hour": TruncHour, "day": TruncDay, "week": TruncWeek}
+
+
+def floor_to_bucket(moment: datetime, bucket: str) -> datetime:
+    if bucket == "minute":
+        return moment.replace(second=0, microsecond=0)
+    if bucket == "hour":
+        return moment.replace(minute=0, second=0, microsecond=0)
+    day = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    return day - timedelta(days=day.weekday()) if bucket == "week" else day
+
+
+def _raw_series(
+    parking_lots: QuerySet[ParkingLot], start: datetime, end: datetime, bucket: str
+) -> dict[datetime, float]:
+    readings = (
+        Occupancy.objects.filter(parking_lot__in=parking_lots, timestamp__gte=start, timestamp__lt=end)
+        .annotate(bucket=TRUNCATE_FUNCTIONS[bucket]("timestamp", tzinfo=UTC))
+        .values("bucket")
+        .annotate(avg_occupied_spots=Avg("occupied_spots"))
+        .order_by()
+    )
+    return {reading["bucket"]: reading["avg_occupied_spots"] for reading in readings}
+
+
+def _summary_series(
+    parking_lots: QuerySet[ParkingLot], start: datetime, end: datetime, bucket: str
+) -> dict[datetime, float]:
+    """Average of the hourly summaries of the hours that start between `start` and `end`."""
+    start_hour = floor_to_bucket(start, "hour")
+    end_hour = floor_to_bucket(end, "hour")
+    if end_hour < end:
+        end_hour += BUCKETS["hour"]
+    summaries = HourlyOccupancySummary.objects.filter(
+        Q(date__gt=start_hour.date()) | Q(date=start_hour.date(), hour__gte=start_hour.hour),
+        Q(date__lt=end_hour.date()) | Q(date=end_hour.date(), hour__lt=end_hour.hour),
+        parking_lot__in=parking_lots,
+    ).order_by()
+    if bucket == "hour":
+        rows = summaries.values_list("date", "hour").annotate(avg_occupied_spots=Avg("avg_occupied_spots"))
+        return {_midnight(day) + timedelta(hours=hour): avg_occupied_spots for day, hour, avg_occupied_spots in rows}
+
+    # Days are folded into weeks here: the days are few, while truncating every row to a week is not native to
+    # all databases.
+    rows = summaries.values_list("date").annotate(total=Sum("avg_occupied_spots"), hours=Count("id"))
+    totals: dict[datetime, list[int]] = defaultdict(lambda: [0, 0])
+    for day, total, hours in rows:
+        bucket_start = floor_to_bucket(_midnight(day), bucket)
+        totals[bucket_start][0] += total
+        totals[bucket_start][1] += hours
+    return {bucket_start: total / hours for bucket_start, (total, hours) in totals.items()}
+
+
+@lru_cache(maxsize=1024)
+def _midnight(day: date) -> datetime:
+    return datetime.combine(day, time(), tzinfo=UTC)
+
+
+def occupancy_series(
+    parking_lots: QuerySet[ParkingLot], start: datetime, end: datetime, bucket: str
+) -> list[dict[str, Any]]:
+    """Average occupied spots of the `parking_lots` per `bucket` between `start` and `end` in chronological order."""
+    watermark = (
+        AggregationWatermark.objects.filter(name=HOURLY_OCCUPANCY_WATERMARK).values_list("timestamp", flat=True).first()
+    )
+    boundary = start if bucket == "minute" or watermark is None else min(max(watermark, start), end)
+    summary_series = _summary_series(parking_lots, start, boundary, bucket) if boundary > start else {}
+    raw_series = _raw_series(parking_lots, boundary, end, bucket) if end > boundary else {}
+
+    series = {**summary_series, **raw_series}
+    # The bucket around the watermark is read from both sources, so the averages are weighted by the time they cover.
+    for bucket_start in summary_series.keys() & raw_series.keys():
+        summary_duration = boundary - max(bucket_start, start)
+        raw_duration = min(bucket_start + BUCKETS[bucket], end) - boundary
+        series[bucket_start] = (
+            summary_series[bucket_start] * summary_duration + raw_series[bucket_start] * raw_duration
+        ) / (summary_duration + raw_duration)
+
+    return [
+        {"timestamp": bucket_start, "avg_occupied_spots": round(avg_occupied_spots, 2)}
+        for bucket_start, avg_occupied_spots in sorted(series.items())
+    ]
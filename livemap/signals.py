@@ -0,0 +1,82 @@
+"""Invalidate the cached livemap popups and grid index, bump the model version stamps and push occupancy changes."""
+
+from functools import partial
+from typing import Any
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .clusters import invalidate_grid_index
+from .markers import invalidate_popups
+from .models import (
+    Address,
+    City,
+    Country,
+    CurrentOccupancy,
+    Occupancy,
+    ParkingLot,
+    VideoStreamSource,
+    current_occupancy_refreshed,
+    stream_leases_changed,
+)
+from .push import publish_current_occupancy
+from .versions import bump_model_versions
+
+
+def _invalidate_on_commit(parking_lot_ids: list[int]) -> None:
+    # Otherwise a concurrent request could cache the old popups again before the change is committed.
+    if parking_lot_ids:
+        transaction.on_commit(partial(invalidate_popups, parking_lot_ids))
+
+
+@receiver(post_save, sender=ParkingLot)
+@receiver(post_delete, sender=ParkingLot)
+def invalidate_parking_lot(instance: ParkingLot, **_kwargs: Any) -> None:
+    _invalidate_on_commit([instance.pk])
+    bump_model_versions(ParkingLot)
+    # Free spots are refreshed in the grid index by its timeout, but the coordinates and spots are not.
+    transaction.on_commit(invalidate_grid_index)
+
+
+@receiver(post_save, sender=VideoStreamSource)
+@receiver(post_delete, sender=VideoStreamSource)
+@receiver(post_save, sender=CurrentOccupancy)
+@receiver(post_delete, sender=CurrentOccupancy)
+def invalidate_parking_lot_details(instance: VideoStreamSource | CurrentOccupancy, **_kwargs: Any) -> None:
+    _invalidate_on_commit([instance.parking_lot_id])  # pyright: ignore[reportAttributeAccessIssue]
+    bump_model_versions(type(instance))
+    if isinstance(instance, CurrentOccupancy):
+        # A deleted current occupancy is not found, so nothing is pushed for it.
+        transaction.on_commit(partial(publish_current_occupancy, [instance.parking_lot_id]))
+
+
+@receiver(current_occupancy_refreshed)
+def invalidate_current_occupancies(parking_lot_ids: list[int], **_kwargs: Any) -> None:
+    _invalidate_on_commit(parking_lot_ids)
+    if parking_lot_ids:
+        bump_model_versions(CurrentOccupancy)
+        transaction.on_commit(partial(publish_current_occupancy, parking_lot_ids))
+
+
+@receiver(stream_leases_changed)
+def bump_video_stream_sources(**_kwargs: Any) -> None:
+    bump_model_versions(VideoStreamSource)
+
+
+# The expired records are purged with raw deletes, which bump the version once instead.
+@receiver(post_save, sender=Occupancy)
+@receiver(post_delete, sender=Occupancy)
+def bump_occupancy(**_kwargs: Any) -> None:
+    bump_model_versions(Occupancy)
+
+
+@receiver(post_save, sender=Address)
+@receiver(post_save, sender=City)
+@receiver(post_save, sender=Country)
+def invalidate_location(instance: Address | City | Country, **_kwargs: Any) -> None:
+    # Deleted locations cascade to their parking lots, which are invalidated on their own.
+    lookup = {Address: "address", City: "address__city", Country: "address__city__country"}[type(instance)]
+    _invalidate_on_commit(list(ParkingLot.objects.filter(**{lookup: instance}).values_list("id", flat=True)))
+    # Parking lots are listed with their addresses.
+    bump_model_versions(ParkingLot)
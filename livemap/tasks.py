@@ -1,53 +1,236 @@
+from datetime import UTC, datetime, timedelta
+from itertools import groupby
+from operator import itemgetter
+from time import perf_counter
+
 from celery import shared_task
 from celery.utils.log import get_task_logger
+from django.conf import settings
 from django.db import transaction
-from django.db.models import Avg, Max
-from django.db.models.functions import TruncDate, TruncHour
+from django.db.models import Avg
 
-from .models import HourlyOccupancySummary, Occupancy
+from . import buffer
+from .db import bulk_upsert
+from .models import (
+    HOURLY_OCCUPANCY_WATERMARK,
+    AggregationWatermark,
+    HourlyOccupancySummary,
+    Occupancy,
+    VideoStreamSource,
+    _floor_to_hour,
+)
+from .partitions import OccupancyPartitions
+from .profiles import changed_parking_lots, rebuild_profiles
+from .versions import bump_model_versions
 
 logger = get_task_logger(__name__)
 
+AGGREGATION_WINDOW = timedelta(hours=1)
+SUMMARY_BATCH_SIZE = 1000
+OCCUPANCY_PROFILES_WATERMARK = "occupancy_profiles"
 
-@shared_task(name="Aggregate occupancy and delete old records")
-def aggregate_occupancy_and_delete_old_records() -> None:
-    """Aggregate occupancy statistics by hours and delete old records to free up space.
-    Remove all but the newest Occupancy records per `parking_lot`.
-    """
-    aggregated_occupancy = (
-        Occupancy.objects.annotate(date=TruncDate("timestamp"), hour=TruncHour("timestamp"))
-        .values("parking_lot", "date", "hour")
+
+def _hold_limit() -> timedelta:
+    # A keep-alive reading is stored with the first reading of the stream after `OCCUPANCY_KEEPALIVE_SECONDS`.
+    return timedelta(seconds=settings.OCCUPANCY_KEEPALIVE_SECONDS + max(VideoStreamSource.ProcessingRate.values))
+
+
+def _averages(start: datetime, end: datetime) -> dict[int, float]:
+    """Average occupied spots of the parking lots with readings between `start` and `end`, computed by the database."""
+    return dict(
+        Occupancy.objects.filter(timestamp__gte=start, timestamp__lt=end)
+        .values_list("parking_lot")
         .annotate(avg_occupied_spots=Avg("occupied_spots"))
+        .order_by()
     )
 
-    # Remove all but the newest Occupancy records per parking_lot.
-    # Step 1: Get the latest timestamp per parking lot.
-    latest_per_lot = Occupancy.objects.values("parking_lot").annotate(latest=Max("timestamp"))
 
-    # Step 2: Build a set of IDs of the newest records to preserve.
-    latest_ids = set(
-        Occupancy.objects.filter(
-            parking_lot__in=[entry["parking_lot"] for entry in latest_per_lot],
-            timestamp__in=[entry["latest"] for entry in latest_per_lot],
-        ).values_list("id", flat=True)
+def _time_weighted_averages(start: datetime, end: datetime) -> dict[int, float]:
+    """Average occupied spots of the parking lots with readings between `start` and `end`, weighted by time.
+
+    A reading holds until the next reading of its parking lot, or for `_hold_limit()` at most when its camera stops
+    reporting, so the readings stored only when the occupancy changes are averaged like every reading being stored.
+    The reading held at `start` is carried into the window. Only used with `OCCUPANCY_CHANGES_ONLY`, since the rows
+    are read into Python.
+    """
+    hold_limit = _hold_limit()
+    readings = (
+        Occupancy.objects.filter(timestamp__gte=start - hold_limit, timestamp__lt=end)
+        .order_by("parking_lot", "timestamp")
+        .values_list("parking_lot", "timestamp", "occupied_spots")
     )
+    averages = {}
+    for parking_lot_id, lot_readings in groupby(readings.iterator(), key=itemgetter(0)):
+        timestamps, occupied_spots = zip(*((timestamp, spots) for _, timestamp, spots in lot_readings), strict=True)
+        if timestamps[-1] < start:
+            continue
+        weighted_spots = total_seconds = 0.0
+        for timestamp, next_timestamp, spots in zip(timestamps, (*timestamps[1:], end), occupied_spots, strict=True):
+            held_seconds = (min(next_timestamp, timestamp + hold_limit, end) - max(timestamp, start)).total_seconds()
+            if held_seconds > 0:
+                weighted_spots += spots * held_seconds
+                total_seconds += held_seconds
+        averages[parking_lot_id] = weighted_spots / total_seconds if total_seconds else occupied_spots[-1]
+    return averages
+
 
+def _aggregate_hourly_occupancy(start: datetime, end: datetime) -> list[HourlyOccupancySummary]:
+    """Average occupancy per parking lot for every hour between `start` and `end`.
+
+    Each hour is aggregated separately with a plain range condition on `timestamp`, so the database can use the index
+    instead of grouping the whole table by a computed date and hour. Empty gaps are skipped with an index lookup.
+    With `OCCUPANCY_CHANGES_ONLY`, the readings are weighted by the time they hold.
+    """
+    averages = _time_weighted_averages if settings.OCCUPANCY_CHANGES_ONLY else _averages
+    summaries = []
+    window_start = _floor_to_hour(start)
+    while window_start < end:
+        window_end = window_start + AGGREGATION_WINDOW
+        summaries.extend(
+            HourlyOccupancySummary(
+                parking_lot_id=parking_lot_id,
+                avg_occupied_spots=round(avg_occupied_spots),
+                hour=window_start.hour,
+                date=window_start.date(),
+            )
+            for parking_lot_id, avg_occupied_spots in averages(window_start, window_end).items()
+        )
+        next_timestamp = (
+            Occupancy.objects.filter(timestamp__gte=window_end, timestamp__lt=end)
+            .order_by("timestamp")
+            .values_list("timestamp", flat=True)
+            .first()
+        )
+        if next_timestamp is None:
+            break
+        window_start = _floor_to_hour(next_timestamp)
+    return summaries
+
+
+def _aggregate_closed_hours() -> datetime | None:
+    """Aggregate the hours closed since the watermark and move it forward. Return the new watermark."""
+    now = datetime.now(UTC)
+    if settings.OCCUPANCY_WRITE_BEHIND:
+        # The buffered readings keep the time they arrived at, so they may belong to an hour that is already closed.
+        buffer.flush(settings.OCCUPANCY_FLUSH_BATCH_SIZE)
+        now -= buffer.MAX_FLUSH_LAG
+    end = _floor_to_hour(now)
     with transaction.atomic(durable=True):
-        occupancy_summary_count = 0
-        for item in aggregated_occupancy:
-            hour = item["hour"].hour
-            date = item["date"].isoformat()
-            if not HourlyOccupancySummary.objects.filter(
-                parking_lot_id=item["parking_lot"], hour=hour, date=date
-            ).exists():
-                HourlyOccupancySummary.objects.create(
-                    parking_lot_id=item["parking_lot"],
-                    avg_occupied_spots=round(item["avg_occupied_spots"]),
-                    hour=hour,
-                    date=date,
-                )
-                occupancy_summary_count += 1
-        # Step 3: Delete all other records.
-        count, _ = Occupancy.objects.exclude(id__in=latest_ids).delete()
-    logger.info("Inserted %s occupancy aggregations", occupancy_summary_count)
-    logger.info("Deleted %s old occupancy records. %s newest left", count, len(latest_ids))
+        # Lock the watermark so that concurrent runs do not aggregate the same hours.
+        watermark = AggregationWatermark.objects.select_for_update().filter(name=HOURLY_OCCUPANCY_WATERMARK).first()
+        start = (
+            watermark.timestamp
+            if watermark
+            else Occupancy.objects.order_by("timestamp").values_list("timestamp", flat=True).first()
+        )
+        if start is None or start >= end:
+            logger.info("No closed hours to aggregate")
+            return watermark.timestamp if watermark else None
+
+        summaries = _aggregate_hourly_occupancy(start, end)
+        # The hours are complete, so re-aggregating one after a failed run may safely overwrite its summary.
+        bulk_upsert(
+            HourlyOccupancySummary,
+            summaries,
+            unique_fields=["parking_lot", "hour", "date"],
+            update_fields=["avg_occupied_spots"],
+            batch_size=SUMMARY_BATCH_SIZE,
+        )
+        AggregationWatermark.objects.update_or_create(name=HOURLY_OCCUPANCY_WATERMARK, defaults={"timestamp": end})
+    logger.info("Aggregated %s hourly occupancy summaries until %s", len(summaries), end.isoformat())
+    return end
+
+
+def purge_occupancy(cutoff: datetime, batch_size: int) -> dict[str, float]:
+    """Delete the occupancy records older than `cutoff` in primary key ranges of up to `batch_size` records.
+
+    Every range is deleted in its own short transaction, so that ingestion is not blocked for the whole purge.
+    """
+    deleted = batches = 0
+    start_time = perf_counter()
+    old_records = Occupancy.objects.filter(timestamp__lt=cutoff)
+    while batch_ids := list(old_records.order_by("id").values_list("id", flat=True)[:batch_size]):
+        batch = old_records.filter(id__gte=batch_ids[0], id__lte=batch_ids[-1])
+        with transaction.atomic():
+            # A single DELETE, instead of loading every record for the `post_delete` receiver. The version is bumped
+            # once below.
+            count = batch._raw_delete(batch.db)  # noqa: SLF001
+        deleted += count
+        batches += 1
+        logger.info("Purge batch %s: deleted %s occupancy records (%s in total)", batches, count, deleted)
+    if deleted:
+        bump_model_versions(Occupancy)
+
+    seconds = perf_counter() - start_time
+    metrics = {
+        "deleted": deleted,
+        "batches": batches,
+        "seconds": round(seconds, 3),
+        "rows_per_second": round(deleted / seconds, 1) if seconds else 0.0,
+    }
+    logger.info("Purged occupancy records older than %s: %s", cutoff.isoformat(), metrics)
+    return metrics
+
+
+@shared_task(name="Aggregate occupancy and delete old records")
+def aggregate_occupancy_and_delete_old_records() -> dict[str, float]:
+    """Aggregate occupancy statistics of the closed hours and delete old records to free up space.
+
+    Only the hours after the persisted watermark are processed, so the cost of a run is proportional to the new data.
+    Records of the hour in progress are left intact until the hour is closed. Aggregated records are purged once they
+    are older than `OCCUPANCY_RETENTION_HOURS`, by dropping whole daily partitions where possible. The latest occupancy
+    of every parking lot remains available in `CurrentOccupancy`.
+    """
+    watermark = _aggregate_closed_hours()
+    if watermark is None:
+        return {}
+    # Never purge the records that are not aggregated yet.
+    cutoff = min(watermark, datetime.now(UTC) - timedelta(hours=settings.OCCUPANCY_RETENTION_HOURS))
+    if settings.OCCUPANCY_PARTITIONING and (dropped_days := OccupancyPartitions().drop_older_than(cutoff)):
+        logger.info("Dropped occupancy partitions of %s", ", ".join(day.isoformat() for day in dropped_days))
+        bump_model_versions(Occupancy)
+    # Records of the partially expired day, or all the old records if the table is not partitioned.
+    return purge_occupancy(cutoff, settings.OCCUPANCY_PURGE_BATCH_SIZE)
+
+
+@shared_task(name="Maintain occupancy partitions")
+def maintain_occupancy_partitions() -> list[str]:
+    """Create the daily `Occupancy` partitions for the upcoming days. Schedule it at least once a day."""
+    if not settings.OCCUPANCY_PARTITIONING:
+        return []
+    created_days = OccupancyPartitions().ensure(datetime.now(UTC).date(), settings.OCCUPANCY_PARTITIONS_AHEAD_DAYS)
+    logger.info("Created %s occupancy partitions", len(created_days))
+    return [day.isoformat() for day in created_days]
+
+
+@shared_task(name="Build occupancy profiles")
+def build_occupancy_profiles() -> int:
+    """Rebuild the typical-week profiles and forecasts of the parking lots with new hourly summaries.
+
+    Schedule it after the aggregation. Return the number of rebuilt profiles.
+    """
+    summaries_watermark = AggregationWatermark.objects.filter(name=HOURLY_OCCUPANCY_WATERMARK).first()
+    if summaries_watermark is None:
+        return 0
+    end = summaries_watermark.timestamp
+    with transaction.atomic(durable=True):
+        # Lock the watermark so that concurrent runs do not rebuild the same profiles.
+        watermark, _ = AggregationWatermark.objects.select_for_update().get_or_create(
+            name=OCCUPANCY_PROFILES_WATERMARK, defaults={"timestamp": datetime.min.replace(tzinfo=UTC)}
+        )
+        if watermark.timestamp >= end:
+            return 0
+        rebuilt = rebuild_profiles(changed_parking_lots(watermark.timestamp, end), end)
+        watermark.timestamp = end
+        watermark.save(update_fields=["timestamp"])
+    logger.info("Rebuilt %s occupancy profiles from the summaries until %s", rebuilt, end.isoformat())
+    return rebuilt
+
+
+@shared_task(name="Flush occupancy buffer")
+def flush_occupancy_buffer() -> dict[str, int]:
+    """Save the readings buffered with `OCCUPANCY_WRITE_BEHIND` in large batches. Schedule it every few seconds."""
+    metrics = buffer.flush(settings.OCCUPANCY_FLUSH_BATCH_SIZE)
+    if metrics["read"]:
+        logger.info("Flushed the occupancy buffer: %s", metrics)
+    return metrics
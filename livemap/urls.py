@@ -1,15 +1,20 @@
 from django.urls import include, path
 from rest_framework import routers
 
-from livemap.drf.view_sets import OccupancyViewSet, VideoStreamSourceViewSet
-from livemap.views import index
+from livemap.drf.ingest import ingest_occupancy
+from livemap.drf.view_sets import OccupancyViewSet, ParkingLotViewSet, VideoStreamSourceViewSet
+from livemap.views import events, index
 
 router = routers.DefaultRouter()
 router.register(r"video-stream-sources", VideoStreamSourceViewSet)
 router.register(r"occupancy", OccupancyViewSet)
+router.register(r"parking-lots", ParkingLotViewSet, basename="parking-lot")
 
 urlpatterns = [
     path("livemap/", index, name="index"),
+    path("livemap/events/", events, name="occupancy-events"),
+    # Before the router, which would take it for an occupancy record.
+    path("api/occupancy/ingest/", ingest_occupancy, name="occupancy-ingest"),
     path("api/", include(router.urls)),
 ]
 
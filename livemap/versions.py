@@ -0,0 +1,85 @@
+"""Version stamps of the models, which answer repeated polls with 304 Not Modified without querying the database.
+
+A stamp is the time in nanoseconds of the last change of a model, kept in the cache and bumped when the change is
+committed (see `livemap.signals`). Changes made with queryset updates and bulk deletes bump the stamps explicitly.
+"""
+
+import hashlib
+import time
+from collections.abc import Callable, Iterable
+from functools import wraps
+from http import HTTPStatus
+from typing import Any
+
+from django.core.cache import cache
+from django.db import models, transaction
+from django.http import HttpRequest, HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+MODEL_VERSION_CACHE_KEY = "model_version:{label}"
+# Stamps are only replaced on changes.
+MODEL_VERSION_CACHE_TIMEOUT = None
+NANOSECONDS = 1_000_000_000
+
+
+def _cache_key(model: type[models.Model]) -> str:
+    return MODEL_VERSION_CACHE_KEY.format(label=model._meta.label_lower)  # noqa: SLF001
+
+
+def model_versions(model_classes: Iterable[type[models.Model]]) -> list[int]:
+    """Version stamps of the models, with a single cache read unless a stamp was evicted."""
+    cache_keys = [_cache_key(model) for model in model_classes]
+    versions = cache.get_many(cache_keys)
+    # An evicted stamp starts from the clock, so it differs from the stamps before the eviction.
+    return [
+        versions[cache_key]
+        if cache_key in versions
+        else cache.get_or_set(cache_key, time.time_ns, MODEL_VERSION_CACHE_TIMEOUT)
+        for cache_key in cache_keys
+    ]
+
+
+def bump_model_versions(*model_classes: type[models.Model]) -> None:
+    """Stamp the models as changed once the current transaction is committed."""
+
+    def bump() -> None:
+        version = time.time_ns()
+        cache.set_many({_cache_key(model): version for model in model_classes}, MODEL_VERSION_CACHE_TIMEOUT)
+
+    # Otherwise a concurrent request could tag the data from before the change with the new stamp.
+    transaction.on_commit(bump)
+
+
+def conditional(
+    *model_classes: type[models.Model], vary: Callable[[HttpRequest], object] | None = None
+) -> Callable[[Callable[..., HttpResponse]], Callable[..., HttpResponse]]:
+    """Answer GET requests with 304 Not Modified while the models are unchanged, without calling the view.
+
+    The ETag is derived from the stamps of the models, the requested URL and representation, and `vary(request)`,
+    for the views that also depend on something else. The Last-Modified date is the newest of the stamps.
+    """
+
+    def decorator(view: Callable[..., HttpResponse]) -> Callable[..., HttpResponse]:
+        @wraps(view)
+        def wrapper(request: HttpRequest, *args: Any, **kwargs: Any) -> HttpResponse:
+            if request.method not in ("GET", "HEAD"):
+                return view(request, *args, **kwargs)
+            # The stamps are read before the data, so the data is never older than its ETag.
+            versions = model_versions(model_classes)
+            parts = [*versions, request.get_full_path(), request.headers.get("Accept", "")]
+            if vary is not None:
+                parts.append(vary(request))
+            etag = quote_etag(hashlib.md5(repr(parts).encode(), usedforsecurity=False).hexdigest())
+            last_modified = max(versions) // NANOSECONDS
+            if (response := get_conditional_response(request, etag=etag, last_modified=last_modified)) is not None:
+                return response
+            response = view(request, *args, **kwargs)
+            if HTTPStatus(response.status_code).is_success:
+                response.headers.setdefault("ETag", etag)
+                response.headers.setdefault("Last-Modified", http_date(last_modified))
+            return response
+
+        return wrapper
+
+    return decorator
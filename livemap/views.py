@@ -1,18 +1,16 @@
-from functools import lru_cache
-from http import HTTPStatus
-
 import folium
-import requests  # type: ignore[import]
 from django.core.handlers.wsgi import WSGIRequest
-from django.http import HttpResponse
+from django.http import HttpRequest, HttpResponse, StreamingHttpResponse
 from django.shortcuts import render
+from django.urls import reverse
 
+from livemap.geolocation import geolocate
+from livemap.markers import MarkerLayer
 from livemap.models import ParkingLot
-
-NUMBER_OF_COORDINATES = 2
+from livemap.push import occupancy_events
+from livemap.versions import conditional
 
 
-@lru_cache
 def _extract_client_ip_address(request: WSGIRequest) -> str | None:
     req_headers = request.META
     if x_forwarded_for_value := req_headers.get("HTTP_X_FORWARDED_FOR"):
@@ -22,68 +20,26 @@ def _extract_client_ip_address(request: WSGIRequest) -> str | None:
     return ip_addr
 
 
-@lru_cache
-def _fetch_geolocation(ip_address: str) -> tuple[float, float] | None:
-    response = requests.get(f"https://ipinfo.io/{ip_address}/json", timeout=3000)
-
-    if response.status_code == HTTPStatus.OK:
-        data = response.json()
-        location = data.get("loc", "").split(",")
-        if len(location) == NUMBER_OF_COORDINATES:
-            latitude, longitude = location
-            return float(latitude), float(longitude)
-    return None
-
-
-def _compose_html_table(parking: ParkingLot) -> str:
-    parking_popup = {
-        "Address": "<a href='https://www.google.com/maps/search/?api=1&query="
-        f"{parking.latitude},{parking.longitude}'>{parking.address}</a>",
-        "Private": parking.get_is_private,
-        "Free": parking.get_is_free,
-        "Total spots": parking.total_spots,
-        "Spots for disables": spots_for_disabled if (spots_for_disabled := parking.spots_for_disabled) else "",
-        "Free spots": parking.total_spots - parking.occupancies.latest().occupied_spots  # pyright: ignore[reportAttributeAccessIssue]
-        if parking.occupancies.exists()  # pyright: ignore[reportAttributeAccessIssue]
-        else "",
-    }
-    lives = "- Live "
-    for stream_source in parking.stream_sources.filter(parking_lot_id=parking.id):  # pyright: ignore[reportAttributeAccessIssue]
-        lives += f"<a href='{stream_source.stream_source}'> 🔴 </a>"
-
-    html_table = f"""
-    <table class="styled-table" style="width:100%">
-        <thead>
-            <tr>
-                <th colspan="2">
-                    Parking details {lives}
-                </th>
-            </tr>
-        </thead>
-    """
-    for field, value in parking_popup.items():
-        html_table += f"""
-        <tr>
-            <td>{field}</td>
-            <td>{value}</td>
-        </tr>
-        """
-    html_table += """
-    </table>
-    """
-    return html_table
+def _client_geolocation(request: WSGIRequest) -> tuple[float, float] | None:
+    client_ip_address = _extract_client_ip_address(request)
+    return geolocate(client_ip_address) if client_ip_address else None
 
 
+# The page embeds the map around the client, and is refreshed along with the parking lots.
+@conditional(ParkingLot, vary=_client_geolocation)
 def index(request: WSGIRequest) -> HttpResponse:
-    parkings = ParkingLot.objects.select_related("address", "address__city", "address__city__country").prefetch_related(
-        "occupancies", "stream_sources"
-    )
-    client_ip_address = _extract_client_ip_address(request)
-    geolocation = _fetch_geolocation(client_ip_address) if client_ip_address else None
-    folium_map = folium.Map(geolocation)
+    folium_map = folium.Map(_client_geolocation(request))
 
-    for parking in parkings:
-        popup = _compose_html_table(parking)
-        folium.Marker([parking.latitude, parking.longitude], folium.Popup(popup)).add_to(folium_map)
+    # The markers of the viewport are loaded as the user pans, so the page is the same size for any number of them.
+    MarkerLayer(reverse("livemap:parking-lot-geojson"), reverse("livemap:occupancy-events")).add_to(folium_map)
 
     return render(request, "index.html", {"map": folium_map.get_root().render()})
+
+
+async def events(request: HttpRequest) -> StreamingHttpResponse:  # noqa: ARG001
+    """Current occupancy changes pushed to the map. Needs an ASGI server to hold many connections."""
+    response = StreamingHttpResponse(occupancy_events(), content_type="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    # Stop nginx from buffering the events.
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
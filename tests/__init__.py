@@ -1,3 +1,5 @@
+from collections.abc import Sequence
+from datetime import datetime, timedelta
 from typing import TYPE_CHECKING
 
 from django.contrib.auth import get_user_model
@@ -11,6 +13,51 @@ if TYPE_CHECKING:
 fake = Faker()
 
 
+def create_parking_lots(address: Address, number: int) -> list[ParkingLot]:
+    return ParkingLot.objects.bulk_create(
+        ParkingLot(
+            address=address,
+            total_spots=fake.pyint(min_value=1),
+            latitude=fake.latitude(),
+            longitude=fake.longitude(),
+        )
+        for _ in range(number)
+    )
+
+
+def create_video_stream_sources(
+    parking_lots: Sequence[ParkingLot], per_lot: int, processing_rate: int | None = None
+) -> list[VideoStreamSource]:
+    streams = []
+    for parking_lot in parking_lots:
+        lot_processing_rate = processing_rate or fake.random_element(VideoStreamSource.ProcessingRate.values)
+        streams.extend(
+            VideoStreamSource(parking_lot=parking_lot, stream_source=fake.url(), processing_rate=lot_processing_rate)
+            for _ in range(per_lot)
+        )
+    return VideoStreamSource.objects.bulk_create(streams)
+
+
+def create_occupancy_history(
+    parking_lots: Sequence[ParkingLot], start: datetime, end: datetime, interval: timedelta, batch_size: int = 10_000
+) -> int:
+    """Create readings from every parking lot each `interval` between `start` and `end`. Return their number."""
+    created = 0
+    occupancies = []
+    timestamp = start
+    while timestamp < end:
+        occupancies.extend(
+            Occupancy(parking_lot=parking_lot, occupied_spots=fake.pyint(max_value=100), timestamp=timestamp)
+            for parking_lot in parking_lots
+        )
+        if len(occupancies) >= batch_size:
+            created += len(Occupancy.objects.bulk_create(occupancies, batch_size=batch_size))
+            occupancies = []
+        timestamp += interval
+    created += len(Occupancy.objects.bulk_create(occupancies, batch_size=batch_size))
+    return created
+
+
 class TestCaseWithData:
     def setUp(self) -> None:
         # Set up data for the whole TestCase
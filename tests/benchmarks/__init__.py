@@ -0,0 +1,35 @@
+"""Performance benchmarks.
+
+They are skipped by default. Run them with:
+
+    RUN_BENCHMARKS=1 python manage.py test tests.benchmarks
+"""
+
+import os
+from time import perf_counter
+from types import TracebackType
+from typing import Self
+from unittest import skipUnless
+
+benchmark = skipUnless(os.environ.get("RUN_BENCHMARKS"), "Set `RUN_BENCHMARKS=1` to run benchmarks")
+
+
+class Timer:
+    """Measure the wall-clock time of a code block."""
+
+    def __init__(self) -> None:
+        self.elapsed = 0.0
+
+    def __enter__(self) -> Self:
+        self._start = perf_counter()
+        return self
+
+    def __exit__(
+        self, exc_type: type[BaseException] | None, exc: BaseException | None, traceback: TracebackType | None
+    ) -> None:
+        self.elapsed = perf_counter() - self._start
+
+
+def report(name: str, **metrics: float) -> None:
+    formatted_metrics = ", ".join(f"{metric}={value:,.2f}" for metric, value in metrics.items())
+    print(f"\n[benchmark] {name}: {formatted_metrics}")  # noqa: T201
@@ -0,0 +1,36 @@
+import os
+from datetime import UTC, datetime, timedelta
+
+from django.test import TestCase
+
+from livemap.models import HourlyOccupancySummary, Occupancy
+from livemap.tasks import aggregate_occupancy_and_delete_old_records
+from tests import TestCaseWithData, create_occupancy_history, create_parking_lots
+from tests.benchmarks import Timer, benchmark, report
+
+# Numbers of synthetic `Occupancy` rows. Override with e.g. `BENCHMARK_OCCUPANCY_ROWS=10000,100000`.
+OCCUPANCY_ROWS = [int(rows) for rows in os.environ.get("BENCHMARK_OCCUPANCY_ROWS", "10000,100000,1000000").split(",")]
+PARKING_LOTS_NUMBER = 100
+READING_INTERVAL = timedelta(minutes=1)
+
+
+@benchmark
+class AggregationBenchmark(TestCaseWithData, TestCase):
+    def test_aggregation_scaling(self) -> None:
+        parking_lots = create_parking_lots(self.address, PARKING_LOTS_NUMBER)
+        start = datetime(year=2025, month=1, day=1, tzinfo=UTC)
+        for rows in OCCUPANCY_ROWS:
+            Occupancy.objects.all().delete()
+            HourlyOccupancySummary.objects.all().delete()
+            end = start + READING_INTERVAL * (rows // PARKING_LOTS_NUMBER)
+            created = create_occupancy_history(parking_lots, start, end, READING_INTERVAL)
+
+            with Timer() as timer:
+                aggregate_occupancy_and_delete_old_records()
+
+            report(
+                f"aggregation of {created:,} occupancy rows",
+                seconds=timer.elapsed,
+                rows_per_second=created / timer.elapsed,
+                summaries=HourlyOccupancySummary.objects.count(),
+            )
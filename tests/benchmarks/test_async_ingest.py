@@ -0,0 +1,106 @@
+import asyncio
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from unittest.mock import patch
+
+from django.db import connection
+from django.test import Client, TransactionTestCase
+from django.urls import reverse
+from rest_framework import status
+
+from tests import TestCaseWithData
+from tests.benchmarks import Timer, benchmark, report
+
+CAMERAS_NUMBER = 200
+# Worker threads of a synchronous WSGI server process, e.g. gunicorn with `--threads 4`.
+WSGI_WORKERS = 4
+# Time a camera takes to send its request body over a slow network, during which the server waits for it.
+UPLOAD_SECONDS = 0.05
+CONTENT_TYPE = "application/json"
+# Concurrent writes lock the tables of the shared in-memory SQLite test database, so the database work is serialized.
+SERIALIZED_DATABASE = connection.vendor == "sqlite"
+
+
+class InFlight:
+    def __init__(self) -> None:
+        self.current = self.peak = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> None:
+        with self._lock:
+            self.current += 1
+            self.peak = max(self.peak, self.current)
+
+    def __exit__(self, *_args: object) -> None:
+        with self._lock:
+            self.current -= 1
+
+
+@benchmark
+class AsyncIngestBenchmark(TestCaseWithData, TransactionTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        response = self.client.post("/api/token/", data={"username": self.username, "password": self.password})
+        self.headers = {"Authorization": f"Bearer {response.json()['access']}"}
+        self.reading = {"parking_lot_id": self.parking_lot.pk, "occupied_spots": 1}
+
+    def report(self, name: str, latencies: list[float], elapsed: float, in_flight: InFlight) -> None:
+        percentiles = statistics.quantiles(latencies, n=100)
+        report(
+            name,
+            peak_concurrent_requests=in_flight.peak,
+            requests_per_second=CAMERAS_NUMBER / elapsed,
+            p50_ms=percentiles[49] * 1000,
+            p99_ms=percentiles[98] * 1000,
+        )
+
+    def test_wsgi_vs_asgi_ingestion(self) -> None:
+        in_flight = InFlight()
+        local = threading.local()
+        database_lock = threading.Lock() if SERIALIZED_DATABASE else nullcontext()
+
+        # Every request holds a worker thread while its body is uploaded and saved, and waits for a free one before.
+        def upload(submitted: float) -> float:
+            with in_flight:
+                time.sleep(UPLOAD_SECONDS)
+                if not hasattr(local, "client"):
+                    local.client = Client()
+                with database_lock:
+                    response = local.client.post(
+                        "/api/occupancy/", self.reading, content_type=CONTENT_TYPE, headers=self.headers
+                    )
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            return time.perf_counter() - submitted
+
+        with Timer() as timer, ThreadPoolExecutor(max_workers=WSGI_WORKERS) as workers:
+            latencies = list(workers.map(upload, [time.perf_counter()] * CAMERAS_NUMBER))
+        self.report("WSGI occupancy ingestion", latencies, timer.elapsed, in_flight)
+
+        database_threads = (
+            patch("livemap.drf.ingest._database_threads", ThreadPoolExecutor(max_workers=1))
+            if SERIALIZED_DATABASE
+            else nullcontext()
+        )
+        with Timer() as timer, database_threads:
+            latencies, in_flight = asyncio.run(self.upload_async())
+        self.report("ASGI occupancy ingestion", latencies, timer.elapsed, in_flight)
+
+    async def upload_async(self) -> tuple[list[float], InFlight]:
+        in_flight = InFlight()
+        path = reverse("livemap:occupancy-ingest")
+
+        # The event loop serves the other requests while a body is uploaded.
+        async def upload() -> float:
+            submitted = time.perf_counter()
+            with in_flight:
+                await asyncio.sleep(UPLOAD_SECONDS)
+                response = await self.async_client.post(
+                    path, self.reading, content_type=CONTENT_TYPE, headers=self.headers
+                )
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            return time.perf_counter() - submitted
+
+        return list(await asyncio.gather(*(upload() for _ in range(CAMERAS_NUMBER)))), in_flight
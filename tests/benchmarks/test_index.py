@@ -0,0 +1,78 @@
+from unittest.mock import patch
+
+import folium
+from django.core.cache import cache
+from django.test import TestCase
+
+from livemap.clusters import CLUSTER_MAX_ZOOM
+from livemap.markers import compose_popup
+from livemap.models import CurrentOccupancy, Occupancy, ParkingLot
+from tests import TestCaseWithData, create_parking_lots, create_video_stream_sources, fake
+from tests.benchmarks import Timer, benchmark, report
+
+SIZES = (100, 1000, 10000)
+STREAMS_PER_LOT = 2
+REPEATS = 5
+GEOJSON_PATH = "/api/parking-lots/geojson/"
+WORLD = {"bbox": "-180,-90,180,90", "zoom": 2}
+
+
+def render_all_markers() -> str:
+    """The map as it was rendered with a marker per parking lot, for comparison."""
+    folium_map = folium.Map(None)
+    parking_lots = ParkingLot.objects.select_related("address__city__country", "current_occupancy").prefetch_related(
+        "stream_sources"
+    )
+    for parking_lot in parking_lots:
+        popup = folium.Popup(compose_popup(parking_lot))
+        folium.Marker([parking_lot.latitude, parking_lot.longitude], popup).add_to(folium_map)
+    return folium_map.get_root().render()
+
+
+@benchmark
+@patch("livemap.views.geolocate", return_value=None)
+class IndexBenchmark(TestCaseWithData, TestCase):
+    def milliseconds_per_request(self, path: str, query_params: dict | None = None) -> tuple[float, int]:
+        with Timer() as timer:
+            for _ in range(REPEATS):
+                response = self.client.get(path, query_params=query_params)
+        return timer.elapsed * 1000 / REPEATS, len(response.content)
+
+    def test_index(self, _geolocate: object) -> None:
+        seeded = 0
+        for size in SIZES:
+            parking_lots = create_parking_lots(self.address, size - seeded)
+            create_video_stream_sources(parking_lots, STREAMS_PER_LOT)
+            seeded = size
+            parking_lot = fake.random_element(parking_lots)
+            latitude, longitude = float(parking_lot.latitude), float(parking_lot.longitude)  # pyright: ignore[reportArgumentType]
+            street = {"bbox": f"{longitude - 0.01},{latitude - 0.01},{longitude + 0.01},{latitude + 0.01}"}
+            street["zoom"] = str(CLUSTER_MAX_ZOOM + 1)
+
+            with Timer() as all_markers_timer:
+                all_markers_bytes = len(render_all_markers())
+            page_ms, page_bytes = self.milliseconds_per_request("/livemap/")
+            cache.clear()
+            with Timer() as cold_timer:
+                self.client.get(GEOJSON_PATH, query_params=WORLD)
+            world_ms, world_bytes = self.milliseconds_per_request(GEOJSON_PATH, WORLD)
+            street_ms, street_bytes = self.milliseconds_per_request(GEOJSON_PATH, street)
+            with self.captureOnCommitCallbacks(execute=True):
+                occupancy = Occupancy.objects.create(parking_lot=parking_lot, occupied_spots=0)
+                CurrentOccupancy.objects.refresh_from([occupancy])
+            with Timer() as changed_timer:
+                self.client.get(GEOJSON_PATH, query_params=street)
+
+            report(
+                f"map with {size:,} parking lots",
+                all_markers_ms=all_markers_timer.elapsed * 1000,
+                all_markers_kb=all_markers_bytes / 1024,
+                page_ms=page_ms,
+                page_kb=page_bytes / 1024,
+                cold_index_ms=cold_timer.elapsed * 1000,
+                world_ms=world_ms,
+                world_kb=world_bytes / 1024,
+                street_ms=street_ms,
+                street_kb=street_bytes / 1024,
+                street_changed_ms=changed_timer.elapsed * 1000,
+            )
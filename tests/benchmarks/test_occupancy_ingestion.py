@@ -0,0 +1,39 @@
+from rest_framework import status
+
+from tests import fake
+from tests.benchmarks import Timer, benchmark, report
+from tests.livemap.test_api_endpoints import ExtendedTestCaseWithData
+
+READINGS_NUMBER = 1000
+
+
+@benchmark
+class OccupancyIngestionBenchmark(ExtendedTestCaseWithData):
+    occupancy_path = "/api/occupancy/"
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.readings = [
+            {
+                "parking_lot_id": fake.random_element((self.parking_lot.pk, self.another_parking_lot.pk)),
+                "occupied_spots": 1,
+            }
+            for _ in range(READINGS_NUMBER)
+        ]
+
+    def test_single_vs_bulk_ingestion(self) -> None:
+        with Timer() as single_timer:
+            for reading in self.readings:
+                response = self.client.post(self.occupancy_path, data=reading, **self.default_kwargs)
+                self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        with Timer() as bulk_timer:
+            response = self.client.post(f"{self.occupancy_path}bulk/", data=self.readings, **self.default_kwargs)
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        report(
+            "occupancy ingestion",
+            single_rows_per_second=READINGS_NUMBER / single_timer.elapsed,
+            bulk_rows_per_second=READINGS_NUMBER / bulk_timer.elapsed,
+            speedup=single_timer.elapsed / bulk_timer.elapsed,
+        )
@@ -0,0 +1,48 @@
+from datetime import UTC, datetime, timedelta
+
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from livemap.models import AggregationWatermark, HourlyOccupancySummary
+from livemap.tasks import HOURLY_OCCUPANCY_WATERMARK
+from tests import TestCaseWithData, create_parking_lots, fake
+from tests.benchmarks import Timer, benchmark, report
+
+PARKING_LOTS_NUMBER = 100
+HOURS = 365 * 24
+REPEATS = 10
+
+
+@benchmark
+class OccupancySeriesBenchmark(TestCaseWithData, APITestCase):
+    def test_year_of_hourly_data(self) -> None:
+        parking_lots = create_parking_lots(self.address, PARKING_LOTS_NUMBER)
+        end = datetime(year=2026, month=1, day=1, tzinfo=UTC)
+        start = end - timedelta(hours=HOURS)
+        AggregationWatermark.objects.create(name=HOURLY_OCCUPANCY_WATERMARK, timestamp=end)
+        hours = [start + timedelta(hours=hour) for hour in range(HOURS)]
+        for parking_lot in parking_lots:
+            HourlyOccupancySummary.objects.bulk_create(
+                HourlyOccupancySummary(
+                    parking_lot=parking_lot,
+                    avg_occupied_spots=fake.pyint(max_value=100),
+                    hour=hour.hour,
+                    date=hour.date(),
+                )
+                for hour in hours
+            )
+
+        self.client.force_authenticate(self.user)
+        query_params = {"parking_lot_id": parking_lots[0].pk, "from": start.isoformat(), "to": end.isoformat()}
+        for bucket in ("hour", "day", "week"):
+            with Timer() as timer:
+                for _ in range(REPEATS):
+                    response = self.client.get(
+                        "/api/occupancy/series/", query_params={**query_params, "bucket": bucket}
+                    )
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            report(
+                f"a year of {bucket} buckets of one of {PARKING_LOTS_NUMBER} parking lots",
+                milliseconds_per_request=timer.elapsed * 1000 / REPEATS,
+                points=len(response.json()),
+            )
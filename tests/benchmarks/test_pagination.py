@@ -0,0 +1,58 @@
+import json
+import os
+from datetime import UTC, datetime, timedelta
+
+from django.test import TestCase
+from rest_framework.pagination import Cursor, LimitOffsetPagination
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from livemap.drf.pagination import OccupancyPagination
+from livemap.models import Occupancy
+from tests import TestCaseWithData, create_occupancy_history, create_parking_lots
+from tests.benchmarks import Timer, benchmark, report
+
+# Number of synthetic `Occupancy` rows. Override with e.g. `BENCHMARK_PAGINATION_ROWS=100000`.
+PAGINATION_ROWS = int(os.environ.get("BENCHMARK_PAGINATION_ROWS", "10000000"))
+PARKING_LOTS_NUMBER = 100
+READING_INTERVAL = timedelta(minutes=1)
+PAGE_SIZE = 50
+PATH = "/api/occupancy/"
+
+
+@benchmark
+class PaginationBenchmark(TestCaseWithData, TestCase):
+    def keyset_request(self, depth: int) -> Request:
+        """A request for the page that starts right after `depth` rows."""
+        if not depth:
+            return Request(APIRequestFactory().get(PATH, {"limit": PAGE_SIZE}))
+        timestamp, occupancy_id = (
+            Occupancy.objects.order_by("-timestamp", "-id").values_list("timestamp", "id")[depth - 1 : depth].get()
+        )
+        paginator = OccupancyPagination()
+        paginator.base_url = f"http://testserver{PATH}?limit={PAGE_SIZE}"
+        cursor = Cursor(offset=0, reverse=False, position=json.dumps([timestamp.isoformat(), str(occupancy_id)]))
+        return Request(APIRequestFactory().get(paginator.encode_cursor(cursor)))
+
+    def test_deep_pages(self) -> None:
+        parking_lots = create_parking_lots(self.address, PARKING_LOTS_NUMBER)
+        start = datetime(year=2025, month=1, day=1, tzinfo=UTC)
+        end = start + READING_INTERVAL * (PAGINATION_ROWS // PARKING_LOTS_NUMBER)
+        rows = create_occupancy_history(parking_lots, start, end, READING_INTERVAL)
+        queryset = Occupancy.objects.order_by("-timestamp", "-id")
+
+        for depth in (0, rows // 100, rows // 2, rows - PAGE_SIZE):
+            offset_request = Request(APIRequestFactory().get(PATH, {"limit": PAGE_SIZE, "offset": depth}))
+            with Timer() as offset_timer:
+                LimitOffsetPagination().paginate_queryset(queryset, offset_request)
+
+            keyset_request = self.keyset_request(depth)
+            with Timer() as keyset_timer:
+                page = OccupancyPagination().paginate_queryset(queryset, keyset_request)
+            self.assertEqual(len(page or []), PAGE_SIZE)
+
+            report(
+                f"page at depth {depth:,} of {rows:,} occupancy rows",
+                offset_ms=offset_timer.elapsed * 1000,
+                keyset_ms=keyset_timer.elapsed * 1000,
+            )
@@ -0,0 +1,61 @@
+import os
+from datetime import UTC, datetime, timedelta
+
+from django.test import TestCase
+
+from livemap.drf.serializers import (
+    OCCUPANCY_ROW_FIELDS,
+    PARKING_LOT_ROW_FIELDS,
+    OccupancyRowSerializer,
+    OccupancySerializer,
+    ParkingLotStreamsSerializer,
+    VideoStreamSourceSerializer,
+)
+from livemap.drf.view_sets import _parking_lot_streams
+from livemap.models import Occupancy, VideoStreamSource
+from tests import TestCaseWithData, create_occupancy_history, create_parking_lots, create_video_stream_sources
+from tests.benchmarks import Timer, benchmark, report
+
+# Number of serialized rows. Override with e.g. `BENCHMARK_SERIALIZATION_ROWS=100000`.
+SERIALIZATION_ROWS = int(os.environ.get("BENCHMARK_SERIALIZATION_ROWS", "10000"))
+STREAMS_PER_LOT = 4
+READING_INTERVAL = timedelta(minutes=1)
+
+
+@benchmark
+class SerializationBenchmark(TestCaseWithData, TestCase):
+    def report(self, name: str, rows: int, model_timer: Timer, row_timer: Timer) -> None:
+        report(
+            f"{name} of {rows:,} rows",
+            model_serializer_ms_per_1k=model_timer.elapsed * 1000 * 1000 / rows,
+            row_serializer_ms_per_1k=row_timer.elapsed * 1000 * 1000 / rows,
+            speedup=model_timer.elapsed / row_timer.elapsed,
+        )
+
+    def test_occupancy_list(self) -> None:
+        parking_lots = create_parking_lots(self.address, 100)
+        start = datetime(year=2025, month=1, day=1, tzinfo=UTC)
+        create_occupancy_history(
+            parking_lots, start, start + READING_INTERVAL * (SERIALIZATION_ROWS // 100), READING_INTERVAL
+        )
+        queryset = Occupancy.objects.order_by("-timestamp", "-id")
+
+        with Timer() as model_timer:
+            expected = OccupancySerializer(queryset.select_related("parking_lot"), many=True).data
+        with Timer() as row_timer:
+            data = OccupancyRowSerializer(queryset.values(*OCCUPANCY_ROW_FIELDS), many=True).data
+        self.assertListEqual(data, expected)
+        self.report("occupancy list", len(data), model_timer, row_timer)
+
+    def test_video_stream_sources_list(self) -> None:
+        parking_lots = create_parking_lots(self.address, SERIALIZATION_ROWS // STREAMS_PER_LOT)
+        create_video_stream_sources(parking_lots, per_lot=STREAMS_PER_LOT)
+        queryset = VideoStreamSource.objects.order_by("parking_lot_id", "id")
+
+        with Timer() as model_timer:
+            VideoStreamSourceSerializer(queryset.select_related("parking_lot__address__city__country"), many=True).data  # noqa: B018
+        with Timer() as row_timer:
+            rows = [tuple(row.values()) for row in queryset.parking_lots().values(*PARKING_LOT_ROW_FIELDS)]
+            data = ParkingLotStreamsSerializer(_parking_lot_streams(rows, queryset), many=True).data
+        self.assertEqual(sum(len(parking_lot["streams"]) for parking_lot in data), queryset.count())
+        self.report("video stream sources list", queryset.count(), model_timer, row_timer)
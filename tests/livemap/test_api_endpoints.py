@@ -1,12 +1,23 @@
 from copy import deepcopy
-from datetime import UTC, datetime, timedelta
+from datetime import UTC, date, datetime, timedelta
 from time import sleep
 
+from django.core.cache import cache
 from rest_framework import status
 from rest_framework.test import APITestCase
 
-from livemap.models import VideoStreamSource
-from tests import TestCaseWithData, fake
+from livemap.drf.serializers import OccupancySerializer, VideoStreamSourceSerializer
+from livemap.models import (
+    AggregationWatermark,
+    CurrentOccupancy,
+    HourlyOccupancySummary,
+    Occupancy,
+    ParkingLot,
+    VideoStreamSource,
+)
+from livemap.profiles import HOURS_PER_WEEK, rebuild_profiles
+from livemap.tasks import HOURLY_OCCUPANCY_WATERMARK
+from tests import TestCaseWithData, create_parking_lots, create_video_stream_sources, fake
 
 CONTENT_TYPE = "application/json"
 
@@ -21,6 +32,53 @@ class ExtendedTestCaseWithData(TestCaseWithData, APITestCase):
         }
 
 
+class ParkingLotTests(ExtendedTestCaseWithData):
+    geojson_path = "/api/parking-lots/geojson/"
+
+    def test_geojson_method(self) -> None:
+        cache.clear()
+        # The map is public.
+        response = self.client.get(self.geojson_path, query_params={"bbox": "-180,-90,180,90", "zoom": 18})
+        self.assertEqual(response.status_code, status.HTTP_200_OK, msg=response.json())
+        self.assertEqual(response.json()["type"], "FeatureCollection")
+        self.assertSetEqual(
+            {feature["id"] for feature in response.json()["features"]},
+            {self.parking_lot.pk, self.another_parking_lot.pk},
+        )
+
+        for query_params in (
+            {"bbox": "-180,-90,180", "zoom": 1},
+            {"bbox": "-180,-90,180,nan", "zoom": 1},
+            {"bbox": "-181,-90,180,90", "zoom": 1},
+            {"bbox": "-180,90,180,-90", "zoom": 1},
+            {"bbox": "-180,-90,180,90", "zoom": 23},
+        ):
+            response = self.client.get(self.geojson_path, query_params=query_params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, msg=query_params)
+
+    def test_nearest_method(self) -> None:
+        path = "/api/parking-lots/nearest/"
+        latitude, longitude = float(self.parking_lot.latitude), float(self.parking_lot.longitude)  # pyright: ignore[reportArgumentType]
+        response = self.client.get(path, query_params={"latitude": latitude, "longitude": longitude, "limit": 1})
+        self.assertEqual(response.status_code, status.HTTP_200_OK, msg=response.json())
+        (nearest,) = response.json()
+        self.assertEqual(nearest["parking_lot_id"], self.parking_lot.pk)
+        self.assertEqual(nearest["parking_lot_address"], str(self.address))
+        self.assertLess(nearest["distance"], 1)
+
+        query_params = {
+            "latitude": latitude,
+            "longitude": longitude,
+            "min_free_spots": self.parking_lot.total_spots + 1,
+        }
+        response = self.client.get(path, query_params=query_params)
+        self.assertListEqual(response.json(), [])
+
+        for query_params in ({"latitude": 91, "longitude": 0}, {"latitude": 0, "longitude": 0, "radius": 10**6}):
+            response = self.client.get(path, query_params=query_params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, msg=query_params)
+
+
 class VideoStreamSourceTests(ExtendedTestCaseWithData):
     video_stream_path = "/api/video-stream-sources/"
 
@@ -32,6 +90,47 @@ class VideoStreamSourceTests(ExtendedTestCaseWithData):
         streams_number = 2
         self.assertEqual(len(response.json()["results"][0]["streams"]), streams_number)
 
+    def test_get_method_representation(self) -> None:
+        VideoStreamSource.objects.filter(parking_lot=self.parking_lot).update(
+            in_use_until=datetime.now(UTC), lease_owner="worker"
+        )
+        response = self.client.get(self.video_stream_path, **self.default_kwargs)
+        parking_lot = next(
+            result for result in response.json()["results"] if result["parking_lot_id"] == self.parking_lot.pk
+        )
+        streams = VideoStreamSource.objects.filter(parking_lot=self.parking_lot).order_by("id")
+        stream_fields = ("id", "stream_source", "in_use_until", "lease_owner", "is_active")
+        self.assertDictEqual(
+            parking_lot,
+            {
+                "parking_lot_id": self.parking_lot.pk,
+                "parking_lot_address": str(self.parking_lot.address),
+                "processing_rate": streams[0].processing_rate,
+                "streams": [
+                    {field: VideoStreamSourceSerializer(stream).data[field] for field in stream_fields}
+                    for stream in streams
+                ],
+            },
+        )
+
+    def test_get_method_paginates_parking_lots(self) -> None:
+        parking_lots = create_parking_lots(self.address, 3)
+        create_video_stream_sources(parking_lots, per_lot=3)
+        parking_lots_number = ParkingLot.objects.filter(stream_source__isnull=False).distinct().count()
+
+        response = self.client.get(
+            self.video_stream_path, query_params={"limit": 2, "count": "true"}, **self.default_kwargs
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["count"], parking_lots_number)
+        results = response.json()["results"]
+        self.assertEqual(len(results), 2)
+        for parking_lot in results:
+            stream_ids = VideoStreamSource.objects.filter(parking_lot_id=parking_lot["parking_lot_id"]).values_list(
+                "id", flat=True
+            )
+            self.assertListEqual([stream["id"] for stream in parking_lot["streams"]], sorted(stream_ids))
+
     def test_post_method(self) -> None:
         fake_stream = {
             "parking_lot_id": self.parking_lot.pk,
@@ -88,9 +187,8 @@ class VideoStreamSourceTests(ExtendedTestCaseWithData):
         streams_number = 2
         self.assertEqual(len(response.json()["results"][0]["streams"]), streams_number)
 
-        response = self.client.get(
-            self.video_stream_path, query_params={"limit": 1, "offset": 1}, **self.default_kwargs
-        )
+        response = self.client.get(self.video_stream_path, query_params={"limit": 1}, **self.default_kwargs)
+        response = self.client.get(response.json()["next"], **self.default_kwargs)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         streams_number = 1
         self.assertEqual(len(response.json()["results"][0]["streams"]), streams_number, msg=response.json())
@@ -160,15 +258,132 @@ class VideoStreamSourceTests(ExtendedTestCaseWithData):
         )
         self.assertEqual(number_of_reserved_streams, limit, msg=response.json())
 
+    def test_lease_renewal_and_release(self) -> None:
+        lease_owner = fake.pystr()
+        in_use_until = datetime.now(UTC) + timedelta(seconds=30)
+        response = self.client.get(
+            self.video_stream_path,
+            query_params={"mark_in_use_until": in_use_until.isoformat(), "lease_owner": lease_owner},
+            **self.default_kwargs,
+        )
+        claimed_streams = [stream for group in response.json()["results"] for stream in group["streams"]]
+        self.assertTrue(claimed_streams)
+        self.assertTrue(all(stream["lease_owner"] == lease_owner for stream in claimed_streams))
+
+        renewed_until = in_use_until + timedelta(seconds=30)
+        with self.assertNumQueries(2):  # User and a single update.
+            response = self.client.post(
+                f"{self.video_stream_path}renew/",
+                data={"lease_owner": lease_owner, "in_use_until": renewed_until.isoformat()},
+                **self.default_kwargs,
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK, msg=response.json())
+        self.assertEqual(response.json(), {"renewed": len(claimed_streams)})
+        self.assertEqual(VideoStreamSource.objects.filter(in_use_until=renewed_until).count(), len(claimed_streams))
+
+        # Only the owner can renew or release its reservations.
+        response = self.client.post(
+            f"{self.video_stream_path}release/", data={"lease_owner": fake.pystr()}, **self.default_kwargs
+        )
+        self.assertEqual(response.json(), {"released": 0})
+
+        released_stream_id = claimed_streams[0]["id"]
+        response = self.client.post(
+            f"{self.video_stream_path}release/",
+            data={"lease_owner": lease_owner, "ids": [released_stream_id]},
+            **self.default_kwargs,
+        )
+        self.assertEqual(response.json(), {"released": 1})
+        self.assertIsNone(VideoStreamSource.objects.get(pk=released_stream_id).in_use_until)
+
+        # The released stream is available to other workers right away.
+        response = self.client.get(
+            self.video_stream_path,
+            query_params={"mark_in_use_until": in_use_until.isoformat(), "lease_owner": fake.pystr()},
+            **self.default_kwargs,
+        )
+        self.assertEqual(response.json()["results"][0]["streams"][0]["id"], released_stream_id)
+
+        # Expired reservations cannot be renewed.
+        VideoStreamSource.objects.update(in_use_until=datetime.now(UTC) - timedelta(seconds=1))
+        response = self.client.post(
+            f"{self.video_stream_path}renew/",
+            data={"lease_owner": lease_owner, "in_use_until": renewed_until.isoformat()},
+            **self.default_kwargs,
+        )
+        self.assertEqual(response.json(), {"renewed": 0})
+
+        response = self.client.post(
+            f"{self.video_stream_path}renew/",
+            data={"lease_owner": lease_owner, "in_use_until": datetime.now(UTC).isoformat()},
+            **self.default_kwargs,
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_capacity_aware_claim(self) -> None:
+        in_use_until = datetime.now(UTC) + timedelta(seconds=30)
+        query_params = {"mark_in_use_until": in_use_until.isoformat(), "lease_owner": "worker"}
+        response = self.client.get(
+            self.video_stream_path, query_params={**query_params, "capacity": "-1"}, **self.default_kwargs
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.get(
+            self.video_stream_path,
+            query_params={"mark_in_use_until": in_use_until.isoformat(), "capacity": "1"},
+            **self.default_kwargs,
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("lease_owner", response.json())
+
+        # Both parking lots need more than the capacity, but an idle worker takes one of them anyway.
+        response = self.client.get(
+            self.video_stream_path, query_params={**query_params, "capacity": "0.001"}, **self.default_kwargs
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.json()["results"]), 1)
+
+        response = self.client.post(
+            f"{self.video_stream_path}renew/",
+            data={"lease_owner": "worker", "in_use_until": in_use_until.isoformat(), "capacity": 0.001},
+            **self.default_kwargs,
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK, msg=response.json())
+        # The only worker's fair share is the whole load, so nothing is released.
+        self.assertListEqual(response.json()["released"], [])
+
 
 class OccupancyTests(ExtendedTestCaseWithData):
     occupancy_path = "/api/occupancy/"
 
     def test_get_method(self) -> None:
-        response = self.client.get(self.occupancy_path, **self.default_kwargs)
+        response = self.client.get(self.occupancy_path, query_params={"count": "true"}, **self.default_kwargs)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         elements_number = 2
         self.assertEqual(response.json()["count"], elements_number)
+        expected = OccupancySerializer(Occupancy.objects.order_by("-timestamp", "-id"), many=True).data
+        self.assertListEqual(response.json()["results"], expected)
+
+    def test_keyset_pagination(self) -> None:
+        # Readings that share a timestamp must neither be skipped nor repeated.
+        timestamp = datetime.now(UTC)
+        Occupancy.objects.bulk_create(
+            Occupancy(parking_lot=self.parking_lot, occupied_spots=fake.pyint(), timestamp=timestamp) for _ in range(5)
+        )
+        expected_ids = list(Occupancy.objects.order_by("-timestamp", "-id").values_list("id", flat=True))
+
+        response = self.client.get(self.occupancy_path, query_params={"limit": 2}, **self.default_kwargs)
+        self.assertNotIn("count", response.json())
+        pages = [response.json()]
+        while next_link := pages[-1]["next"]:
+            pages.append(self.client.get(next_link, **self.default_kwargs).json())
+        self.assertListEqual([reading["id"] for page in pages for reading in page["results"]], expected_ids)
+
+        previous_page = self.client.get(pages[-1]["previous"], **self.default_kwargs).json()
+        self.assertListEqual(previous_page["results"], pages[-2]["results"])
+
+        response = self.client.get(self.occupancy_path, query_params={"cursor": "invalid"}, **self.default_kwargs)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
     def test_post_method(self) -> None:
         occupancy = {"parking_lot_id": self.parking_lot.pk, "occupied_spots": fake.pyint(min_value=1)}
@@ -177,3 +392,125 @@ class OccupancyTests(ExtendedTestCaseWithData):
 
         response = self.client.post(self.occupancy_path, data=occupancy, **self.default_kwargs)
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_bulk_post_method(self) -> None:
+        bulk_path = f"{self.occupancy_path}bulk/"
+        readings = [
+            {"parking_lot_id": parking_lot.pk, "occupied_spots": fake.pyint(min_value=1)}
+            for parking_lot in (self.parking_lot, self.another_parking_lot)
+            for _ in range(3)
+        ]
+        response = self.client.post(bulk_path, data=readings, **self.default_kwargs)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, msg=response.json())
+        self.assertEqual(response.json(), {"created": len(readings), "errors": []})
+        self.assertEqual(Occupancy.objects.count(), len(readings) + 2)
+        self.assertEqual(
+            CurrentOccupancy.objects.get(parking_lot=self.another_parking_lot).occupied_spots,
+            readings[-1]["occupied_spots"],
+        )
+
+        fake_parking_lot_id = fake.pyint(min_value=10)
+        readings = [
+            {"parking_lot_id": self.parking_lot.pk, "occupied_spots": 1},
+            {"parking_lot_id": fake_parking_lot_id, "occupied_spots": 1},
+            {"parking_lot_id": self.parking_lot.pk, "occupied_spots": -1},
+        ]
+        response = self.client.post(bulk_path, data=readings, **self.default_kwargs)
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS, msg=response.json())
+        self.assertEqual(response.json()["created"], 1)
+        errors = response.json()["errors"]
+        self.assertEqual([error["index"] for error in errors], [1, 2])
+        self.assertEqual(
+            errors[0]["errors"]["parking_lot_id"][0], f"No parking lot found for the provided ID {fake_parking_lot_id}"
+        )
+        self.assertIn("occupied_spots", errors[1]["errors"])
+
+        response = self.client.post(bulk_path, data=readings[1:], **self.default_kwargs)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, msg=response.json())
+
+        response = self.client.post(bulk_path, data=readings[0], **self.default_kwargs)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, msg=response.json())
+
+    def test_series_method(self) -> None:
+        watermark = datetime(year=2025, month=1, day=2, tzinfo=UTC)
+        AggregationWatermark.objects.create(name=HOURLY_OCCUPANCY_WATERMARK, timestamp=watermark)
+        HourlyOccupancySummary.objects.bulk_create(
+            HourlyOccupancySummary(
+                parking_lot=self.parking_lot, avg_occupied_spots=spots, hour=hour, date=date(2025, 1, 1)
+            )
+            for hour, spots in ((22, 10), (23, 20))
+        )
+        Occupancy.objects.bulk_create(
+            Occupancy(parking_lot=self.parking_lot, occupied_spots=spots, timestamp=watermark + offset)
+            for offset, spots in (
+                (timedelta(minutes=10), 30),
+                (timedelta(minutes=20), 50),
+                (timedelta(minutes=65), 40),
+            )
+        )
+        path = f"{self.occupancy_path}series/"
+        query_params = {
+            "parking_lot_id": self.parking_lot.pk,
+            "from": (watermark - timedelta(hours=2)).isoformat(),
+            "to": (watermark + timedelta(hours=2)).isoformat(),
+        }
+
+        def series(**extra_params: object) -> list[tuple[str, float]]:
+            response = self.client.get(path, query_params={**query_params, **extra_params}, **self.default_kwargs)
+            self.assertEqual(response.status_code, status.HTTP_200_OK, msg=response.json())
+            return [(point["timestamp"], point["avg_occupied_spots"]) for point in response.json()]
+
+        self.assertListEqual(
+            series(bucket="hour"),
+            [
+                ("2025-01-01T22:00:00Z", 10),
+                ("2025-01-01T23:00:00Z", 20),
+                ("2025-01-02T00:00:00Z", 40),
+                ("2025-01-02T01:00:00Z", 40),
+            ],
+        )
+        self.assertListEqual(series(bucket="day"), [("2025-01-01T00:00:00Z", 15), ("2025-01-02T00:00:00Z", 40)])
+        # The week is read from the summaries and the raw readings for two hours each.
+        self.assertListEqual(series(bucket="week"), [("2024-12-30T00:00:00Z", 27.5)])
+        # Minutes are only available in the raw readings.
+        self.assertListEqual(
+            series(bucket="minute"),
+            [("2025-01-02T00:10:00Z", 30), ("2025-01-02T00:20:00Z", 50), ("2025-01-02T01:05:00Z", 40)],
+        )
+        self.assertListEqual(series(bucket="hour", parking_lot_id="", city_id=self.city.pk), series(bucket="hour"))
+
+        for invalid_params in (
+            {"parking_lot_id": ""},
+            {"city_id": self.city.pk},
+            {"to": query_params["from"]},
+            {"bucket": "minute", "from": (watermark - timedelta(days=365)).isoformat()},
+        ):
+            response = self.client.get(path, query_params={**query_params, **invalid_params}, **self.default_kwargs)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, msg=invalid_params)
+
+    def test_profile_method(self) -> None:
+        cache.clear()
+        path = f"{self.occupancy_path}profile/"
+        response = self.client.get(path, **self.default_kwargs)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(path, query_params={"parking_lot_id": self.parking_lot.pk}, **self.default_kwargs)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        rebuild_profiles([self.parking_lot.pk], datetime.now(UTC).replace(minute=0, second=0, microsecond=0))
+        response = self.client.get(path, query_params={"parking_lot_id": self.parking_lot.pk}, **self.default_kwargs)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.json()["hours"]), HOURS_PER_WEEK)
+
+    def test_current_method(self) -> None:
+        response = self.client.get(
+            f"{self.occupancy_path}current/", query_params={"count": "true"}, **self.default_kwargs
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK, msg=response.json())
+        self.assertEqual(response.json()["count"], 1)
+        current_occupancy = response.json()["results"][0]
+        latest_occupancy = Occupancy.objects.filter(parking_lot=self.parking_lot).latest()
+        self.assertEqual(current_occupancy["parking_lot_id"], self.parking_lot.pk)
+        self.assertEqual(current_occupancy["occupied_spots"], latest_occupancy.occupied_spots)
+        self.assertEqual(
+            current_occupancy["free_spots"], max(self.parking_lot.total_spots - latest_occupancy.occupied_spots, 0)
+        )
@@ -0,0 +1,156 @@
+import json
+from datetime import UTC, datetime, timedelta
+from unittest.mock import patch
+
+import redis
+from django.apps import apps
+from django.core.exceptions import ImproperlyConfigured
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework import status
+
+from livemap import buffer
+from livemap.buffer import FLUSH_GROUP, OCCUPANCY_STREAM, LocalBuffer, RedisBuffer, flush
+from livemap.models import AggregationWatermark, CurrentOccupancy, HourlyOccupancySummary, Occupancy
+from livemap.tasks import HOURLY_OCCUPANCY_WATERMARK, aggregate_occupancy_and_delete_old_records, flush_occupancy_buffer
+from tests.livemap.test_api_endpoints import ExtendedTestCaseWithData
+
+
+class LocalBufferTest(SimpleTestCase):
+    def test_redelivery(self) -> None:
+        buffer = LocalBuffer()
+        buffer.append([{"reading": 1}, {"reading": 2}, {"reading": 3}])
+        first_batch = buffer.read(2)
+        self.assertListEqual([reading for _, reading in first_batch], [{"reading": 1}, {"reading": 2}])
+
+        # The unacknowledged readings are read again.
+        buffer.acknowledge([first_batch[0][0]])
+        self.assertListEqual([reading for _, reading in buffer.read(5)], [{"reading": 2}, {"reading": 3}])
+        buffer.acknowledge(entry_id for entry_id, _ in buffer.read(5))
+        self.assertListEqual(buffer.read(5), [])
+
+
+class RedisBufferTest(SimpleTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        patcher = patch("livemap.buffer.redis.Redis.from_url")
+        self.client = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        self.buffer = RedisBuffer("redis://buffer.test")
+
+    def test_read(self) -> None:
+        self.client.xgroup_create.side_effect = redis.ResponseError("BUSYGROUP Consumer Group name already exists")
+        reading = {"parking_lot_id": 1, "occupied_spots": 2, "timestamp": "2025-01-01T00:00:00+00:00"}
+        self.client.xautoclaim.return_value = [b"0-0", [], []]
+        self.client.xreadgroup.return_value = [
+            [OCCUPANCY_STREAM.encode(), [(b"1-0", {b"reading": json.dumps(reading)})]]
+        ]
+        self.assertListEqual(self.buffer.read(10), [("1-0", reading)])
+
+        # The readings of a failed flush are claimed first, and the batch is filled with new ones.
+        self.client.xautoclaim.return_value = [b"0-0", [(b"1-0", {b"reading": json.dumps(reading)})], []]
+        self.client.xreadgroup.return_value = [
+            [OCCUPANCY_STREAM.encode(), [(b"2-0", {b"reading": json.dumps(reading)})]]
+        ]
+        self.assertListEqual(self.buffer.read(10), [("1-0", reading), ("2-0", reading)])
+        self.assertEqual(self.client.xreadgroup.call_args.kwargs["count"], 9)
+        self.client.xreadgroup.reset_mock()
+        self.client.xautoclaim.return_value = [b"0-0", [(b"1-0", {b"reading": json.dumps(reading)})], []]
+        self.assertListEqual(self.buffer.read(1), [("1-0", reading)])
+        self.client.xreadgroup.assert_not_called()
+        self.client.xgroup_create.assert_called_once_with(OCCUPANCY_STREAM, FLUSH_GROUP, id="0", mkstream=True)
+
+    def test_acknowledge(self) -> None:
+        self.buffer.acknowledge(["1-0", "2-0"])
+        pipeline = self.client.pipeline.return_value
+        pipeline.xack.assert_called_once_with(OCCUPANCY_STREAM, FLUSH_GROUP, "1-0", "2-0")
+        pipeline.xdel.assert_called_once_with(OCCUPANCY_STREAM, "1-0", "2-0")
+
+
+@override_settings(OCCUPANCY_WRITE_BEHIND=True, OCCUPANCY_BUFFER_URL="")
+class WriteBehindTest(ExtendedTestCaseWithData, TestCase):
+    bulk_path = "/api/occupancy/bulk/"
+
+    def setUp(self) -> None:
+        super().setUp()
+        patcher = patch("livemap.buffer._local_buffer", LocalBuffer())
+        self.buffer = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.readings = [
+            {"parking_lot_id": self.parking_lot.pk, "occupied_spots": 1},
+            {"parking_lot_id": self.another_parking_lot.pk, "occupied_spots": 2},
+        ]
+
+    def test_flush(self) -> None:
+        occupancies = Occupancy.objects.count()
+        response = self.client.post(self.bulk_path, data=self.readings, **self.default_kwargs)
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertDictEqual(response.json(), {"created": 2, "errors": []})
+        self.assertEqual(Occupancy.objects.count(), occupancies)
+        accepted_at = datetime.now(UTC)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertDictEqual(flush_occupancy_buffer(), {"read": 2, "saved": 2, "batches": 1})
+        self.assertEqual(Occupancy.objects.count(), occupancies + 2)
+        current_occupancy = CurrentOccupancy.objects.get(parking_lot=self.another_parking_lot)
+        self.assertEqual(current_occupancy.occupied_spots, 2)
+        # The readings keep the time they arrived at.
+        self.assertLessEqual(current_occupancy.timestamp, accepted_at)
+        self.assertDictEqual(flush(10), {"read": 0, "saved": 0, "batches": 0})
+
+    def test_batches(self) -> None:
+        for _ in range(3):
+            self.client.post(self.bulk_path, data=self.readings, **self.default_kwargs)
+        self.assertDictEqual(flush(4), {"read": 6, "saved": 6, "batches": 2})
+
+    def test_redelivered_readings(self) -> None:
+        self.client.post(self.bulk_path, data=self.readings, **self.default_kwargs)
+        occupancies = Occupancy.objects.count()
+        # The flush fails after saving the readings.
+        with (
+            patch.object(self.buffer, "acknowledge", side_effect=redis.ConnectionError),
+            self.assertRaises(redis.ConnectionError),
+        ):
+            flush(10)
+        self.assertEqual(Occupancy.objects.count(), occupancies + 2)
+
+        self.assertDictEqual(flush(10), {"read": 2, "saved": 0, "batches": 1})
+        self.assertEqual(Occupancy.objects.count(), occupancies + 2)
+
+    def test_readings_of_a_parking_lot(self) -> None:
+        readings = [
+            {"parking_lot_id": self.parking_lot.pk, "occupied_spots": occupied_spots} for occupied_spots in (1, 2)
+        ]
+        response = self.client.post(self.bulk_path, data=readings, **self.default_kwargs)
+        self.assertEqual(response.json()["created"], 2)
+        # The readings of a request are not taken for copies of each other.
+        self.assertDictEqual(flush(10), {"read": 2, "saved": 2, "batches": 1})
+        self.assertEqual(CurrentOccupancy.objects.get(parking_lot=self.parking_lot).occupied_spots, 2)
+
+    def test_aggregation_waits_for_the_buffer(self) -> None:
+        Occupancy.objects.all().delete()
+        now = datetime(year=2025, month=1, day=1, hour=10, minute=1, tzinfo=UTC)
+        with patch("livemap.buffer.timezone.now", return_value=now - timedelta(minutes=2)):
+            self.client.post(self.bulk_path, data=self.readings, **self.default_kwargs)
+        with patch("livemap.tasks.datetime", wraps=datetime) as mocked_datetime:
+            mocked_datetime.now.return_value = now
+            # The buffer is flushed first, and the hour that ended a minute ago is not closed yet.
+            aggregate_occupancy_and_delete_old_records()
+            self.assertEqual(Occupancy.objects.count(), 2)
+            self.assertFalse(AggregationWatermark.objects.filter(name=HOURLY_OCCUPANCY_WATERMARK).exists())
+            mocked_datetime.now.return_value = now + buffer.MAX_FLUSH_LAG
+            aggregate_occupancy_and_delete_old_records()
+        self.assertEqual(
+            AggregationWatermark.objects.get(name=HOURLY_OCCUPANCY_WATERMARK).timestamp, now.replace(minute=0)
+        )
+        self.assertEqual(HourlyOccupancySummary.objects.count(), 2)
+
+    def test_shared_buffer_required(self) -> None:
+        with self.assertRaises(ImproperlyConfigured):
+            apps.get_app_config("livemap").ready()
+        with override_settings(OCCUPANCY_BUFFER_URL="redis://buffer.test"):
+            apps.get_app_config("livemap").ready()
+
+    def test_deleted_parking_lot(self) -> None:
+        self.client.post(self.bulk_path, data=self.readings, **self.default_kwargs)
+        self.another_parking_lot.delete()
+        self.assertDictEqual(flush(10), {"read": 2, "saved": 1, "batches": 1})
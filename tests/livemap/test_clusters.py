@@ -0,0 +1,77 @@
+from django.core.cache import cache
+from django.test import TestCase
+
+from livemap.clusters import CLUSTER_MAX_ZOOM, MAX_FEATURES, map_features
+from livemap.models import CurrentOccupancy, Occupancy, ParkingLot
+from tests import TestCaseWithData
+
+WORLD = (-180.0, -90.0, 180.0, 90.0)
+
+
+class MapFeaturesTest(TestCaseWithData, TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        cache.clear()
+        # Two parking lots a few meters apart, and one far away.
+        ParkingLot.objects.filter(id=self.parking_lot.pk).update(latitude=50.45, longitude=30.52)
+        ParkingLot.objects.filter(id=self.another_parking_lot.pk).update(latitude=50.4501, longitude=30.5201)
+        self.far_parking_lot = ParkingLot.objects.create(
+            address=self.address, total_spots=10, latitude=-33.86, longitude=151.2
+        )
+        occupancy = Occupancy.objects.create(parking_lot=self.far_parking_lot, occupied_spots=4)
+        CurrentOccupancy.objects.refresh_from([occupancy])
+        cache.clear()
+
+    def test_clusters(self) -> None:
+        features = map_features(WORLD, 3)["features"]
+        self.assertEqual(len(features), 2)
+        parking_lot, cluster = features
+        self.assertEqual(parking_lot["properties"]["parking_lot_id"], self.far_parking_lot.pk)
+        self.assertEqual(parking_lot["properties"]["free_spots"], 6)
+        self.assertEqual(parking_lot["geometry"]["coordinates"], [151.2, -33.86])
+        self.assertIn(str(self.address), parking_lot["properties"]["popup"])
+        self.assertDictEqual(
+            cluster["properties"],
+            {
+                "cluster": True,
+                "parking_lots": 2,
+                "total_spots": self.parking_lot.total_spots + self.another_parking_lot.total_spots,
+                "free_spots": sum(
+                    parking_lot.free_spots or 0
+                    for parking_lot in ParkingLot.objects.filter(
+                        id__in=[self.parking_lot.pk, self.another_parking_lot.pk]
+                    )
+                ),
+            },
+        )
+        self.assertEqual(cluster["geometry"]["coordinates"], [30.52005, 50.45005])
+
+    def test_parking_lots_when_zoomed_in(self) -> None:
+        features = map_features((30.5, 50.4, 30.6, 50.5), CLUSTER_MAX_ZOOM + 1)["features"]
+        self.assertListEqual(
+            [feature["id"] for feature in features], [self.parking_lot.pk, self.another_parking_lot.pk]
+        )
+        self.assertEqual(
+            features[0]["properties"]["free_spots"], ParkingLot.objects.get(id=self.parking_lot.pk).free_spots
+        )
+
+    def test_bbox_across_antimeridian(self) -> None:
+        features = map_features((150.0, -40.0, -170.0, 0.0), CLUSTER_MAX_ZOOM + 1)["features"]
+        self.assertListEqual([feature["id"] for feature in features], [self.far_parking_lot.pk])
+        self.assertListEqual(map_features((-170.0, -40.0, 150.0, 0.0), CLUSTER_MAX_ZOOM + 1)["features"], [])
+
+    def test_feature_limit(self) -> None:
+        ParkingLot.objects.bulk_create(
+            ParkingLot(address=self.address, total_spots=1, latitude=index / 100, longitude=0)
+            for index in range(MAX_FEATURES + 1)
+        )
+        cache.clear()
+        features = map_features(WORLD, CLUSTER_MAX_ZOOM + 1)["features"]
+        self.assertLessEqual(len(features), MAX_FEATURES)
+        self.assertTrue(any(feature["properties"].get("cluster") for feature in features))
+
+    def test_invalidation(self) -> None:
+        map_features(WORLD, 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            ParkingLot.objects.filter(id=self.far_parking_lot.pk).delete()
+        self.assertEqual(len(map_features(WORLD, 0)["features"]), 1)
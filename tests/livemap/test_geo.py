@@ -0,0 +1,85 @@
+from django.db import connection
+from django.test import TestCase
+from parameterized import parameterized
+
+from livemap.geo import GRID_CELLS_PER_DEGREE, GRID_COLUMNS, distance, grid_cell_ranges
+from livemap.models import CurrentOccupancy, Occupancy, ParkingLot
+from tests import TestCaseWithData
+from tests.livemap.test_query_budgets import explain
+
+KYIV = (50.4501, 30.5234)
+LVIV = (49.8397, 24.0297)
+
+
+def grid_cell(latitude: float, longitude: float) -> int:
+    return int((latitude + 90) * GRID_CELLS_PER_DEGREE) * GRID_COLUMNS + int((longitude + 180) * GRID_CELLS_PER_DEGREE)
+
+
+class GridTest(TestCase):
+    def test_distance(self) -> None:
+        self.assertAlmostEqual(distance(*KYIV, *LVIV) / 1000, 468, delta=2)
+        self.assertEqual(distance(*KYIV, *KYIV), 0)
+        self.assertAlmostEqual(distance(0, 179.99, 0, -179.99), 2224, delta=1)
+
+    @parameterized.expand([(KYIV, 2000), ((0.0, 179.99), 5000), ((-33.86, -180.0), 100), ((89.99, 0.0), 5000)])
+    def test_grid_cell_ranges_cover_circle(self, point: tuple[float, float], radius: float) -> None:
+        ranges = grid_cell_ranges(*point, radius)
+        # Points on the circle in every direction.
+        for latitude_step in (-1, 0, 1):
+            for longitude_step in (-1, 0, 1):
+                latitude = max(min(point[0] + latitude_step * radius / 111_000, 90), -90)
+                longitude = (point[1] + longitude_step * radius / 50_000 + 180) % 360 - 180
+                if distance(*point, latitude, longitude) > radius:
+                    continue
+                cell = grid_cell(latitude, longitude)
+                self.assertTrue(any(start <= cell <= end for start, end in ranges), msg=(latitude, longitude))
+
+    def test_grid_cell_ranges_of_pole(self) -> None:
+        ranges = grid_cell_ranges(89.99, 0, 5000)
+        # Whole rows around the pole are merged.
+        self.assertEqual(len(ranges), 1)
+
+
+class NearestTest(TestCaseWithData, TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        ParkingLot.objects.filter(id=self.parking_lot.pk).update(latitude=KYIV[0], longitude=KYIV[1])
+        ParkingLot.objects.filter(id=self.another_parking_lot.pk).update(latitude=LVIV[0], longitude=LVIV[1])
+        # About 300 and 700 meters north of Kyiv.
+        self.near_parking_lots = ParkingLot.objects.bulk_create(
+            ParkingLot(address=self.address, total_spots=10, latitude=KYIV[0] + offset, longitude=KYIV[1])
+            for offset in (0.0027, 0.0063)
+        )
+
+    def test_grid_cell(self) -> None:
+        parking_lot = ParkingLot.objects.get(id=self.parking_lot.pk)
+        self.assertIn(parking_lot.grid_cell - grid_cell(*KYIV), (-1, 0, 1))
+
+    def test_nearest(self) -> None:
+        nearest = ParkingLot.objects.nearest(*KYIV, limit=2, radius=50_000)
+        self.assertListEqual(
+            [parking_lot.pk for parking_lot in nearest], [self.parking_lot.pk, self.near_parking_lots[0].pk]
+        )
+        self.assertAlmostEqual(nearest[1].distance, 300, delta=5)  # pyright: ignore[reportAttributeAccessIssue]
+
+        nearest = ParkingLot.objects.nearest(*KYIV, limit=10, radius=500_000)
+        self.assertEqual(nearest[-1].pk, self.another_parking_lot.pk)
+        self.assertEqual(len(ParkingLot.objects.nearest(*KYIV, limit=10, radius=500)), 2)
+
+    def test_nearest_with_free_spots(self) -> None:
+        occupancies = Occupancy.objects.bulk_create(
+            Occupancy(parking_lot=parking_lot, occupied_spots=occupied_spots)
+            for parking_lot, occupied_spots in zip(self.near_parking_lots, (8, 5), strict=True)
+        )
+        CurrentOccupancy.objects.refresh_from(occupancies)
+        nearest = ParkingLot.objects.filter(id__in=[lot.pk for lot in self.near_parking_lots]).with_free_spots(3)
+        self.assertListEqual(
+            [parking_lot.pk for parking_lot in nearest.nearest(*KYIV, limit=5, radius=2000)],
+            [self.near_parking_lots[1].pk],
+        )
+
+    def test_grid_cell_index(self) -> None:
+        if connection.vendor != "sqlite":
+            self.skipTest("The query plan is checked on SQLite")
+        query = str(ParkingLot.objects.near(*KYIV, 2000).query)
+        self.assertTrue(any("grid_cell" in row["detail"] for row in explain(query)))
@@ -0,0 +1,156 @@
+import tempfile
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+from django.core.cache import caches
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from parameterized import parameterized
+
+from livemap.geolocation import GEOLOCATION_CACHE_KEY, build_database, cache_statistics, geolocate, locate
+
+RANGES = [
+    ("1.0.0.0", "1.0.0.255", -27.4698, 153.0251),
+    ("8.8.8.0", "8.8.8.255", 37.4220, -122.0841),
+    ("2001:db8::", "2001:db8:0:ffff:ffff:ffff:ffff:ffff", 50.4501, 30.5234),
+]
+
+
+class GeolocationDatabaseTest(TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        build_database(reversed(RANGES), self.directory)
+
+    @parameterized.expand(
+        [
+            ("1.0.0.0", (-27.4698, 153.0251)),
+            ("1.0.0.255", (-27.4698, 153.0251)),
+            ("8.8.8.8", (37.422, -122.0841)),
+            ("::ffff:8.8.8.8", (37.422, -122.0841)),
+            ("2001:db8:0:1::1", (50.4501, 30.5234)),
+            ("1.0.1.0", None),
+            ("0.0.0.1", None),
+            ("2001:db9::1", None),
+            ("not an address", None),
+        ]
+    )
+    def test_locate(self, ip_address: str, location: tuple[float, float] | None) -> None:
+        with override_settings(GEOIP_DATABASE=str(self.directory)):
+            self.assertEqual(locate(ip_address), location)
+
+    def test_locate_without_database(self) -> None:
+        with override_settings(GEOIP_DATABASE=""):
+            self.assertIsNone(locate("8.8.8.8"))
+
+    def test_build_geoip_database(self) -> None:
+        csv_path = self.directory / "ranges.csv"
+        csv_path.write_text(
+            "".join(f"{first},{last},EU,UA,Kyiv,Kyiv,{lat},{lng}\n" for first, last, lat, lng in RANGES)
+        )
+        directory = self.directory / "built"
+        call_command("build_geoip_database", str(csv_path), directory=str(directory), stdout=MagicMock())
+        with override_settings(GEOIP_DATABASE=str(directory)):
+            self.assertEqual(locate("1.0.0.1"), (-27.4698, 153.0251))
+            self.assertEqual(locate("2001:db8::1"), (50.4501, 30.5234))
+
+
+LOCAL_MEMORY_CACHE = "django.core.cache.backends.locmem.LocMemCache"
+# The shared tier stands in for Redis.
+TIERED_CACHES = {
+    "default": {"BACKEND": LOCAL_MEMORY_CACHE, "LOCATION": "shared"},
+    "geolocation": {"BACKEND": LOCAL_MEMORY_CACHE, "LOCATION": "process", "OPTIONS": {"MAX_ENTRIES": 10}},
+}
+
+
+@override_settings(
+    GEOIP_DATABASE="",
+    GEOIP_REMOTE_URL="https://geolocation.test/{ip_address}",
+    CACHES=TIERED_CACHES,
+    GEOLOCATION_CACHES=["geolocation", "default"],
+)
+class RemoteGeolocationTest(TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        for alias in TIERED_CACHES:
+            caches[alias].clear()
+        # Run the background lookups right away.
+        remote_lookups = patch("livemap.geolocation._remote_lookups")
+        remote_lookups.start().submit.side_effect = lambda function, *args: function(*args)
+        self.addCleanup(remote_lookups.stop)
+
+    @patch("livemap.geolocation.requests.get")
+    def test_geolocate(self, get: MagicMock) -> None:
+        get.return_value.status_code = 200
+        get.return_value.json.return_value = {"loc": "37.4220,-122.0841"}
+        # The first request does not wait for the lookup.
+        self.assertIsNone(geolocate("8.8.8.8"))
+        self.assertEqual(geolocate("8.8.8.8"), (37.422, -122.0841))
+        get.assert_called_once()
+        self.assertEqual(get.call_args.args[0], "https://geolocation.test/8.8.8.8")
+
+    @patch("livemap.geolocation.requests.get")
+    def test_geolocate_failure(self, get: MagicMock) -> None:
+        get.return_value.status_code = 429
+        self.assertIsNone(geolocate("8.8.8.8"))
+        # The address is not looked up again until the interval passes.
+        self.assertIsNone(geolocate("8.8.8.8"))
+        get.assert_called_once()
+
+    @parameterized.expand(["127.0.0.1", "192.168.1.1", "::1"])
+    @patch("livemap.geolocation.requests.get")
+    def test_geolocate_non_global(self, ip_address: str, get: MagicMock) -> None:
+        self.assertIsNone(geolocate(ip_address))
+        get.assert_not_called()
+        # The address is remembered as not found.
+        with patch("livemap.geolocation.locate") as locate_mock:
+            self.assertIsNone(geolocate(ip_address))
+        locate_mock.assert_not_called()
+
+    @parameterized.expand(["not an address", "8.8.8.8, 1.1.1.1", ""])
+    @patch("livemap.geolocation.requests.get")
+    def test_geolocate_invalid_address(self, ip_address: str, get: MagicMock) -> None:
+        with patch("livemap.geolocation._remember_geolocation") as remember:
+            self.assertIsNone(geolocate(ip_address))
+        # Clients may send anything, which must not fill the caches.
+        remember.assert_not_called()
+        get.assert_not_called()
+
+    @patch("livemap.geolocation.requests.get")
+    def test_shared_tier(self, get: MagicMock) -> None:
+        get.return_value.status_code = 200
+        get.return_value.json.return_value = {"loc": "37.4220,-122.0841"}
+        geolocate("8.8.8.8")
+        # Another process only finds the address in the shared tier.
+        caches["geolocation"].clear()
+        before = cache_statistics()
+        self.assertEqual(geolocate("8.8.8.8"), (37.422, -122.0841))
+        self.assertEqual(geolocate("8.8.8.8"), (37.422, -122.0841))
+        get.assert_called_once()
+
+        after = cache_statistics()
+        self.assertEqual(after["geolocation"]["hits"] - before["geolocation"]["hits"], 1)
+        self.assertEqual(after["geolocation"]["misses"] - before["geolocation"]["misses"], 1)
+        self.assertEqual(after["default"]["hits"] - before["default"]["hits"], 1)
+        self.assertGreater(after["geolocation"]["hit_rate"], 0)
+
+    @override_settings(GEOLOCATION_NEGATIVE_CACHE_TIMEOUT=0)
+    @patch("livemap.geolocation.requests.get")
+    def test_negative_cache_timeout(self, get: MagicMock) -> None:
+        get.return_value.status_code = 404
+        self.assertIsNone(geolocate("8.8.8.8"))
+        self.assertIsNone(caches["geolocation"].get(GEOLOCATION_CACHE_KEY.format(ip_address="8.8.8.8")))
+
+    def test_local_tier_is_bounded(self) -> None:
+        cache_keys = [GEOLOCATION_CACHE_KEY.format(ip_address=f"10.0.0.{index}") for index in range(50)]
+        for index in range(50):
+            geolocate(f"10.0.0.{index}")
+        self.assertLessEqual(len(caches["geolocation"].get_many(cache_keys)), 10)
+
+    @patch("livemap.geolocation.requests.get")
+    def test_geolocate_offline(self, get: MagicMock) -> None:
+        with override_settings(GEOIP_REMOTE_URL=""):
+            self.assertIsNone(geolocate("8.8.8.8"))
+        get.assert_not_called()
@@ -0,0 +1,72 @@
+from unittest.mock import MagicMock, patch
+
+from django.http import HttpResponse
+from django.test import TransactionTestCase
+from django.urls import reverse
+from rest_framework import status
+
+from livemap.drf.ingest import BULK_MAX_ITEMS
+from livemap.models import CurrentOccupancy, Occupancy
+from tests import TestCaseWithData
+
+CONTENT_TYPE = "application/json"
+
+
+# The readings are saved in the threads of the view, which do not see the data of an unfinished test transaction.
+class AsyncIngestTest(TestCaseWithData, TransactionTestCase):
+    path = reverse("livemap:occupancy-ingest")
+
+    async def post(self, data: object, **headers: str) -> HttpResponse:
+        response = await self.async_client.post("/api/token/", {"username": self.username, "password": self.password})
+        headers = {"Authorization": f"Bearer {response.json()['access']}"} | headers
+        return await self.async_client.post(self.path, data, content_type=CONTENT_TYPE, headers=headers)
+
+    async def test_ingest_reading(self) -> None:
+        response = await self.post({"parking_lot_id": self.parking_lot.pk, "occupied_spots": 3})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, msg=response.json())
+        self.assertDictEqual(response.json(), {"created": 1, "errors": []})
+        current_occupancy = await CurrentOccupancy.objects.aget(parking_lot=self.parking_lot)
+        self.assertEqual(current_occupancy.occupied_spots, 3)
+
+    @patch("livemap.drf.ingest.close_old_connections")
+    async def test_connection_checks(self, close_old_connections: MagicMock) -> None:
+        response = await self.post({"parking_lot_id": self.parking_lot.pk, "occupied_spots": 3})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        # The expired or broken connection of the database thread is closed before and after the job.
+        self.assertEqual(close_old_connections.call_count, 2)
+
+    async def test_ingest_readings(self) -> None:
+        occupancies = await Occupancy.objects.acount()
+        readings = [
+            {"parking_lot_id": self.parking_lot.pk, "occupied_spots": 1},
+            {"parking_lot_id": self.parking_lot.pk, "occupied_spots": -1},
+            {"parking_lot_id": self.another_parking_lot.pk, "occupied_spots": 2},
+            {"parking_lot_id": self.another_parking_lot.pk + 1000, "occupied_spots": 2},
+        ]
+        response = await self.post(readings)
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(response.json()["created"], 2)
+        self.assertListEqual([error["index"] for error in response.json()["errors"]], [1, 3])
+        self.assertEqual(await Occupancy.objects.acount(), occupancies + 2)
+
+        response = await self.post(readings[1:2])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    async def test_invalid_requests(self) -> None:
+        response = await self.post(
+            [{"parking_lot_id": self.parking_lot.pk, "occupied_spots": 1}] * (BULK_MAX_ITEMS + 1)
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("non_field_errors", response.json())
+
+        response = await self.async_client.post(self.path, "{", content_type=CONTENT_TYPE)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertIn("WWW-Authenticate", response.headers)
+        response = await self.post("{", Authorization="Bearer invalid")
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        response = await self.post("{")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("JSON parse error", response.json()["detail"])
+        response = await self.async_client.get(self.path)
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
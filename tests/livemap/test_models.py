@@ -1,6 +1,10 @@
-from django.test import TestCase
+from datetime import UTC, datetime, timedelta
+from typing import Any
+from unittest.mock import patch
 
-from livemap.models import ParkingLot
+from django.test import TestCase, override_settings
+
+from livemap.models import CurrentOccupancy, CurrentOccupancyQuerySet, Occupancy, ParkingLot
 from tests import TestCaseWithData
 
 
@@ -8,3 +12,94 @@ class ParkingLotModelTest(TestCaseWithData, TestCase):
     def test_parking_lot_choices(self) -> None:
         self.assertIn(self.parking_lot.get_is_private, ParkingLot.Answer.labels)
         self.assertIn(self.parking_lot.get_is_free, ParkingLot.Answer.labels)
+
+    def test_free_spots(self) -> None:
+        latest_occupancy = Occupancy.objects.filter(parking_lot=self.parking_lot).latest()
+        parking_lot = ParkingLot.objects.select_related("current_occupancy").get(pk=self.parking_lot.pk)
+        with self.assertNumQueries(0):
+            free_spots = parking_lot.free_spots
+        self.assertEqual(free_spots, max(parking_lot.total_spots - latest_occupancy.occupied_spots, 0))
+        self.assertIsNone(ParkingLot.objects.get(pk=self.another_parking_lot.pk).free_spots)
+
+
+class OccupancyModelTest(TestCaseWithData, TestCase):
+    def test_changes(self) -> None:
+        keepalive = timedelta(minutes=10)
+        stored = Occupancy.objects.filter(parking_lot=self.parking_lot).latest()
+
+        def reading(occupied_spots: int, minutes: int) -> Occupancy:
+            return Occupancy(
+                parking_lot=self.parking_lot,
+                occupied_spots=occupied_spots,
+                timestamp=stored.timestamp + timedelta(minutes=minutes),
+            )
+
+        readings = [
+            reading(stored.occupied_spots, 1),
+            reading(stored.occupied_spots + 1, 2),
+            reading(stored.occupied_spots + 1, 3),
+            # The keep-alive after the change.
+            reading(stored.occupied_spots + 1, 12),
+            Occupancy(parking_lot=self.another_parking_lot, occupied_spots=1, timestamp=stored.timestamp),
+        ]
+        self.assertListEqual(
+            Occupancy.objects.changes(reversed(readings), keepalive), [readings[4], readings[1], readings[3]]
+        )
+
+    @override_settings(OCCUPANCY_CHANGES_ONLY=True)
+    def test_ingest_changes_only(self) -> None:
+        stored = Occupancy.objects.filter(parking_lot=self.parking_lot).latest()
+        unchanged = Occupancy(
+            parking_lot=self.parking_lot,
+            occupied_spots=stored.occupied_spots,
+            timestamp=stored.timestamp + timedelta(seconds=30),
+        )
+        self.assertListEqual(Occupancy.objects.ingest([unchanged]), [])
+        self.assertEqual(Occupancy.objects.filter(parking_lot=self.parking_lot).latest(), stored)
+        # The current occupancy is refreshed by every reading.
+        self.assertEqual(CurrentOccupancy.objects.get(parking_lot=self.parking_lot).timestamp, unchanged.timestamp)
+
+
+class CurrentOccupancyModelTest(TestCaseWithData, TestCase):
+    def test_refresh_from(self) -> None:
+        occupancy = Occupancy.objects.create(parking_lot=self.another_parking_lot, occupied_spots=1)
+        current_occupancy = CurrentOccupancy.objects.get(parking_lot=self.another_parking_lot)
+        self.assertEqual(current_occupancy.occupied_spots, occupancy.occupied_spots)
+        self.assertEqual(current_occupancy.timestamp, occupancy.timestamp)
+
+        newer_occupancy = Occupancy.objects.create(parking_lot=self.another_parking_lot, occupied_spots=2)
+        older_occupancy = Occupancy(
+            parking_lot=self.another_parking_lot, occupied_spots=3, timestamp=occupancy.timestamp
+        )
+        CurrentOccupancy.objects.refresh_from([newer_occupancy, older_occupancy])
+        current_occupancy.refresh_from_db()
+        self.assertEqual(current_occupancy.occupied_spots, newer_occupancy.occupied_spots)
+        self.assertEqual(CurrentOccupancy.objects.count(), 2)
+
+        # A reading older than the current occupancy does not move it back.
+        CurrentOccupancy.objects.refresh_from([older_occupancy])
+        current_occupancy.refresh_from_db()
+        self.assertEqual(current_occupancy.occupied_spots, newer_occupancy.occupied_spots)
+        self.assertEqual(current_occupancy.timestamp, newer_occupancy.timestamp)
+
+    def test_refresh_from_concurrent_first_readings(self) -> None:
+        newer_timestamp = datetime.now(UTC)
+        older_occupancy = Occupancy(
+            parking_lot=self.another_parking_lot, occupied_spots=1, timestamp=newer_timestamp - timedelta(minutes=1)
+        )
+        bulk_create = CurrentOccupancyQuerySet.bulk_create
+
+        def insert_newer_first(queryset: CurrentOccupancyQuerySet, *args: Any, **kwargs: Any) -> list[CurrentOccupancy]:
+            # A concurrent refresh stores the newer reading between the lookup and the insert of the older one.
+            bulk_create(
+                queryset,
+                [CurrentOccupancy(parking_lot=self.another_parking_lot, occupied_spots=2, timestamp=newer_timestamp)],
+            )
+            return bulk_create(queryset, *args, **kwargs)
+
+        self.assertFalse(CurrentOccupancy.objects.filter(parking_lot=self.another_parking_lot).exists())
+        with patch.object(CurrentOccupancyQuerySet, "bulk_create", autospec=True, side_effect=insert_newer_first):
+            CurrentOccupancy.objects.refresh_from([older_occupancy])
+        current_occupancy = CurrentOccupancy.objects.get(parking_lot=self.another_parking_lot)
+        self.assertEqual(current_occupancy.occupied_spots, 2)
+        self.assertEqual(current_occupancy.timestamp, newer_timestamp)
@@ -0,0 +1,99 @@
+from datetime import UTC, date, datetime, timedelta
+from unittest import skipIf, skipUnless
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from livemap.models import Occupancy
+from livemap.partitions import OccupancyPartitions, partition_day, partition_definitions, partition_name
+from livemap.tasks import aggregate_occupancy_and_delete_old_records
+from tests import TestCaseWithData, fake
+
+IS_MYSQL = connection.vendor == "mysql"
+
+
+class PartitionSqlTest(TestCase):
+    def test_partition_name(self) -> None:
+        day = fake.date_object()
+        self.assertEqual(partition_day(partition_name(day)), day)
+        self.assertIsNone(partition_day("pmax"))
+
+    def test_partition_definitions(self) -> None:
+        self.assertEqual(
+            partition_definitions([date(2025, 1, 31)]),
+            "PARTITION p20250131 VALUES LESS THAN (TO_DAYS('2025-02-01')), PARTITION pmax VALUES LESS THAN MAXVALUE",
+        )
+
+    def test_statements(self) -> None:
+        partitions = OccupancyPartitions()
+        days = [date(2025, 1, 1), date(2025, 1, 2)]
+        enable_sql = partitions.enable_sql(*days)
+        self.assertIn("ADD PRIMARY KEY (id, timestamp)", enable_sql[0])
+        self.assertIn("PARTITION BY RANGE (TO_DAYS(timestamp))", enable_sql[1])
+        self.assertIn("PARTITION p20250102", enable_sql[1])
+        self.assertIn("REORGANIZE PARTITION pmax INTO", partitions.extend_sql(days)[0])
+        self.assertEqual(
+            partitions.drop_sql(days), ["ALTER TABLE livemap_occupancy DROP PARTITION p20250101, p20250102"]
+        )
+        self.assertEqual(partitions.extend_sql([]), [])
+        self.assertEqual(partitions.drop_sql([]), [])
+
+
+@skipIf(IS_MYSQL, "Partitioning is supported by MySQL")
+class UnsupportedPartitioningTest(TestCaseWithData, TestCase):
+    def test_fallback(self) -> None:
+        partitions = OccupancyPartitions()
+        self.assertFalse(partitions.supported)
+        self.assertEqual(partitions.ensure(datetime.now(UTC).date(), 1), [])
+        with self.assertRaises(CommandError):
+            call_command("partition_occupancy")
+
+    @override_settings(OCCUPANCY_PARTITIONING=True, OCCUPANCY_RETENTION_HOURS=24, OCCUPANCY_PURGE_BATCH_SIZE=2)
+    def test_purge_without_partitions(self) -> None:
+        now = datetime.now(UTC)
+        Occupancy.objects.bulk_create(
+            Occupancy(
+                parking_lot=self.parking_lot,
+                occupied_spots=fake.pyint(),
+                timestamp=now - timedelta(days=2, hours=hours),
+            )
+            for hours in range(5)
+        )
+        recent_occupancy = Occupancy.objects.create(
+            parking_lot=self.parking_lot, occupied_spots=fake.pyint(), timestamp=now - timedelta(hours=23)
+        )
+        kept_ids = set(Occupancy.objects.filter(timestamp__gte=recent_occupancy.timestamp).values_list("id", flat=True))
+
+        # The old records are deleted in batches instead, and the aggregated records within the retention are kept.
+        metrics = aggregate_occupancy_and_delete_old_records()
+        self.assertEqual(metrics["deleted"], 5)
+        self.assertEqual(metrics["batches"], 3)
+        self.assertSetEqual(set(Occupancy.objects.values_list("id", flat=True)), kept_ids)
+        self.assertIn(recent_occupancy.pk, kept_ids)
+
+
+@skipUnless(IS_MYSQL, "Run the tests against a MySQL-compatible database to test partitioning")
+class MySqlPartitioningTest(TestCaseWithData, TransactionTestCase):
+    # DDL statements implicitly commit transactions in MySQL, hence `TransactionTestCase`.
+
+    @override_settings(OCCUPANCY_PARTITIONING=True, OCCUPANCY_RETENTION_HOURS=24)
+    def test_partitioning(self) -> None:
+        today = datetime.now(UTC).date()
+        old_day = today - timedelta(days=3)
+        Occupancy.objects.create(
+            parking_lot=self.parking_lot,
+            occupied_spots=fake.pyint(),
+            timestamp=datetime.combine(old_day, datetime.min.time(), tzinfo=UTC),
+        )
+        partitions = OccupancyPartitions()
+        created_days = partitions.ensure(today, days_ahead=2)
+        self.assertEqual(created_days[0], old_day)
+        self.assertEqual(partitions.days(), created_days)
+        self.assertEqual(partitions.ensure(today, days_ahead=3), [today + timedelta(days=3)])
+
+        aggregate_occupancy_and_delete_old_records()
+        self.assertNotIn(old_day, partitions.days())
+        self.assertFalse(Occupancy.objects.filter(timestamp__date=old_day).exists())
+        self.assertTrue(Occupancy.objects.exists())
@@ -0,0 +1,78 @@
+from datetime import UTC, datetime, timedelta
+from typing import Any, cast
+
+import numpy as np
+from django.core.cache import cache
+from django.test import TestCase
+
+from livemap.models import AggregationWatermark, HourlyOccupancySummary, OccupancyProfile
+from livemap.profiles import HOURS_PER_WEEK, cached_profile, compute_profiles
+from livemap.tasks import HOURLY_OCCUPANCY_WATERMARK, build_occupancy_profiles
+from tests import TestCaseWithData
+
+
+class ComputeProfilesTest(TestCase):
+    def test_compute_profiles(self) -> None:
+        start = datetime(year=2025, month=1, day=6, tzinfo=UTC)  # Monday.
+        end = start + timedelta(weeks=2)
+        hours = np.arange(HOURS_PER_WEEK, dtype=np.float32)
+        # The second parking lot has no summaries at all.
+        matrix = np.vstack([np.concatenate([hours, hours + 2]), np.full(2 * HOURS_PER_WEEK, np.nan)])
+
+        statistics, forecast = compute_profiles(matrix, start, end)
+        mean, p10, p50, p90 = statistics[0]
+        np.testing.assert_allclose(mean, hours + 1)
+        np.testing.assert_allclose(p10, hours + 0.2, rtol=1e-5)
+        np.testing.assert_allclose(p50, hours + 1)
+        np.testing.assert_allclose(p90, hours + 1.8, rtol=1e-5)
+        # The last hour is above the mean by one spot, which fades away in the following hours.
+        np.testing.assert_allclose(forecast[0][:2], [1 + 0.8, 2 + 0.8**2], rtol=1e-5)
+        self.assertTrue(np.isnan(statistics[1]).all())
+        self.assertTrue(np.isnan(forecast[1]).all())
+
+
+class BuildOccupancyProfilesTest(TestCaseWithData, TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        cache.clear()
+
+    def add_summaries(self, parking_lot_id: int, start: datetime, hours: int) -> datetime:
+        moments = [start + timedelta(hours=hour) for hour in range(hours)]
+        HourlyOccupancySummary.objects.bulk_create(
+            HourlyOccupancySummary(
+                parking_lot_id=parking_lot_id, avg_occupied_spots=moment.hour, hour=moment.hour, date=moment.date()
+            )
+            for moment in moments
+        )
+        end = moments[-1] + timedelta(hours=1)
+        AggregationWatermark.objects.update_or_create(name=HOURLY_OCCUPANCY_WATERMARK, defaults={"timestamp": end})
+        return end
+
+    def test_incremental_rebuild(self) -> None:
+        self.assertEqual(build_occupancy_profiles(), 0)
+        end = self.add_summaries(self.parking_lot.pk, datetime(year=2025, month=1, day=6, tzinfo=UTC), 2 * 24 * 7)
+        self.assertEqual(build_occupancy_profiles(), 1)
+        self.assertEqual(build_occupancy_profiles(), 0)
+
+        profile = cached_profile(self.parking_lot.pk)
+        self.assertIsNotNone(profile)
+        profile = cast("dict[str, Any]", profile)
+        self.assertEqual(len(profile["hours"]), HOURS_PER_WEEK)
+        self.assertEqual(profile["hours"][8], {"hour_of_week": 8, "mean": 8, "p10": 8, "p50": 8, "p90": 8})
+        self.assertEqual(profile["forecast"][0]["timestamp"], end)
+        self.assertIsNone(cached_profile(self.another_parking_lot.pk))
+
+        # Only the parking lots with new summaries are rebuilt, and their cached profiles are invalidated.
+        end = self.add_summaries(self.another_parking_lot.pk, end, 1)
+        self.assertEqual(build_occupancy_profiles(), 1)
+        self.assertEqual(OccupancyProfile.objects.count(), 2)
+        self.assertIsNotNone(cache.get(f"occupancy_profile:{self.parking_lot.pk}"))
+
+        self.add_summaries(self.parking_lot.pk, end, 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(build_occupancy_profiles(), 1)
+        self.assertIsNone(cache.get(f"occupancy_profile:{self.parking_lot.pk}"))
+        profile = cached_profile(self.parking_lot.pk)
+        self.assertIsNotNone(profile)
+        profile = cast("dict[str, Any]", profile)
+        self.assertEqual(profile["forecast"][0]["timestamp"], end + timedelta(hours=1))
@@ -0,0 +1,115 @@
+import asyncio
+import json
+from collections.abc import AsyncIterator
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import redis
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from livemap.models import CurrentOccupancy, Occupancy
+from livemap.push import OCCUPANCY_CHANNEL, Broadcaster, broadcaster
+from tests import TestCaseWithData
+
+
+@override_settings(PUSH_BROKER_URL="")
+class BroadcasterTest(SimpleTestCase):
+    async def test_publish(self) -> None:
+        local_broadcaster = Broadcaster()
+        # Nothing is queued without subscriptions.
+        local_broadcaster.publish({1: "{}"})
+        subscription, another_subscription = local_broadcaster.subscribe(), local_broadcaster.subscribe()
+
+        # Only the latest change of a parking lot is kept until it is sent.
+        await asyncio.to_thread(local_broadcaster.publish, {1: "old", 2: "second"})
+        await asyncio.to_thread(local_broadcaster.publish, {1: "new"})
+        await asyncio.sleep(0)
+        self.assertListEqual(await subscription.next(), ["new", "second"])
+        self.assertListEqual(await another_subscription.next(), ["new", "second"])
+
+        local_broadcaster.unsubscribe(subscription)
+        local_broadcaster.deliver({3: "third"})
+        self.assertDictEqual(subscription.pending, {})
+        self.assertListEqual(await another_subscription.next(), ["third"])
+
+    @override_settings(PUSH_BROKER_URL="redis://broker.test")
+    async def test_broker(self) -> None:
+        async def listen() -> AsyncIterator[dict]:
+            yield {"type": "subscribe", "data": 1}
+            yield {"type": "message", "data": json.dumps([{"parking_lot_id": 1, "free_spots": 2}])}
+            await asyncio.Event().wait()
+
+        client = MagicMock()
+        client.__aenter__.return_value = client
+        pubsub = client.pubsub.return_value.__aenter__.return_value
+        pubsub.subscribe = AsyncMock()
+        pubsub.listen = listen
+        local_broadcaster = Broadcaster()
+        with patch("livemap.push.redis.asyncio.from_url", return_value=client):
+            subscription = local_broadcaster.subscribe()
+            self.assertListEqual(await subscription.next(), ['{"parking_lot_id":1,"free_spots":2}'])
+        pubsub.subscribe.assert_awaited_once_with(OCCUPANCY_CHANNEL)
+        local_broadcaster._listener.cancel()  # noqa: SLF001  # pyright: ignore[reportOptionalMemberAccess]
+
+    async def test_events(self) -> None:
+        response = await self.async_client.get(reverse("livemap:occupancy-events"))
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        events = aiter(response.streaming_content)  # pyright: ignore[reportAttributeAccessIssue]
+        self.assertEqual(await anext(events), b"retry: 5000\n\n")
+
+        broadcaster.deliver({1: '{"parking_lot_id":1}', 2: '{"parking_lot_id":2}'})
+        self.assertEqual(
+            await anext(events), b'event: occupancy\ndata: [{"parking_lot_id":1},{"parking_lot_id":2}]\n\n'
+        )
+        with patch("livemap.push.HEARTBEAT_INTERVAL", 0.01):
+            self.assertEqual(await anext(events), b": heartbeat\n\n")
+
+        # The ASGI handler cancels the response when the viewer disconnects.
+        next_event = asyncio.ensure_future(anext(events))
+        await asyncio.sleep(0)
+        next_event.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await next_event
+        self.assertSetEqual(broadcaster.subscriptions, set())
+
+
+class PublishTest(TestCaseWithData, TestCase):
+    def refresh_occupancy(self, occupied_spots: int) -> None:
+        with self.captureOnCommitCallbacks(execute=True):
+            occupancy = Occupancy.objects.create(parking_lot=self.parking_lot, occupied_spots=occupied_spots)
+            CurrentOccupancy.objects.refresh_from([occupancy])
+
+    @override_settings(PUSH_BROKER_URL="")
+    @patch.object(broadcaster, "publish")
+    def test_publish_in_process(self, publish: MagicMock) -> None:
+        self.refresh_occupancy(1)
+        # Nobody is subscribed.
+        publish.assert_not_called()
+
+        with patch.object(broadcaster, "subscriptions", {MagicMock()}):
+            self.refresh_occupancy(1)
+        (changes,) = publish.call_args.args
+        change = json.loads(changes[self.parking_lot.pk])
+        self.assertEqual(change["occupied_spots"], 1)
+        self.assertEqual(change["free_spots"], max(self.parking_lot.total_spots - 1, 0))
+
+        # The current occupancy saved on its own, e.g. in the admin, is pushed too.
+        current_occupancy = CurrentOccupancy.objects.get(parking_lot=self.parking_lot)
+        current_occupancy.occupied_spots = 2
+        with patch.object(broadcaster, "subscriptions", {MagicMock()}), self.captureOnCommitCallbacks(execute=True):
+            current_occupancy.save()
+        (changes,) = publish.call_args.args
+        self.assertEqual(json.loads(changes[self.parking_lot.pk])["occupied_spots"], 2)
+
+    @override_settings(PUSH_BROKER_URL="redis://broker.test")
+    @patch("livemap.push._broker")
+    def test_publish_to_broker(self, broker: MagicMock) -> None:
+        self.refresh_occupancy(2)
+        channel, message = broker.return_value.publish.call_args.args
+        self.assertEqual(channel, OCCUPANCY_CHANNEL)
+        self.assertListEqual([change["parking_lot_id"] for change in json.loads(message)], [self.parking_lot.pk])
+
+        # A broken broker does not fail the ingestion.
+        broker.return_value.publish.side_effect = redis.ConnectionError
+        with self.assertLogs("livemap.push", "WARNING"):
+            self.refresh_occupancy(3)
@@ -0,0 +1,185 @@
+"""Query-count and query-plan regression tests.
+
+Every endpoint and task must run a fixed number of queries regardless of the number of parking lots, and must not
+scan the whole `Occupancy` or `VideoStreamSource` tables without a limit.
+"""
+
+import os
+import re
+from collections.abc import Callable
+from datetime import UTC, datetime, timedelta
+from math import ceil
+from typing import Any
+from unittest.mock import patch
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from parameterized import parameterized
+from rest_framework import status
+
+from livemap.markers import cached_popups
+from livemap.models import CurrentOccupancy, HourlyOccupancySummary, Occupancy, ParkingLot, VideoStreamSource
+from livemap.tasks import SUMMARY_BATCH_SIZE, aggregate_occupancy_and_delete_old_records
+from tests import create_occupancy_history, create_parking_lots, create_video_stream_sources, fake
+from tests.livemap.test_api_endpoints import ExtendedTestCaseWithData
+
+# Numbers of parking lots to seed. Override with e.g. `QUERY_BUDGET_SIZES=10,1000`.
+SIZES = [(int(size),) for size in os.environ.get("QUERY_BUDGET_SIZES", "10,1000,10000").split(",")]
+STREAMS_PER_LOT = 2
+TRANSACTION_STATEMENT = re.compile(r"(SAVEPOINT|RELEASE SAVEPOINT|ROLLBACK TO SAVEPOINT|BEGIN|COMMIT|ROLLBACK)\b")
+WATCHED_TABLES = (Occupancy._meta.db_table, VideoStreamSource._meta.db_table)  # noqa: SLF001
+
+
+def explain(sql: str) -> list[dict[str, Any]]:
+    """Query plan rows of the `sql` query as dictionaries."""
+    prefix = "EXPLAIN QUERY PLAN" if connection.vendor == "sqlite" else "EXPLAIN"
+    with connection.cursor() as cursor:
+        cursor.execute(f"{prefix} {sql}")
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row, strict=True)) for row in cursor.fetchall()]
+
+
+def is_full_table_scan(plan_row: dict[str, Any]) -> bool:
+    if connection.vendor == "sqlite":
+        # E.g. "SCAN livemap_occupancy", but not "SCAN livemap_occupancy USING COVERING INDEX ...".
+        match = re.fullmatch(r"SCAN (\w+)( USING .*)?", plan_row["detail"])
+        return bool(match and match.group(1) in WATCHED_TABLES and not match.group(2))
+    return plan_row.get("type") == "ALL" and plan_row.get("table") in WATCHED_TABLES
+
+
+def find_full_table_scans(queries: list[dict[str, str]]) -> list[str]:
+    """Unbounded `SELECT` queries that read the watched tables in whole."""
+    return [
+        query["sql"]
+        for query in queries
+        if query["sql"].startswith("SELECT")
+        and " LIMIT " not in query["sql"]
+        and any(is_full_table_scan(plan_row) for plan_row in explain(query["sql"]))
+    ]
+
+
+class QueryBudgetTests(ExtendedTestCaseWithData):
+    def seed(self, size: int) -> None:
+        parking_lots = create_parking_lots(self.address, size)
+        create_video_stream_sources(parking_lots, STREAMS_PER_LOT)
+        occupancies = Occupancy.objects.bulk_create(
+            Occupancy(parking_lot=parking_lot, occupied_spots=fake.pyint(max_value=100)) for parking_lot in parking_lots
+        )
+        CurrentOccupancy.objects.refresh_from(occupancies)
+
+    def assert_query_budget(self, budget: int, func: Callable[[], Any]) -> Any:
+        with CaptureQueriesContext(connection) as context:
+            result = func()
+        # Transaction control statements depend on whether the code runs within a test transaction.
+        captured_queries = [
+            query for query in context.captured_queries if not TRANSACTION_STATEMENT.match(query["sql"])
+        ]
+        queries = "\n".join(query["sql"] for query in captured_queries)
+        self.assertEqual(len(captured_queries), budget, msg=f"Query budget exceeded:\n{queries}")
+        self.assertListEqual(find_full_table_scans(captured_queries), [])
+        return result
+
+    def test_full_table_scan_detection(self) -> None:
+        unindexed_query = str(Occupancy.objects.filter(occupied_spots=1).query)
+        self.assertListEqual(find_full_table_scans([{"sql": unindexed_query}]), [unindexed_query])
+        indexed_query = str(Occupancy.objects.filter(parking_lot_id=1).query)
+        self.assertListEqual(find_full_table_scans([{"sql": indexed_query}]), [])
+
+    @parameterized.expand(SIZES)
+    def test_index(self, size: int) -> None:
+        self.seed(size)
+        with patch("livemap.views.geolocate", return_value=None):
+            # The markers are loaded separately.
+            response = self.assert_query_budget(0, lambda: self.client.get("/livemap/"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @parameterized.expand(SIZES)
+    def test_parking_lots_geojson(self, size: int) -> None:
+        self.seed(size)
+        ParkingLot.objects.filter(pk=self.parking_lot.pk).update(latitude=10, longitude=10)
+        cache.clear()
+        path = "/api/parking-lots/geojson/"
+        # A viewport around a single parking lot, which stays under `MAX_FEATURES` for any number of parking lots.
+        query_params = {"bbox": "9.999,9.999,10.001,10.001", "zoom": 17}
+        # The grid index, and the parking lots with uncached popups and their streams.
+        response = self.assert_query_budget(3, lambda: self.client.get(path, query_params=query_params))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn(self.parking_lot.pk, [feature["id"] for feature in response.json()["features"]])
+        response = self.assert_query_budget(0, lambda: self.client.get(path, query_params=query_params))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @parameterized.expand(SIZES)
+    def test_parking_lots_geojson_clusters(self, size: int) -> None:
+        self.seed(size)
+        cache.clear()
+        # Whether the clusters of a single parking lot need their popups rendered depends on the coordinates.
+        cached_popups(ParkingLot.objects.values_list("id", flat=True))
+        path = "/api/parking-lots/geojson/"
+        query_params = {"bbox": "-180,-90,180,90", "zoom": 17}
+        # Too many parking lots for the zoom fall back to the clusters of a lower zoom, read from the grid index.
+        with patch("livemap.clusters.MAX_FEATURES", 5):
+            response = self.assert_query_budget(1, lambda: self.client.get(path, query_params=query_params))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(any(feature["properties"].get("cluster") for feature in response.json()["features"]))
+
+    @parameterized.expand(SIZES)
+    def test_video_stream_sources_list(self, size: int) -> None:
+        self.seed(size)
+        path = "/api/video-stream-sources/"
+        # User, page of parking lots and their streams. The total is not counted by default.
+        response = self.assert_query_budget(3, lambda: self.client.get(path, **self.default_kwargs))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        in_use_until = (datetime.now(UTC) + timedelta(minutes=5)).isoformat()
+        query_params = {"active_only": True, "mark_in_use_until": in_use_until}
+        # User, reservation (either a locking select and an update, or a compare-and-set update and a check)
+        # and the parking lots of the reserved streams with the streams.
+        claim_queries = 2 if connection.features.has_select_for_update_skip_locked else 3
+        response = self.assert_query_budget(
+            1 + claim_queries + 2, lambda: self.client.get(path, query_params=query_params, **self.default_kwargs)
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @parameterized.expand(SIZES)
+    def test_occupancy(self, size: int) -> None:
+        self.seed(size)
+        path = "/api/occupancy/"
+        # User and page. The total is not counted by default.
+        response = self.assert_query_budget(2, lambda: self.client.get(path, **self.default_kwargs))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # Pages deeper in the history are not more expensive.
+        next_link = self.client.get(path, query_params={"limit": 2}, **self.default_kwargs).json()["next"]
+        response = self.assert_query_budget(2, lambda: self.client.get(next_link, **self.default_kwargs))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        reading = {"parking_lot_id": self.parking_lot.pk, "occupied_spots": 1}
+        # User, parking lot validation, insert, current occupancy lock and upsert.
+        response = self.assert_query_budget(5, lambda: self.client.post(path, data=reading, **self.default_kwargs))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        readings = [reading] * 100
+        # User, parking lots validation, insert, current occupancy lock and upsert.
+        response = self.assert_query_budget(
+            5, lambda: self.client.post(f"{path}bulk/", data=readings, **self.default_kwargs)
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    @parameterized.expand(SIZES)
+    def test_aggregation(self, size: int) -> None:
+        self.seed(size)
+        start = datetime.now(UTC).replace(minute=0, second=0, microsecond=0) - timedelta(days=3)
+        hours = 3
+        parking_lots = list(self.address.parking_lots.all())
+        readings = create_occupancy_history(parking_lots, start, start + timedelta(hours=hours), timedelta(minutes=20))
+        # Reads do not depend on the number of parking lots: the watermark, the first reading and two queries per hour.
+        # Writes are batched: the summaries upsert, the watermark update and the purge batches.
+        summaries = len(parking_lots) * hours
+        summary_fields = [field for field in HourlyOccupancySummary._meta.concrete_fields if not field.primary_key]  # noqa: SLF001
+        summary_batch_size = min(SUMMARY_BATCH_SIZE, connection.ops.bulk_batch_size(summary_fields, [None] * summaries))
+        summary_batches = ceil(summaries / summary_batch_size)
+        purge_batches = ceil(readings / settings.OCCUPANCY_PURGE_BATCH_SIZE)
+        self.assert_query_budget(
+            2 + 2 * hours + summary_batches + 2 + 2 * purge_batches + 1, aggregate_occupancy_and_delete_old_records
+        )
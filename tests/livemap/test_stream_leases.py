@@ -0,0 +1,137 @@
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import UTC, datetime, timedelta
+from threading import Barrier
+from unittest.mock import patch
+
+from django.db import OperationalError, connection
+from django.test import TestCase, TransactionTestCase
+
+from livemap.assignment import pack_parking_lots, shed_parking_lots
+from livemap.models import StreamWorker, VideoStreamSource
+from tests import TestCaseWithData, create_parking_lots, create_video_stream_sources
+
+WORKERS = 16
+STREAMS_PER_WORKER = 5
+
+
+class StreamClaimTest(TestCaseWithData, TestCase):
+    def test_claim(self) -> None:
+        in_use_until = datetime.now(UTC) + timedelta(minutes=5)
+        streams = VideoStreamSource.objects.filter(is_active=True)
+        claimed_ids = streams.claim(in_use_until, limit=1)
+        self.assertListEqual(claimed_ids, [self.small_parking_lot.pk])
+        self.assertListEqual(streams.claim(in_use_until, limit=10), [self.big_parking_lot.pk])
+        self.assertListEqual(streams.claim(in_use_until, limit=10), [])
+
+        # Expired reservations can be claimed again.
+        VideoStreamSource.objects.update(in_use_until=datetime.now(UTC) - timedelta(seconds=1))
+        self.assertListEqual(
+            streams.claim(in_use_until, limit=10, lease_owner="worker"),
+            [self.small_parking_lot.pk, self.big_parking_lot.pk],
+        )
+        self.assertEqual(VideoStreamSource.objects.filter(lease_owner="worker").count(), 2)
+
+
+class StreamAssignmentTest(TestCaseWithData, TestCase):
+    def test_pack_parking_lots(self) -> None:
+        # (id, parking_lot_id, processing_rate): the parking lots need 0.4, 0.1 and 1/180 frames per second.
+        streams = [(1, 1, 5), (2, 1, 5), (3, 2, 10), (4, 3, 180)]
+        self.assertListEqual(pack_parking_lots(streams, budget=0.15, limit=10), [3, 4])
+        self.assertListEqual(pack_parking_lots(streams, budget=0.5, limit=2), [1, 2])
+        self.assertListEqual(pack_parking_lots(streams, budget=0.001, limit=10), [])
+        self.assertListEqual(pack_parking_lots(streams, budget=0.001, limit=10, allow_overflow=True), [4])
+        self.assertListEqual(shed_parking_lots(streams, excess=0.2), [3, 4])
+        self.assertListEqual(shed_parking_lots(streams, excess=0.001), [])
+
+    def test_capacity_claim_and_rebalance(self) -> None:
+        VideoStreamSource.objects.all().delete()
+        # Every parking lot needs 0.2 frames per second.
+        create_video_stream_sources(create_parking_lots(self.address, 4), per_lot=2, processing_rate=10)
+        streams = VideoStreamSource.objects.filter(is_active=True)
+        in_use_until = datetime.now(UTC) + timedelta(minutes=5)
+
+        first_worker_ids = streams.claim(in_use_until, limit=100, lease_owner="first", capacity=0.5)
+        self.assertEqual(len(first_worker_ids), 4)
+        self.assertEqual(len({stream.parking_lot_id for stream in streams.filter(id__in=first_worker_ids)}), 2)
+        self.assertListEqual(streams.claim(in_use_until, limit=100, lease_owner="first", capacity=0.5), [])
+        self.assertEqual(len(streams.claim(in_use_until, limit=100, lease_owner="second", capacity=1)), 4)
+
+        # A new worker joins when all the streams are taken.
+        self.assertListEqual(streams.claim(in_use_until, limit=100, lease_owner="third", capacity=0.5), [])
+        self.assertEqual(StreamWorker.objects.active().count(), 3)
+
+        # The first worker holds twice its fair share and gives one parking lot away.
+        released_ids = streams.rebalance("first", 0.5, in_use_until)
+        self.assertEqual(len(released_ids), 2)
+        self.assertListEqual(streams.rebalance("second", 1, in_use_until), [])
+        self.assertListEqual(streams.claim(in_use_until, limit=100, lease_owner="third", capacity=0.5), released_ids)
+        self.assertAlmostEqual(streams.held_by("first").load(), 0.2)
+
+    def test_capacity_claim_registration(self) -> None:
+        streams = VideoStreamSource.objects.filter(is_active=True)
+        in_use_until = datetime.now(UTC) + timedelta(minutes=5)
+        with self.assertRaises(ValueError):
+            streams.claim(in_use_until, limit=10, capacity=1)
+
+        # The worker is only registered along with the streams it reserves.
+        with (
+            patch("livemap.models.pack_parking_lots", side_effect=OperationalError),
+            self.assertRaises(OperationalError),
+        ):
+            streams.claim(in_use_until, limit=10, lease_owner="worker", capacity=1)
+        self.assertFalse(StreamWorker.objects.exists())
+        self.assertFalse(streams.held_by("worker").exists())
+
+    def test_capacity_claim_window(self) -> None:
+        VideoStreamSource.objects.all().delete()
+        parking_lots = create_parking_lots(self.address, 3)
+        create_video_stream_sources(parking_lots, per_lot=3, processing_rate=10)
+        streams = VideoStreamSource.objects.filter(is_active=True)
+        in_use_until = datetime.now(UTC) + timedelta(minutes=5)
+
+        # The window of 8 streams ends in the middle of the third parking lot, which is left for a later claim.
+        with patch("livemap.models.CLAIM_PACKING_WINDOW", 1):
+            claimed_ids = streams.claim(in_use_until, limit=8, lease_owner="worker", capacity=10)
+        self.assertEqual(len(claimed_ids), 6)
+        self.assertSetEqual(
+            set(streams.filter(id__in=claimed_ids).values_list("parking_lot_id", flat=True)),
+            {parking_lots[0].pk, parking_lots[1].pk},
+        )
+
+
+class ConcurrentStreamClaimTest(TestCaseWithData, TransactionTestCase):
+    """Many workers claim streams at the same moment, each stream must be given to a single worker."""
+
+    def test_no_double_assignment(self) -> None:
+        parking_lots = create_parking_lots(self.address, WORKERS * STREAMS_PER_WORKER // 2)
+        create_video_stream_sources(parking_lots, per_lot=2)
+        free_streams = VideoStreamSource.objects.filter(is_active=True).not_in_use()
+        free_stream_ids = set(free_streams.values_list("id", flat=True))
+        in_use_until = datetime.now(UTC) + timedelta(minutes=5)
+        barrier = Barrier(WORKERS)
+
+        def worker(number: int) -> list[int]:
+            barrier.wait()
+            try:
+                while True:
+                    try:
+                        return free_streams.claim(
+                            in_use_until, limit=STREAMS_PER_WORKER, lease_owner=f"worker-{number}"
+                        )
+                    except OperationalError:
+                        # The in-memory test database does not wait for locks, a real worker would poll again.
+                        continue
+            finally:
+                connection.close()
+
+        claimed_ids: Counter[int] = Counter()
+        # Claiming rounds continue until all the streams are given away, as workers would keep polling.
+        while set(claimed_ids) != free_stream_ids:
+            with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+                for worker_claimed_ids in executor.map(worker, range(WORKERS)):
+                    claimed_ids.update(worker_claimed_ids)
+            self.assertEqual(max(claimed_ids.values()), 1, msg="Some streams were claimed twice")
+
+        for stream in VideoStreamSource.objects.filter(id__in=free_stream_ids):
+            self.assertTrue(stream.lease_owner.startswith("worker-"))
@@ -1,9 +1,10 @@
-from datetime import UTC, datetime
+from datetime import UTC, datetime, timedelta
 
-from django.test import TestCase
+from django.conf import settings
+from django.test import TestCase, override_settings
 
-from livemap.models import HourlyOccupancySummary, Occupancy
-from livemap.tasks import aggregate_occupancy_and_delete_old_records
+from livemap.models import AggregationWatermark, CurrentOccupancy, HourlyOccupancySummary, Occupancy
+from livemap.tasks import HOURLY_OCCUPANCY_WATERMARK, aggregate_occupancy_and_delete_old_records, purge_occupancy
 from tests import TestCaseWithData, fake
 
 
@@ -36,8 +37,122 @@ class CeleryTasksTest(TestCaseWithData, TestCase):
         aggregations = HourlyOccupancySummary.objects.all()
         self.assertEqual(len(aggregations), self.aggregated_records)
         self.assertSetEqual(self.avg_occupied_spots, {aggregation.avg_occupied_spots for aggregation in aggregations})
-        self.assertEqual(Occupancy.objects.count(), len(self.parking_lots))
+        self.assertEqual(Occupancy.objects.count(), 0)
+        self.assertEqual(CurrentOccupancy.objects.count(), len(self.parking_lots))
 
         # Make sure there are no duplicate records in the table after a second aggregation.
         aggregate_occupancy_and_delete_old_records()
         self.assertEqual(HourlyOccupancySummary.objects.count(), len(aggregations))
+
+    @override_settings(OCCUPANCY_RETENTION_HOURS=0)
+    def test_open_hour_is_not_aggregated(self) -> None:
+        aggregate_occupancy_and_delete_old_records()
+        watermark = AggregationWatermark.objects.get(name=HOURLY_OCCUPANCY_WATERMARK).timestamp
+        self.assertLessEqual(datetime.now(UTC) - watermark, timedelta(hours=1))
+
+        # Readings of the hour in progress stay in place and do not produce a summary.
+        summaries_count = HourlyOccupancySummary.objects.count()
+        Occupancy.objects.create(parking_lot=self.parking_lot, occupied_spots=fake.pyint())
+        aggregate_occupancy_and_delete_old_records()
+        self.assertEqual(Occupancy.objects.count(), 1)
+        self.assertEqual(HourlyOccupancySummary.objects.count(), summaries_count)
+
+        # Once the hour is closed, only the readings after the watermark are aggregated.
+        AggregationWatermark.objects.filter(name=HOURLY_OCCUPANCY_WATERMARK).update(
+            timestamp=watermark - timedelta(hours=1)
+        )
+        occupancy = Occupancy.objects.create(
+            parking_lot=self.parking_lot, occupied_spots=fake.pyint(), timestamp=watermark - timedelta(minutes=1)
+        )
+        aggregate_occupancy_and_delete_old_records()
+        self.assertEqual(Occupancy.objects.count(), 1)
+        summary = HourlyOccupancySummary.objects.get(
+            parking_lot=self.parking_lot, date=occupancy.timestamp.date(), hour=occupancy.timestamp.hour
+        )
+        self.assertEqual(summary.avg_occupied_spots, occupancy.occupied_spots)
+        self.assertEqual(HourlyOccupancySummary.objects.count(), summaries_count + 1)
+
+    def test_retention(self) -> None:
+        recent_occupancy = Occupancy.objects.create(
+            parking_lot=self.parking_lot,
+            occupied_spots=fake.pyint(),
+            timestamp=datetime.now(UTC).replace(minute=0, second=0, microsecond=0) - timedelta(minutes=1),
+        )
+        aggregate_occupancy_and_delete_old_records()
+        # The aggregated record is kept until it is older than the retention period.
+        self.assertListEqual(list(Occupancy.objects.values_list("id", flat=True)), [recent_occupancy.pk])
+
+    def test_late_readings(self) -> None:
+        hour = datetime.now(UTC).replace(minute=0, second=0, microsecond=0) - timedelta(hours=2)
+        Occupancy.objects.create(parking_lot=self.parking_lot, occupied_spots=10, timestamp=hour)
+        aggregate_occupancy_and_delete_old_records()
+        watermark = AggregationWatermark.objects.get(name=HOURLY_OCCUPANCY_WATERMARK).timestamp
+        self.assertGreater(watermark, hour)
+
+        # A reading that arrives after its hour was aggregated reopens the hour.
+        Occupancy.objects.ingest(
+            [Occupancy(parking_lot=self.parking_lot, occupied_spots=30, timestamp=hour + timedelta(minutes=30))]
+        )
+        self.assertEqual(AggregationWatermark.objects.get(name=HOURLY_OCCUPANCY_WATERMARK).timestamp, hour)
+        aggregate_occupancy_and_delete_old_records()
+        summary = HourlyOccupancySummary.objects.get(parking_lot=self.parking_lot, date=hour.date(), hour=hour.hour)
+        self.assertEqual(summary.avg_occupied_spots, 20)
+        self.assertEqual(AggregationWatermark.objects.get(name=HOURLY_OCCUPANCY_WATERMARK).timestamp, watermark)
+
+        # The records of an hour older than the retention may be purged, so it cannot be aggregated again.
+        with self.assertLogs("livemap.models", level="WARNING"):
+            Occupancy.objects.ingest(
+                [Occupancy(parking_lot=self.parking_lot, timestamp=datetime(2025, 1, 1, tzinfo=UTC))]
+            )
+        self.assertEqual(AggregationWatermark.objects.get(name=HOURLY_OCCUPANCY_WATERMARK).timestamp, watermark)
+
+    def test_purge_occupancy(self) -> None:
+        cutoff = datetime(year=2025, month=1, day=2, tzinfo=UTC)
+        old_records = Occupancy.objects.filter(timestamp__lt=cutoff)
+        old_records_count = old_records.count()
+        batch_size = 4
+        metrics = purge_occupancy(cutoff, batch_size=batch_size)
+        self.assertEqual(metrics["deleted"], old_records_count)
+        self.assertEqual(metrics["batches"], -(-old_records_count // batch_size))
+        self.assertFalse(old_records.exists())
+        self.assertEqual(Occupancy.objects.count(), self.aggregated_records * 3 - old_records_count)
+
+
+class ChangesOnlyAggregationTest(TestCaseWithData, TestCase):
+    def aggregate(self, readings: list[Occupancy]) -> dict[int, int]:
+        Occupancy.objects.all().delete()
+        HourlyOccupancySummary.objects.all().delete()
+        AggregationWatermark.objects.all().delete()
+        Occupancy.objects.ingest(readings)
+        aggregate_occupancy_and_delete_old_records()
+        return dict(HourlyOccupancySummary.objects.values_list("hour", "avg_occupied_spots"))
+
+    def test_same_summaries(self) -> None:
+        start = datetime(year=2025, month=1, day=1, hour=1, tzinfo=UTC)
+        occupied_spots = 0
+        readings = []
+        # Readings every minute, which mostly repeat the previous one.
+        for minute in range(3 * 60):
+            if fake.pyint(max_value=9) == 0:
+                occupied_spots = fake.pyint(max_value=100)
+            readings.append(
+                Occupancy(
+                    parking_lot=self.parking_lot,
+                    occupied_spots=occupied_spots,
+                    timestamp=start + timedelta(minutes=minute),
+                )
+            )
+        summaries = self.aggregate(readings)
+        # The plain averages of the regular readings.
+        self.assertDictEqual(
+            summaries,
+            {
+                hour: round(sum(reading.occupied_spots for reading in readings[index * 60 : (index + 1) * 60]) / 60)
+                for index, hour in enumerate(range(1, 4))
+            },
+        )
+
+        with override_settings(OCCUPANCY_CHANGES_ONLY=True):
+            changes = Occupancy.objects.changes(readings, timedelta(seconds=settings.OCCUPANCY_KEEPALIVE_SECONDS))
+            self.assertLess(len(changes), len(readings) / 3)
+            self.assertDictEqual(self.aggregate(readings), summaries)
@@ -0,0 +1,147 @@
+from datetime import UTC, datetime, timedelta
+from unittest.mock import MagicMock, patch
+
+from django.core.cache import cache
+from django.db import connection
+from django.http import HttpResponse
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+
+from livemap.models import Occupancy, ParkingLot
+from livemap.tasks import purge_occupancy
+from livemap.versions import bump_model_versions, model_versions
+from tests import TestCaseWithData
+from tests.livemap.test_api_endpoints import ExtendedTestCaseWithData
+
+STREAMS_PATH = "/api/video-stream-sources/"
+OCCUPANCY_PATH = "/api/occupancy/"
+
+
+class ModelVersionsTest(TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        cache.clear()
+
+    def test_bump_model_versions(self) -> None:
+        versions = model_versions([ParkingLot, Occupancy])
+        self.assertListEqual(model_versions([ParkingLot, Occupancy]), versions)
+        with self.captureOnCommitCallbacks(execute=True):
+            bump_model_versions(Occupancy)
+            # Not before the change is committed.
+            self.assertListEqual(model_versions([ParkingLot, Occupancy]), versions)
+        parking_lot_version, occupancy_version = model_versions([ParkingLot, Occupancy])
+        self.assertEqual(parking_lot_version, versions[0])
+        self.assertGreater(occupancy_version, versions[1])
+
+
+class ConditionalGetTest(ExtendedTestCaseWithData):
+    def setUp(self) -> None:
+        super().setUp()
+        cache.clear()
+
+    def get(self, path: str, etag: str | None = None, **query_params: object) -> HttpResponse:
+        headers = self.default_kwargs["headers"] | ({"If-None-Match": etag} if etag else {})
+        return self.client.get(path, query_params=query_params, headers=headers)
+
+    def assert_not_modified(self, path: str, etag: str, **query_params: object) -> None:
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get(path, etag, **query_params)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        # Only the user is authenticated.
+        self.assertFalse([query for query in queries.captured_queries if "livemap_" in query["sql"]])
+
+    def test_video_stream_sources(self) -> None:
+        response = self.get(STREAMS_PATH)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response.headers["ETag"]
+        self.assertIn("Last-Modified", response.headers)
+        self.assert_not_modified(STREAMS_PATH, etag)
+        # Other pages and filters are tagged on their own.
+        self.assertEqual(self.get(STREAMS_PATH, etag, active_only=True).status_code, status.HTTP_200_OK)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.small_parking_lot.save()
+        response = self.get(STREAMS_PATH, etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response.headers["ETag"]
+
+        # Reserving streams is never answered from the client's cache.
+        in_use_until = (datetime.now(UTC) + timedelta(minutes=5)).isoformat()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.get(STREAMS_PATH, etag, mark_in_use_until=in_use_until)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn("ETag", response.headers)
+        # The reservations are listed.
+        self.assertEqual(self.get(STREAMS_PATH, etag).status_code, status.HTTP_200_OK)
+
+    def test_parking_lot_changes(self) -> None:
+        etag = self.get(STREAMS_PATH).headers["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.address.save()
+        self.assertEqual(self.get(STREAMS_PATH, etag).status_code, status.HTTP_200_OK)
+
+    def test_if_modified_since(self) -> None:
+        last_modified = self.get(STREAMS_PATH).headers["Last-Modified"]
+        headers = self.default_kwargs["headers"] | {"If-Modified-Since": last_modified}
+        response = self.client.get(STREAMS_PATH, headers=headers)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_occupancy(self) -> None:
+        etag = self.get(OCCUPANCY_PATH).headers["ETag"]
+        current_etag = self.get(f"{OCCUPANCY_PATH}current/").headers["ETag"]
+        self.assert_not_modified(OCCUPANCY_PATH, etag)
+        self.assert_not_modified(f"{OCCUPANCY_PATH}current/", current_etag)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                f"{OCCUPANCY_PATH}bulk/",
+                data=[{"parking_lot_id": self.parking_lot.pk, "occupied_spots": 1}],
+                **self.default_kwargs,
+            )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.get(OCCUPANCY_PATH, etag).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.get(f"{OCCUPANCY_PATH}current/", current_etag).status_code, status.HTTP_200_OK)
+
+    def test_occupancy_deletes(self) -> None:
+        etag = self.get(OCCUPANCY_PATH).headers["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            purge_occupancy(datetime.now(UTC) + timedelta(hours=1), batch_size=100)
+        self.assertFalse(Occupancy.objects.exists())
+        self.assertEqual(self.get(OCCUPANCY_PATH, etag).status_code, status.HTTP_200_OK)
+
+        occupancy = Occupancy.objects.create(parking_lot=self.parking_lot, occupied_spots=1)
+        etag = self.get(OCCUPANCY_PATH).headers["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete(f"{OCCUPANCY_PATH}{occupancy.pk}/", **self.default_kwargs)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.get(OCCUPANCY_PATH, etag).status_code, status.HTTP_200_OK)
+
+        # Records deleted along with their parking lot.
+        Occupancy.objects.create(parking_lot=self.another_parking_lot, occupied_spots=1)
+        etag = self.get(OCCUPANCY_PATH).headers["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.another_parking_lot.delete()
+        self.assertEqual(self.get(OCCUPANCY_PATH, etag).status_code, status.HTTP_200_OK)
+
+
+class IndexConditionalGetTest(TestCaseWithData, TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        cache.clear()
+
+    @patch("livemap.views.geolocate", return_value=None)
+    def test_index(self, geolocate: MagicMock) -> None:
+        etag = self.client.get("/livemap/").headers["ETag"]
+        self.assertEqual(
+            self.client.get("/livemap/", headers={"If-None-Match": etag}).status_code, status.HTTP_304_NOT_MODIFIED
+        )
+
+        # The map is centred on another location.
+        geolocate.return_value = (50.45, 30.52)
+        self.assertEqual(self.client.get("/livemap/", headers={"If-None-Match": etag}).status_code, status.HTTP_200_OK)
+
+        geolocate.return_value = None
+        with self.captureOnCommitCallbacks(execute=True):
+            self.parking_lot.save()
+        self.assertEqual(self.client.get("/livemap/", headers={"If-None-Match": etag}).status_code, status.HTTP_200_OK)
@@ -1,12 +1,15 @@
 from http import HTTPStatus
 from io import StringIO
 
+from django.core.cache import cache
 from django.core.handlers.wsgi import WSGIRequest
 from django.test import TestCase
 from django.urls import reverse
-from parameterized import parameterized
+from django.utils.html import escape
 
-from livemap.views import _compose_html_table, _extract_client_ip_address, _fetch_geolocation
+from livemap.markers import cached_popups, compose_popup
+from livemap.models import CurrentOccupancy, Occupancy
+from livemap.views import _extract_client_ip_address
 from tests import TestCaseWithData, fake
 
 
@@ -20,19 +23,19 @@ class HelperFunctionsTest(TestCase):
         ip_by_http_x_forwarded = _extract_client_ip_address(WSGIRequest(meta | {"HTTP_X_FORWARDED_FOR": fake_ip}))  # pyright: ignore[reportCallIssue]
         self.assertEqual(ip_by_http_x_forwarded, fake_ip)
 
-    @parameterized.expand([(fake.pystr(), type(None)), (fake.ipv4(), tuple)])
-    def test__fetch_geolocation(self, ip_address: str, return_type: type[None] | tuple) -> None:
-        self.assertIsInstance(_fetch_geolocation(ip_address), return_type)
-
 
 class ViewsTest(TestCaseWithData, TestCase):
-    def test__compose_html_table(self) -> None:
-        html_table = _compose_html_table(self.parking_lot)
+    def setUp(self) -> None:
+        super().setUp()
+        cache.clear()
+
+    def test_compose_popup(self) -> None:
+        html_table = compose_popup(self.parking_lot)
         for field in ("Address", "Private", "Free", "Total spots", "Spots for disables", "Free spots"):
             self.assertIn(field, html_table)
         self.assertIn(
             "<a href='https://www.google.com/maps/search/?api=1&query="
-            f"{self.parking_lot.latitude},{self.parking_lot.longitude}'>{self.parking_lot.address}</a>",
+            f"{self.parking_lot.latitude},{self.parking_lot.longitude}'>{escape(self.parking_lot.address)}</a>",
             html_table,
         )
         for stream_source in self.parking_lot.stream_sources.filter(parking_lot_id=self.parking_lot.pk):  # pyright: ignore[reportAttributeAccessIssue]
@@ -41,3 +44,27 @@ class ViewsTest(TestCaseWithData, TestCase):
     def test_index(self) -> None:
         response = self.client.get(reverse("livemap:index"))
         self.assertEqual(response.status_code, HTTPStatus.OK)
+
+    def test_cached_popups(self) -> None:
+        parking_lot_ids = [self.parking_lot.pk, self.another_parking_lot.pk]
+        popups = cached_popups(parking_lot_ids)
+        self.assertListEqual(list(popups), parking_lot_ids)
+        with self.assertNumQueries(0):
+            self.assertDictEqual(cached_popups(parking_lot_ids), popups)
+
+        # Only the popup of the changed parking lot is rendered again.
+        with self.captureOnCommitCallbacks(execute=True):
+            occupancy = Occupancy.objects.create(parking_lot=self.another_parking_lot, occupied_spots=0)
+            CurrentOccupancy.objects.refresh_from([occupancy])
+        with self.assertNumQueries(2):
+            changed_popups = cached_popups(parking_lot_ids)
+        self.assertEqual(changed_popups[self.parking_lot.pk], popups[self.parking_lot.pk])
+        self.assertIn(
+            f"<span class='free-spots'>{self.another_parking_lot.total_spots}</span>",
+            changed_popups[self.another_parking_lot.pk],
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.city.city_name = fake.pystr()
+            self.city.save()
+        self.assertIn(self.city.city_name, cached_popups([self.parking_lot.pk])[self.parking_lot.pk])